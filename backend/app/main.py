@@ -1,14 +1,29 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import time
+_process_started = time.perf_counter()
+
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List, Tuple
+import asyncio
+import json
+import os
+import sqlite3
+import threading
 import uvicorn
 
 # Standard relative imports for package structure
 from .resolvers.barcode_resolver import resolve_by_barcode
-from .resolvers.image_resolver import resolve_by_image
-from .models.schemas import ProductResponse, UserProfile, PersonalizedProductResponse
+from .resolvers.image_resolver import extract_identifiers, extract_text, scan_frame, resolve_identifiers, warm_up_backends, get_capabilities
+from .models.schemas import ProductResponse, UserProfile, PersonalizedProductResponse, RecommendationsResponse
 from .utils.personalization import get_personalization_engine
 from .utils.history import save_scan, get_history
+from .utils.http_client import close_http_session
+from .utils.metrics import get_metrics, register_gauge, increment
+from .utils.image_cache import get_image_cache
+from .utils.image_pool import get_image_pool, shutdown_image_pool, ImagePoolBusy, ImageJobTimeout, ClientDisconnected, ImageWorkerCrashed
+from .utils.recommendation_jobs import get_recommendation_jobs, shutdown_recommendation_jobs, job_status
 
 # Load environment variables
 from dotenv import load_dotenv
@@ -26,12 +41,40 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Startup timings (seconds), reported by /ready and /metrics
+startup_timings = {}
+register_gauge("startup", lambda: startup_timings)
+
 # Initialize personalization engine at startup
 @app.on_event("startup")
 async def startup_event():
     print("🚀 Starting AI Food Quality Analyzer API...")
+    startup_timings['imports_seconds'] = round(time.perf_counter() - _process_started, 3)
+
     # This will load the ML model
+    started = time.perf_counter()
     get_personalization_engine()
+    startup_timings['personalization_engine_seconds'] = round(time.perf_counter() - started, 3)
+
+    # Image backends (pyzbar, EasyOCR) load lazily; optionally warm them in the
+    # background so the first image scan doesn't pay for the OCR model load.
+    # With the process pool enabled they live in the worker processes.
+    if os.getenv("IMAGE_BACKENDS_WARMUP", "1") == "1":
+        image_pool = get_image_pool()
+        if image_pool.max_workers > 0:
+            image_pool.start()
+        else:
+            threading.Thread(target=warm_up_backends, name="image-backend-warmup", daemon=True).start()
+
+    startup_timings['startup_seconds'] = round(time.perf_counter() - _process_started, 3)
+    print(f"✅ Ready to serve in {startup_timings['startup_seconds']:.2f}s")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Release pooled keep-alive connections to upstream APIs
+    close_http_session()
+    shutdown_image_pool()
+    shutdown_recommendation_jobs()
 
 class BarcodeRequest(BaseModel):
     barcode: str
@@ -40,6 +83,11 @@ class PersonalizedBarcodeRequest(BaseModel):
     barcode: str
     user_profile: UserProfile
 
+class BatchBarcodeRequest(BaseModel):
+    barcodes: List[str]
+    user_profile: UserProfile = UserProfile()
+    include_recommendations: bool = False
+
 @app.get("/")
 def read_root():
     return {"message": "AI Food Quality Analyzer API - Now with ML Personalization!", "version": "0.2.0"}
@@ -53,46 +101,165 @@ def scan_barcode_endpoint(request: BarcodeRequest):
         return result
     raise HTTPException(status_code=404, detail="Product not found")
 
+async def run_image_job(fn, contents: bytes, request: Request) -> dict:
+    """Run an image_resolver extraction step in the worker pool, mapping pool errors to HTTP errors."""
+    try:
+        return await get_image_pool().run(fn, contents, request=request)
+    except ImagePoolBusy:
+        raise HTTPException(status_code=503, detail="Image processing queue is full, please retry")
+    except ImageJobTimeout:
+        raise HTTPException(status_code=504, detail="Image processing timed out")
+    except ClientDisconnected:
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    except ImageWorkerCrashed:
+        raise HTTPException(status_code=503, detail="Image worker crashed, please retry")
+
+async def resolve_image_upload(contents: bytes, request: Request) -> Optional[ProductResponse]:
+    """
+    Decode/OCR the upload in the image worker pool (off the event loop),
+    then resolve the product in the thread pool. Re-uploads of the same (or
+    a nearly identical) photo are answered from the image scan cache.
+    """
+    cache = get_image_cache()
+    if cache is not None:
+        cached, digest, phash = await run_in_threadpool(cache.lookup, contents)
+        if cached is not None:
+            print("💾 Image cache hit")
+            return cached
+
+    identifiers = await run_image_job(extract_identifiers, contents, request)
+    product = await run_in_threadpool(resolve_identifiers, identifiers)
+    if cache is not None and product is not None:
+        cache.put(digest, phash, product)
+    return product
+
 @app.post("/scan/image", response_model=ProductResponse)
-async def scan_image_endpoint(file: UploadFile = File(...)):
+async def scan_image_endpoint(request: Request, file: UploadFile = File(...)):
     contents = await file.read()
-    result = resolve_by_image(contents)
+    result = await resolve_image_upload(contents, request)
+    if result:
+        return result
+    raise HTTPException(status_code=404, detail="Product not found or could not be identified from image")
+
+@app.post("/scan/image/burst", response_model=ProductResponse)
+async def scan_image_burst_endpoint(request: Request, files: List[UploadFile] = File(...)):
+    """
+    Scan a burst of frames from one capture.
+
+    Frames are barcode-scanned in parallel (at most one per image worker at a
+    time) and scanning stops at the first frame that decodes. If none does,
+    OCR runs once, on the sharpest frame. A frame the pool rejects, times
+    out on or loses to a worker crash counts as a frame without a barcode;
+    the request only fails if no frame could be scanned at all.
+    """
+    max_frames = int(os.getenv("BURST_MAX_FRAMES", "8"))
+    if len(files) > max_frames:
+        raise HTTPException(status_code=413, detail=f"At most {max_frames} frames per burst")
+    frames = [await f.read() for f in files]
+
+    parallel = max(1, get_image_pool().max_workers)
+    queued = list(enumerate(frames))
+    running = {}
+    sharpness = {}
+    frame_errors = []
+    barcode = None
+    try:
+        while (queued or running) and barcode is None:
+            while queued and len(running) < parallel:
+                index, frame = queued.pop(0)
+                running[asyncio.ensure_future(get_image_pool().run(scan_frame, frame, request=request))] = index
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = running.pop(task)
+                try:
+                    result = task.result()
+                except (ImagePoolBusy, ImageJobTimeout, ImageWorkerCrashed) as e:
+                    increment("burst.frames_failed")
+                    frame_errors.append(e)
+                    continue
+                except ClientDisconnected:
+                    raise HTTPException(status_code=499, detail="Client disconnected")
+                increment("burst.frames_scanned")
+                sharpness[index] = result['sharpness']
+                if result['barcode'] and barcode is None:
+                    barcode = result['barcode']
+    finally:
+        for task in running:
+            task.cancel()
+
+    if barcode is not None:
+        skipped = len(queued) + len(running)
+        if skipped:
+            increment("burst.frames_skipped", skipped)
+        print(f"📸 Burst decoded after {len(sharpness)}/{len(frames)} frames")
+        identifiers = {'barcode': barcode, 'ocr_text': None}
+    elif not sharpness:
+        # Every frame failed in the pool
+        if all(isinstance(e, ImageJobTimeout) for e in frame_errors):
+            raise HTTPException(status_code=504, detail="Image processing timed out")
+        raise HTTPException(status_code=503, detail="Image processing queue is full, please retry")
+    else:
+        increment("burst.ocr_fallbacks")
+        sharpest = max(sharpness, key=sharpness.get)
+        identifiers = await run_image_job(extract_text, frames[sharpest], request)
+
+    result = await run_in_threadpool(resolve_identifiers, identifiers)
     if result:
         return result
     raise HTTPException(status_code=404, detail="Product not found or could not be identified from image")
 
 # --- NEW: PERSONALIZED ENDPOINTS (With ML-Powered Scoring) ---
 
-@app.post("/scan/barcode/personalized", response_model=PersonalizedProductResponse)
-def scan_barcode_personalized_endpoint(request: PersonalizedBarcodeRequest):
+def product_to_model_dict(product: ProductResponse) -> dict:
+    """Product dict in the form the personalization engine reads."""
+    product_dict = product.dict()
+    # Add nutrition fields to top level for easier access
+    product_dict.update(product_dict.get('nutrition', {}))
+    return product_dict
+
+def personalize_product(product: ProductResponse, user_profile: UserProfile, include_recommendations: bool = True,
+                        defer_recommendations: bool = False,
+                        scored: Optional[Tuple[float, List[str], List[str]]] = None) -> PersonalizedProductResponse:
     """
-    Scan a barcode and get personalized suitability score based on user's health profile.
+    Score a resolved product for a user and attach recommendations and additive details.
+
+    With defer_recommendations, recommendations are computed in the
+    background instead: the response carries a scan_id to fetch them with,
+    unless an identical earlier scan already has them ready. `scored` is an
+    already computed (score, reasons, warnings), e.g. from predict_many.
     """
-    # Get base product data
-    product = resolve_by_barcode(request.barcode)
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
     # Get personalization engine
     engine = get_personalization_engine()
     
     # Convert product to dict for the model
-    product_dict = product.dict()
-    # Add nutrition fields to top level for easier access
-    product_dict.update(product_dict.get('nutrition', {}))
+    product_dict = product_to_model_dict(product)
     
     # Get personalized score
-    score, reasons, warnings = engine.predict(
-        product_data=product_dict,
-        user_profile=request.user_profile.dict()
-    )
+    if scored is None:
+        scored = engine.predict(
+            product_data=product_dict,
+            user_profile=user_profile.dict()
+        )
+    score, reasons, warnings = scored
     
     # Get recommendations
-    recommendations = engine.get_recommendations(
-        current_product_data=product_dict,
-        current_score=score,
-        user_profile=request.user_profile.dict()
-    )
+    recommendations = []
+    scan_id = None
+    pending = False
+    if include_recommendations and defer_recommendations:
+        scan_id, job = get_recommendation_jobs().submit(
+            engine.recommendation_key(product_dict, user_profile.dict()),
+            engine.get_recommendations, product_dict, score, user_profile.dict()
+        )
+        status = job_status(scan_id, job)
+        recommendations = status['recommendations']
+        pending = status['status'] == 'pending'
+    elif include_recommendations:
+        recommendations = engine.get_recommendations(
+            current_product_data=product_dict,
+            current_score=score,
+            user_profile=user_profile.dict()
+        )
     
     # Get additive details
     additive_details = engine.get_additive_details(product.additives)
@@ -104,11 +271,126 @@ def scan_barcode_personalized_endpoint(request: PersonalizedBarcodeRequest):
         reasons=reasons,
         warnings=warnings,
         recommendations=recommendations,
-        additive_details=additive_details
+        additive_details=additive_details,
+        scan_id=scan_id,
+        recommendations_pending=pending
     )
 
+def record_scan(result: PersonalizedProductResponse, user_profile: UserProfile):
+    """Append a personalized scan to the history store; runs after the response is sent."""
+    try:
+        save_scan(user_profile.dict(), result.dict(), result.suitability_score)
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not record scan {result.product_id}: {e}")
+
+def recommendations_async() -> bool:
+    """Whether the personalized scan endpoints defer recommendations (RECOMMENDATIONS_ASYNC)."""
+    return os.getenv("RECOMMENDATIONS_ASYNC", "1") == "1"
+
+@app.post("/scan/barcode/personalized", response_model=PersonalizedProductResponse)
+def scan_barcode_personalized_endpoint(request: PersonalizedBarcodeRequest, background_tasks: BackgroundTasks):
+    """
+    Scan a barcode and get personalized suitability score based on user's health profile.
+    """
+    # Get base product data
+    product = resolve_by_barcode(request.barcode)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    result = personalize_product(product, request.user_profile, defer_recommendations=recommendations_async())
+    background_tasks.add_task(record_scan, result, request.user_profile)
+    return result
+
+@app.post("/scan/barcode/batch")
+async def scan_barcode_batch_endpoint(request: BatchBarcodeRequest):
+    """
+    Score a whole basket/shelf of barcodes for one user profile.
+
+    Barcodes are resolved concurrently (at most BATCH_CONCURRENCY at a time)
+    and results are streamed back as newline-delimited JSON in completion
+    order, one line per barcode:
+        {"index": 0, "barcode": "...", "status": "ok", "result": {...}}
+        {"index": 1, "barcode": "...", "status": "not_found"}
+        {"index": 2, "barcode": "...", "status": "error", "error": "..."}
+    Resolved products are scored together: each scoring pass waits
+    BATCH_SCORE_WINDOW seconds for more products to finish resolving, then
+    scores everything waiting with one model call.
+    Recommendations are skipped unless include_recommendations is true.
+    """
+    max_barcodes = int(os.getenv("BATCH_MAX_BARCODES", "200"))
+    if not request.barcodes:
+        raise HTTPException(status_code=400, detail="barcodes must not be empty")
+    if len(request.barcodes) > max_barcodes:
+        raise HTTPException(status_code=413, detail=f"At most {max_barcodes} barcodes per batch")
+
+    semaphore = asyncio.Semaphore(int(os.getenv("BATCH_CONCURRENCY", "8")))
+    engine = get_personalization_engine()
+    user_profile = request.user_profile.dict()
+    score_window = float(os.getenv("BATCH_SCORE_WINDOW", "0.05"))
+    waiting: List[Tuple[dict, asyncio.Future]] = []
+    scoring = False
+
+    async def _score_waiting():
+        nonlocal scoring
+        try:
+            while waiting:
+                await asyncio.sleep(score_window)
+                batch = waiting[:]
+                waiting.clear()
+                try:
+                    results = await run_in_threadpool(engine.predict_many, [p for p, _ in batch], user_profile)
+                except Exception as e:
+                    results = [e] * len(batch)
+                for (_, future), result in zip(batch, results):
+                    if future.done():
+                        continue  # item cancelled (client went away)
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        finally:
+            scoring = False
+
+    async def _score(product: ProductResponse) -> Tuple[float, List[str], List[str]]:
+        nonlocal scoring
+        future = asyncio.get_running_loop().create_future()
+        waiting.append((product_to_model_dict(product), future))
+        if not scoring:
+            scoring = True
+            asyncio.create_task(_score_waiting())
+        return await future
+
+    async def _scan_one(index: int, barcode: str) -> dict:
+        async with semaphore:
+            item = {'index': index, 'barcode': barcode}
+            try:
+                product = await run_in_threadpool(resolve_by_barcode, barcode)
+                if not product:
+                    return {**item, 'status': 'not_found'}
+                scored = await _score(product)
+                result = await run_in_threadpool(personalize_product, product, request.user_profile,
+                                                 request.include_recommendations, scored=scored)
+            except Exception as e:
+                print(f"❌ Batch item {barcode} failed: {e}")
+                return {**item, 'status': 'error', 'error': str(e)}
+            return {**item, 'status': 'ok', 'result': result.dict()}
+
+    async def _stream():
+        tasks = [asyncio.create_task(_scan_one(i, b)) for i, b in enumerate(request.barcodes)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            # Client went away — don't keep resolving the rest
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
 @app.post("/scan/image/personalized", response_model=PersonalizedProductResponse)
 async def scan_image_personalized_endpoint(
+    request: Request,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     user_profile: str = None  # JSON string of UserProfile
 ):
@@ -116,11 +398,9 @@ async def scan_image_personalized_endpoint(
     Scan an image and get personalized suitability score.
     Note: user_profile should be a JSON string due to multipart/form-data limitations.
     """
-    import json
-    
     # Get base product data
     contents = await file.read()
-    product = resolve_by_image(contents)
+    product = await resolve_image_upload(contents, request)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found or could not be identified from image")
     
@@ -135,43 +415,75 @@ async def scan_image_personalized_endpoint(
         # Default healthy user
         user_profile_obj = UserProfile()
     
-    # Get personalization engine
-    engine = get_personalization_engine()
-    
-    # Convert product to dict
-    product_dict = product.dict()
-    product_dict.update(product_dict.get('nutrition', {}))
-    
-    # Get personalized score
-    score, reasons, warnings = engine.predict(
-        product_data=product_dict,
-        user_profile=user_profile_obj.dict()
-    )
-    
-    # Get recommendations
-    recommendations = engine.get_recommendations(
-        current_product_data=product_dict,
-        current_score=score,
-        user_profile=user_profile_obj.dict()
-    )
-    
-    # Get additive details
-    additive_details = engine.get_additive_details(product.additives)
-    
-    # Create personalized response
-    return PersonalizedProductResponse(
-        **product.dict(),
-        suitability_score=score,
-        reasons=reasons,
-        warnings=warnings,
-        recommendations=recommendations,
-        additive_details=additive_details
-    )
+    result = await run_in_threadpool(personalize_product, product, user_profile_obj,
+                                     defer_recommendations=recommendations_async())
+    background_tasks.add_task(record_scan, result, user_profile_obj)
+    return result
+
+@app.get("/recommendations/{scan_id}", response_model=RecommendationsResponse)
+def get_scan_recommendations(scan_id: str):
+    """
+    Recommendations for a personalized scan, by the scan_id it returned.
+    Poll while status is 'pending', or use the /stream variant instead.
+    """
+    job = get_recommendation_jobs().get(scan_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired scan_id")
+    return job_status(scan_id, job)
+
+@app.get("/recommendations/{scan_id}/stream")
+async def stream_scan_recommendations(scan_id: str):
+    """
+    Server-sent events: one `recommendations` event (same body as
+    /recommendations/{scan_id}) once the job finishes, with keep-alive
+    comments while it runs. Gives up with a `timeout` event after
+    RECOMMENDATIONS_STREAM_TIMEOUT seconds.
+    """
+    job = get_recommendation_jobs().get(scan_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired scan_id")
+    deadline = time.monotonic() + float(os.getenv("RECOMMENDATIONS_STREAM_TIMEOUT", "60"))
+
+    async def _events():
+        # Wrapped once and never cancelled: the job is shared with other scans
+        waiter = asyncio.wrap_future(job)
+        while not waiter.done():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield f"event: timeout\ndata: {json.dumps({'scan_id': scan_id})}\n\n"
+                return
+            await asyncio.wait({waiter}, timeout=min(15.0, remaining))
+            if not waiter.done():
+                yield ": keep-alive\n\n"
+        if waiter.exception() is not None:
+            print(f"⚠️ Recommendations for scan {scan_id} failed: {waiter.exception()}")
+        body = RecommendationsResponse(**job_status(scan_id, job))
+        yield f"event: recommendations\ndata: {json.dumps(body.dict())}\n\n"
+
+    return StreamingResponse(_events(), media_type="text/event-stream", headers={'Cache-Control': 'no-cache'})
+
+@app.get("/ready")
+def readiness():
+    """
+    Readiness probe. Barcode endpoints are ready once startup finished;
+    image capabilities report whether barcode decoding and OCR are loaded yet.
+    """
+    return {
+        'ready': 'startup_seconds' in startup_timings,
+        'startup': startup_timings,
+        'capabilities': get_capabilities(),
+        'image_pool': get_image_pool().stats(),
+    }
+
+@app.get("/metrics")
+def get_service_metrics():
+    """Counters and gauges (cache hits, circuit breaker states, etc.)."""
+    return get_metrics()
 
 @app.get("/history")
-def get_user_history():
-    """Get scan history for the user."""
-    return get_history()
+def get_user_history(limit: int = 50):
+    """Get the most recent scans (oldest first)."""
+    return get_history(max(1, min(limit, 1000)))
 
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -26,6 +26,17 @@ class ProductResponse(BaseModel):
     traces_tags: List[str] = []
     categories_tags: List[str] = []
 
+class ProductRecord(ProductResponse):
+    """
+    Internal product record: a ProductResponse plus its user-independent
+    nutritional quality score, persisted with cached/stored records (see
+    personalization.attach_base_score) and recomputed when the rules change.
+    Endpoints declare ProductResponse, so these fields never reach clients.
+    """
+    base_score: Optional[float] = None
+    base_reasons: List[str] = []
+    base_score_version: Optional[str] = None
+
 class UserProfile(BaseModel):
     """User health profile for personalized recommendations"""
     # Medical Conditions
@@ -76,3 +87,14 @@ class PersonalizedProductResponse(ProductResponse):
     warnings: List[str] = []
     recommendations: List[AlternativeProduct] = []
     additive_details: List[AdditiveDetail] = []
+    # Set when recommendations are still being computed: fetch them from
+    # /recommendations/{scan_id} (or its /stream)
+    scan_id: Optional[str] = None
+    recommendations_pending: bool = False
+
+class RecommendationsResponse(BaseModel):
+    """Recommendations computed in the background for a personalized scan"""
+    scan_id: str
+    status: str  # 'pending', 'ready', 'error'
+    recommendations: List[AlternativeProduct] = []
+    error: Optional[str] = None
@@ -1,154 +1,277 @@
 import requests
 from ..models.schemas import ProductResponse, NutritionInfo
 from ..utils.normalizer import normalize_nutrition, normalize_ingredients, extract_additives
+from ..utils.ingredient_scanner import merge_ingredient_findings
+from ..utils.product_cache import get_product_cache
+from ..utils.product_store import get_product_store
+from ..utils.http_client import http_get
+from ..utils.hedging import MirrorScoreboard, hedged_request, HedgeCancelled, AllMirrorsFailed
+from ..utils.singleflight import SingleFlight
+from ..utils.circuit_breaker import get_breaker
+from ..utils.metrics import increment, register_gauge
+from ..utils.personalization import attach_base_score
+from urllib.parse import urlparse
 from typing import Optional, List, Dict
-import time
+import threading
+import os
 
 def resolve_by_barcode(barcode: str) -> Optional[ProductResponse]:
     """
-    Fetches product data from OpenFoodFacts for the given barcode.
-    Works with ANY valid barcode in the OpenFoodFacts database.
-    Includes retry logic and fallback domains for reliability.
+    Resolves a barcode to a product.
+    Checked in order: the local product store (offline OpenFoodFacts dump),
+    the persistent product cache, then OpenFoodFacts itself (cache misses,
+    and stale entries in the background).
     """
     # Clean barcode (remove spaces, dashes)
     barcode = str(barcode).strip().replace('-', '').replace(' ', '')
+
+    store = get_product_store()
+    if store is not None:
+        product = store.get(barcode)
+        if product is not None:
+            increment("product_store.hits")
+            return product
+        increment("product_store.misses")
+
+    cache = get_product_cache()
+    if cache is None:
+        try:
+            return _fetch_coalesced(barcode)
+        except ProductNotFound:
+            return None
+    return cache.get_or_fetch(barcode, _fetch_coalesced)
+
+# Concurrent lookups for the same barcode / category share one upstream call
+_barcode_flight = SingleFlight("barcode lookup")
+_category_flight = SingleFlight("category search")
+
+def _fetch_coalesced(barcode: str) -> Optional[ProductResponse]:
+    """_fetch_product, shared across concurrent callers for the same barcode."""
+    return _barcode_flight.do(barcode, _fetch_product, barcode)
+
+def build_product_response(product: Dict, barcode: str) -> ProductResponse:
+    """
+    Normalizes a raw OpenFoodFacts product record into a ProductResponse.
+    """
+    # Extract product name with fallbacks
+    product_name = (
+        product.get('product_name') or 
+        product.get('product_name_en') or 
+        product.get('generic_name') or 
+        'Unknown Product'
+    )
     
-    # Try multiple OpenFoodFacts domains (in case one is down)
-    domains = [
-        "https://world.openfoodfacts.org",
-        "https://world.openfoodfacts.net",
-        "https://us.openfoodfacts.org"
-    ]
+    # Normalize nutrition data
+    nutrients = product.get('nutriments', {})
+    nutrition = normalize_nutrition(nutrients)
     
-    for domain_idx, base_domain in enumerate(domains):
-        url = f"{base_domain}/api/v2/product/{barcode}"
-        
-        # Retry logic (max 2 attempts per domain)
-        for attempt in range(2):
-            try:
-                if domain_idx > 0 or attempt > 0:
-                    print(f"� Retry attempt {attempt + 1} with domain: {base_domain}")
-                else:
-                    print(f"�🔍 Querying OpenFoodFacts for barcode: {barcode}")
-                
-                response = requests.get(url, timeout=10)
-                
-                if response.status_code != 200:
-                    print(f"⚠️ Status code {response.status_code} from {base_domain}")
-                    continue
-                    
-                data = response.json()
-                
-                # Check if product was found
-                if data.get('status') != 1 and not data.get('product'):
-                    print(f"❌ Product not found in OpenFoodFacts database")
-                    return None
-                
-                print(f"✅ Product found in OpenFoodFacts!")
-                product = data['product']
-                
-                # Extract product name with fallbacks
-                product_name = (
-                    product.get('product_name') or 
-                    product.get('product_name_en') or 
-                    product.get('generic_name') or 
-                    'Unknown Product'
-                )
-                
-                # Normalize nutrition data
-                nutrients = product.get('nutriments', {})
-                nutrition = normalize_nutrition(nutrients)
-                
-                # Normalize ingredients
-                raw_ingredients = (
-                    product.get('ingredients_text') or 
-                    product.get('ingredients_text_en') or 
-                    ''
-                )
-                ingredients = normalize_ingredients(raw_ingredients)
-                
-                # Extract additives
-                raw_additives = product.get('additives_tags', [])
-                additives = extract_additives(raw_additives)
-                
-                # Extract sources
-                sources = [s.get('id', 'OpenFoodFacts') for s in product.get('sources', [])]
-                if not sources:
-                    sources = ["OpenFoodFacts"]
-                
-                # Get best available image
-                image_url = (
-                    product.get('image_front_url') or
-                    product.get('image_url') or
-                    product.get('image_front_small_url')
-                )
-                
-                print(f"📦 Product: {product_name}")
-                print(f"🔢 Barcode: {barcode}")
-                print(f"🥗 Ingredients: {len(ingredients)} found")
-                print(f"📊 Nutrition data: {len([k for k, v in nutrition.items() if v is not None])} fields")
-
-                # Extract NOVA group (food processing level 1-4)
-                raw_nova = product.get('nova_group')
-                try:
-                    nova_group = int(raw_nova) if raw_nova is not None else None
-                except (ValueError, TypeError):
-                    nova_group = None
-
-                return ProductResponse(
-                    product_id=product.get('code', barcode),
-                    name=product_name,
-                    ingredients=ingredients,
-                    nutrition=NutritionInfo(**nutrition),
-                    additives=additives,
-                    data_sources=sources,
-                    image_url=image_url,
-                    nova_group=nova_group,
-                    allergens_tags=product.get('allergens_tags', []),
-                    traces_tags=product.get('traces_tags', []),
-                    categories_tags=product.get('categories_tags', []),
-                )
-                
-            except requests.exceptions.Timeout:
-                print(f"⏱️ Timeout on attempt {attempt + 1} with {base_domain}")
-                if attempt == 0:
-                    time.sleep(1)  # Wait 1 second before retry
-                continue
-                
-            except requests.exceptions.ConnectionError as e:
-                print(f"🌐 Connection error with {base_domain}: {str(e)[:100]}")
-                if attempt == 0:
-                    time.sleep(1)
-                continue
-                
-            except requests.exceptions.RequestException as e:
-                print(f"🌐 Network error with {base_domain}: {str(e)[:100]}")
-                if attempt == 0:
-                    time.sleep(1)
-                continue
-                
-            except Exception as e:
-                print(f"❌ Error processing product data: {e}")
-                import traceback
-                traceback.print_exc()
-                return None
+    # Normalize ingredients
+    raw_ingredients = (
+        product.get('ingredients_text') or 
+        product.get('ingredients_text_en') or 
+        ''
+    )
+    ingredients = normalize_ingredients(raw_ingredients)
+    
+    # Extract additives
+    raw_additives = product.get('additives_tags', [])
+    additives = extract_additives(raw_additives)
+
+    # Add allergens and additives that only appear in the ingredients text
+    allergens_tags, traces_tags, additives = merge_ingredient_findings(
+        raw_ingredients, product.get('allergens_tags') or [], product.get('traces_tags') or [], additives
+    )
+    
+    # Extract sources
+    sources = [s.get('id', 'OpenFoodFacts') for s in product.get('sources', [])]
+    if not sources:
+        sources = ["OpenFoodFacts"]
     
-    # If all domains and retries failed
-    print(f"❌ Failed to fetch product after trying all domains")
-    return None
+    # Get best available image
+    image_url = (
+        product.get('image_front_url') or
+        product.get('image_url') or
+        product.get('image_front_small_url')
+    )
+
+    # Extract NOVA group (food processing level 1-4)
+    raw_nova = product.get('nova_group')
+    try:
+        nova_group = int(raw_nova) if raw_nova is not None else None
+    except (ValueError, TypeError):
+        nova_group = None
+
+    return attach_base_score(ProductResponse(
+        product_id=product.get('code', barcode),
+        name=product_name,
+        ingredients=ingredients,
+        nutrition=NutritionInfo(**nutrition),
+        additives=additives,
+        data_sources=sources,
+        image_url=image_url,
+        nova_group=nova_group,
+        allergens_tags=allergens_tags,
+        traces_tags=traces_tags,
+        categories_tags=product.get('categories_tags', []),
+    ))
+
+# OpenFoodFacts mirrors (in case one is down)
+OFF_DOMAINS = [
+    "https://world.openfoodfacts.org",
+    "https://world.openfoodfacts.net",
+    "https://us.openfoodfacts.org"
+]
+
+# Rolling latency/error score per mirror — decides hedge order
+mirror_scoreboard = MirrorScoreboard()
+register_gauge("openfoodfacts.mirror_scores", mirror_scoreboard.snapshot)
+
+# Known-good barcode (Nutella) used to probe mirrors whose circuit is open
+PROBE_BARCODE = "3017624010701"
+
+class ProductNotFound(LookupError):
+    """A mirror answered authoritatively that the barcode is unknown."""
+
+def _probe_mirror(base_domain: str) -> bool:
+    """Background health check for a mirror with an open circuit."""
+    response = http_get(f"{base_domain}/api/v2/product/{PROBE_BARCODE}", params={'fields': 'code'}, timeout=5)
+    return response.status_code == 200
+
+def get_domain_breaker(base_domain: str):
+    """Circuit breaker for one OpenFoodFacts host."""
+    return get_breaker(urlparse(base_domain).netloc, probe=lambda: _probe_mirror(base_domain))
+
+def _query_mirror(base_domain: str, barcode: str, cancelled: threading.Event) -> dict:
+    """
+    Queries one OpenFoodFacts mirror for a barcode.
+    Returns the raw product record; raises ProductNotFound for a confirmed
+    miss and any other exception if the mirror failed.
+    """
+    url = f"{base_domain}/api/v2/product/{barcode}"
+    print(f"🔍 Querying {base_domain} for barcode: {barcode}")
+
+    response = http_get(url, stream=True)
+    if cancelled.is_set():
+        # Another mirror already answered — don't bother reading the body
+        response.close()
+        raise HedgeCancelled()
+
+    try:
+        data = response.json()
+    except ValueError:
+        data = {}
+
+    # Check if product was found (v2 API answers unknown codes with 404 + status 0)
+    if response.status_code in (200, 404) and data.get('status') == 0 and not data.get('product'):
+        raise ProductNotFound(barcode)
+
+    if response.status_code != 200 or not data.get('product'):
+        raise requests.exceptions.HTTPError(f"Status code {response.status_code} from {base_domain}")
+
+    return data['product']
+
+def _fetch_product(barcode: str) -> Optional[ProductResponse]:
+    """
+    Queries mirrors with hedging: the best-scoring mirror goes first and the
+    next one is launched after OFF_HEDGE_DELAY seconds or as soon as the
+    previous one fails. The first good answer wins. Mirrors with an open
+    circuit breaker are skipped.
+
+    Returns None if no mirror could answer; raises ProductNotFound if a
+    mirror confirmed the barcode is unknown.
+    """
+    hedge_delay = None
+    if os.getenv("OFF_HEDGED_REQUESTS", "1") == "1":
+        hedge_delay = float(os.getenv("OFF_HEDGE_DELAY", "0.5"))
+
+    mirrors = [d for d in OFF_DOMAINS if get_domain_breaker(d).allow_request()]
+    if not mirrors:
+        increment("openfoodfacts.lookups_skipped_all_circuits_open")
+        print(f"🔌 All OpenFoodFacts mirrors have open circuits, skipping lookup for {barcode}")
+        return None
+
+    def _call(base_domain: str, cancelled: threading.Event):
+        breaker = get_domain_breaker(base_domain)
+        try:
+            product = _query_mirror(base_domain, barcode, cancelled)
+        except ProductNotFound:
+            # A definitive "not found" is a good answer too
+            breaker.record_success()
+            return None
+        except HedgeCancelled:
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        return product
+
+    try:
+        product = hedged_request(
+            mirrors,
+            _call,
+            mirror_scoreboard,
+            hedge_delay=hedge_delay,
+            deadline=float(os.getenv("OFF_LOOKUP_DEADLINE", "15")),
+        )
+    except AllMirrorsFailed as e:
+        print(f"❌ Failed to fetch product after trying all domains: {e}")
+        return None
+
+    if product is None:
+        print(f"❌ Product not found in OpenFoodFacts database")
+        raise ProductNotFound(barcode)
+
+    try:
+        print(f"✅ Product found in OpenFoodFacts!")
+        result = build_product_response(product, barcode)
+    except Exception as e:
+        print(f"❌ Error processing product data: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+    print(f"📦 Product: {result.name}")
+    print(f"🔢 Barcode: {barcode}")
+    print(f"🥗 Ingredients: {len(result.ingredients)} found")
+    print(f"📊 Nutrition data: {len([k for k, v in result.nutrition.dict().items() if v is not None])} fields")
+    return result
 
 def resolve_by_category(category_tag: str, limit: int = 8) -> List[Dict]:
     """
     Searches for products in a specific category tag.
     Used for finding alternatives.
+    Served from the local product store's category index when the category
+    is indexed; otherwise an OpenFoodFacts search, shared by concurrent
+    callers for the same category.
     """
+    store = get_product_store()
+    if store is not None:
+        local = store.find_by_category(category_tag, limit)
+        if local:
+            increment("product_store.category_hits")
+            return local
+        increment("product_store.category_misses")
+
+    results = _category_flight.do((category_tag, limit), _search_category, category_tag, limit)
+    # Every caller gets its own copies — callers extend/modify the list
+    return [dict(r) for r in results]
+
+def _search_category(category_tag: str, limit: int) -> List[Dict]:
+    """OpenFoodFacts category search (uncoalesced)."""
     url = f"https://world.openfoodfacts.org/cgi/search.pl?action=process&tagtype_0=categories&tag_contains_0=contains&tag_0={category_tag}&sort_by=unique_scans_n&page_size={limit}&json=true"
+    breaker = get_domain_breaker("https://world.openfoodfacts.org")
+    if not breaker.allow_request():
+        print(f"🔌 Circuit open for world.openfoodfacts.org, skipping category search")
+        return []
     
     try:
         print(f"🔍 Searching for alternatives in category: {category_tag}")
-        response = requests.get(url, timeout=10)
+        response = http_get(url)
         if response.status_code != 200:
+            breaker.record_failure()
             return []
+        breaker.record_success()
             
         data = response.json()
         products = data.get('products', [])
@@ -170,6 +293,10 @@ def resolve_by_category(category_tag: str, limit: int = 8) -> List[Dict]:
                 **nutrition # Spread normalized nutrition
             })
         return results
+    except requests.exceptions.RequestException as e:
+        breaker.record_failure()
+        print(f"❌ Error searching by category: {e}")
+        return []
     except Exception as e:
         print(f"❌ Error searching by category: {e}")
         return []
@@ -1,66 +1,167 @@
-import cv2
-import numpy as np
 import requests
 from ..models.schemas import ProductResponse, NutritionInfo
 from ..utils.normalizer import normalize_nutrition, normalize_ingredients, extract_additives
+from ..utils.ingredient_scanner import merge_ingredient_findings
+from ..utils.http_client import http_get
+from ..utils.image_preprocess import PreparedImage
+from ..utils.product_store import get_product_store
+from ..utils.metrics import increment
+from ..utils.personalization import attach_base_score
+from .barcode_resolver import get_domain_breaker
 from typing import Optional, List
 from difflib import get_close_matches
+import os
+import re
+import threading
+import time
 
-# Optional dependencies for image processing
-try:
+# Optional dependencies for image processing.
+# Both are loaded on first use (or by warm_up_backends after startup) rather
+# than at import, so workers that only serve barcode scans start fast and
+# never pay for the OCR model.
+_backends = {
+    'barcode': {'status': 'not_loaded', 'load_seconds': None, 'impl': None},
+    'ocr': {'status': 'not_loaded', 'load_seconds': None, 'impl': None},
+}
+_backend_locks = {'barcode': threading.Lock(), 'ocr': threading.Lock()}
+
+def _load_pyzbar():
     from pyzbar.pyzbar import decode as pyzbar_decode
-    PYZBAR_AVAILABLE = True
-except ImportError:
-    PYZBAR_AVAILABLE = False
-    print("⚠️ Warning: pyzbar not installed. Image barcode scanning will be disabled.")
+    return pyzbar_decode
 
-try:
+def _load_easyocr():
     import easyocr
-    EASYOCR_AVAILABLE = True
-except ImportError:
-    EASYOCR_AVAILABLE = False
-    print("⚠️ Warning: easyocr not installed. OCR will be disabled.")
-
-# Initialize EasyOCR reader lazily/globally if available
-reader = None
-if EASYOCR_AVAILABLE:
+    # GPU=False for server environments to avoid CUDA issues
+    return easyocr.Reader(['en'], gpu=False)
+
+_LOADERS = {
+    'barcode': (_load_pyzbar, "pyzbar not installed. Image barcode scanning will be disabled."),
+    'ocr': (_load_easyocr, "easyocr not installed. OCR will be disabled."),
+}
+
+def _get_backend(name: str):
+    """Load a backend once (thread-safe); returns None if it is unavailable."""
+    backend = _backends[name]
+    if backend['status'] in ('loaded', 'unavailable', 'failed'):
+        return backend['impl']
+    with _backend_locks[name]:
+        if backend['status'] in ('loaded', 'unavailable', 'failed'):
+            return backend['impl']
+        loader, missing_msg = _LOADERS[name]
+        backend['status'] = 'loading'
+        started = time.perf_counter()
+        try:
+            backend['impl'] = loader()
+            backend['status'] = 'loaded'
+            print(f"✅ {name} backend loaded in {time.perf_counter() - started:.2f}s")
+        except ImportError:
+            backend['status'] = 'unavailable'
+            print(f"⚠️ Warning: {missing_msg}")
+        except Exception as e:
+            backend['status'] = 'failed'
+            print(f"⚠️ Warning: {name} backend initialization failed: {e}")
+        backend['load_seconds'] = round(time.perf_counter() - started, 3)
+        return backend['impl']
+
+def get_barcode_decoder():
+    """pyzbar's decode function, or None if pyzbar is missing."""
+    return _get_backend('barcode')
+
+def get_ocr_reader():
+    """The EasyOCR reader (model weights load on first call), or None if unavailable."""
+    return _get_backend('ocr')
+
+def warm_up_backends():
+    """Load the barcode decoder, then the OCR model. Meant for a background thread."""
+    get_barcode_decoder()
+    get_ocr_reader()
+
+def get_capabilities() -> dict:
+    """Load status of each image backend, for readiness reporting."""
+    return {name: {'status': b['status'], 'load_seconds': b['load_seconds']} for name, b in _backends.items()}
+
+def decode_barcode(prepared: PreparedImage) -> Optional[str]:
+    """
+    Runs pyzbar over the image pyramid of an already-decoded upload and
+    returns the first barcode found.
+    """
+    pyzbar_decode = get_barcode_decoder()
+    if pyzbar_decode is None:
+        print("❌ decode_barcode called but pyzbar is missing.")
+        return None
+
     try:
-        # GPU=False for server environments to avoid CUDA issues
-        reader = easyocr.Reader(['en'], gpu=False)
+        for candidate in prepared.barcode_pyramid():
+            decoded_objects = pyzbar_decode(candidate)
+            for obj in decoded_objects:
+                return obj.data.decode('utf-8')
     except Exception as e:
-        print(f"⚠️ Warning: EasyOCR initialization failed: {e}")
-        EASYOCR_AVAILABLE = False
+        print(f"❌ Error decoding barcode: {e}")
+    return None
 
 def decode_barcode_from_image(image_bytes: bytes) -> Optional[str]:
     """
     Decodes barcode from an image byte stream.
     Requires pyzbar to be installed.
     """
-    if not PYZBAR_AVAILABLE:
-        print("❌ decode_barcode_from_image called but pyzbar is missing.")
+    prepared = PreparedImage.from_bytes(image_bytes)
+    if prepared is None:
         return None
-        
-    try:
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
-        
-        if img is None:
-            print("❌ Failed to decode image bytes to image")
-            return None
-            
-        decoded_objects = pyzbar_decode(img)
-        for obj in decoded_objects:
-            return obj.data.decode('utf-8')
-            
-    except Exception as e:
-        print(f"❌ Error decoding barcode: {e}")
-    return None
+    return decode_barcode(prepared)
+
+def _match_fraction(tokens: List[str], ocr_tokens: List[str]) -> float:
+    """Share of `tokens` (weighted by length) found in the OCR tokens, allowing typos."""
+    total = sum(len(t) for t in tokens)
+    if not total:
+        return 0.0
+    vocabulary = set(ocr_tokens)
+    matched = sum(
+        len(t) for t in tokens
+        if t in vocabulary or get_close_matches(t, ocr_tokens, n=1, cutoff=0.8)
+    )
+    return matched / total
+
+def search_local_names(query: str) -> Optional[ProductResponse]:
+    """
+    Match OCR text against the local product store's name index.
+
+    Candidates from the trigram index are re-ranked by how much of their
+    name appears (fuzzily) in the OCR text, with matching brands as a
+    tie-breaker. Returns None when there is no store or the best match is
+    below NAME_MATCH_MIN_CONFIDENCE, so the caller can fall back to search.
+    """
+    store = get_product_store()
+    if store is None:
+        return None
+    started = time.perf_counter()
+    ocr_tokens = re.findall(r'[^\W_]{2,}', query.lower())
+    best, best_key = None, None
+    for candidate in store.search_names(query):
+        name_tokens = re.findall(r'[^\W_]{2,}', candidate['name'].lower())
+        # Very short names ("Bar", "Tea") would match almost any label
+        if sum(len(t) for t in name_tokens) < 4:
+            continue
+        confidence = _match_fraction(name_tokens, ocr_tokens)
+        brand = _match_fraction(re.findall(r'[^\W_]{2,}', candidate['brands'].lower()), ocr_tokens)
+        key = (confidence + 0.1 * brand, candidate['unique_scans_n'])
+        if best_key is None or key > best_key:
+            best, best_key = candidate, key
+
+    min_confidence = float(os.getenv("NAME_MATCH_MIN_CONFIDENCE", "0.8"))
+    elapsed = (time.perf_counter() - started) * 1000
+    if best is None or best_key[0] < min_confidence:
+        increment("name_index.misses")
+        print(f"🔎 No confident local name match ({elapsed:.0f} ms)")
+        return None
+    increment("name_index.hits")
+    print(f"🔎 Local name match: {best['name']} ({best['barcode']}, score {best_key[0]:.2f}, {elapsed:.0f} ms)")
+    return store.get(best['barcode'])
 
 def search_product_by_name(query: str) -> Optional[ProductResponse]:
     """
     Searches OpenFoodFacts for a product by name.
     """
-    url = f"https://world.openfoodfacts.net/cgi/search.pl"
+    url = "https://world.openfoodfacts.net/cgi/search.pl"
     params = {
         'search_terms': query,
         'search_simple': 1,
@@ -68,12 +169,20 @@ def search_product_by_name(query: str) -> Optional[ProductResponse]:
         'json': 1,
         'page_size': 1
     }
+    breaker = get_domain_breaker("https://world.openfoodfacts.net")
+    if not breaker.allow_request():
+        print("🔌 Circuit open for world.openfoodfacts.net, skipping name search")
+        return None
     try:
-        print(f"DEBUG: Searching OpenFoodFacts for: '{query}'")
-        response = requests.get(url, params=params, timeout=10)
+        print(f"🔍 Searching OpenFoodFacts by name: '{query}'")
+        response = http_get(url, params=params)
+        if response.status_code != 200:
+            breaker.record_failure()
+            return None
+        breaker.record_success()
         data = response.json()
         count = data.get('count', 0)
-        print(f"DEBUG: Found {count} results for '{query}'")
+        print(f"📋 {count} result(s) for '{query}'")
         
         if count > 0 and data.get('products'):
             product = data['products'][0]
@@ -89,49 +198,107 @@ def search_product_by_name(query: str) -> Optional[ProductResponse]:
             # Extract additives
             raw_additives = product.get('additives_tags', [])
             additives = extract_additives(raw_additives)
+            allergens_tags, traces_tags, additives = merge_ingredient_findings(
+                raw_ingredients, product.get('allergens_tags') or [], product.get('traces_tags') or [], additives
+            )
 
             # Extract sources if available
             sources = [s.get('id', 'OpenFoodFacts') for s in product.get('sources', [])]
             if not sources:
                 sources = ["OpenFoodFacts Search"]
             
-            return ProductResponse(
+            return attach_base_score(ProductResponse(
                 product_id=product.get('code', 'search_result'),
                 name=product.get('product_name', 'Unknown Product'),
                 ingredients=ingredients,
                 nutrition=NutritionInfo(**nutrition),
                 additives=additives,
                 data_sources=sources,
-                image_url=product.get('image_front_url')
-            )
+                image_url=product.get('image_front_url'),
+                allergens_tags=allergens_tags,
+                traces_tags=traces_tags
+            ))
+    except requests.exceptions.RequestException as e:
+        breaker.record_failure()
+        print(f"Search failed: {e}")
     except Exception as e:
         print(f"Search failed: {e}")
     return None
 
-def resolve_by_image(image_bytes: bytes) -> Optional[ProductResponse]:
+def extract_identifiers(image_bytes: bytes) -> dict:
     """
-    Resolves a product from an image:
-    1. Try barcode decoding.
-    2. If no barcode, try OCR + Search.
+    CPU-bound half of image resolution: barcode decoding, then OCR if no
+    barcode was found. Has no network I/O and returns only plain data, so it
+    can run in a worker process (see utils/image_pool.py).
+
+    Returns:
+        {'barcode': str or None, 'ocr_text': str or None}
     """
-    barcode = decode_barcode_from_image(image_bytes)
+    # Decode once; barcode and OCR both work from views of this image
+    prepared = PreparedImage.from_bytes(image_bytes)
+    if prepared is None:
+        return {'barcode': None, 'ocr_text': None}
+
+    barcode = decode_barcode(prepared)
     if barcode:
-        from .barcode_resolver import resolve_by_barcode
-        return resolve_by_barcode(barcode)
+        return {'barcode': barcode, 'ocr_text': None}
     
-    # OCR (Fallback)
+    # OCR (Fallback) on the downscaled, text-cropped image
+    return {'barcode': None, 'ocr_text': _read_text(prepared)}
+
+def _read_text(prepared: PreparedImage) -> Optional[str]:
+    """EasyOCR over the prepared OCR crop; None if unavailable or nothing was read."""
+    reader = get_ocr_reader()
     if reader:
         try:
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            # Use IMREAD_COLOR to ensure 3 channels for EasyOCR if needed (it handles BGR)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            result = reader.readtext(img, detail=0)
+            img = prepared.ocr_image()
+            result = reader.readtext(img, detail=0, canvas_size=prepared.ocr_max_side)
             text_query = " ".join(result)
             
             if text_query.strip():
                 print(f"OCR Extracted: {text_query}")
-                return search_product_by_name(text_query)
+                return text_query
         except Exception as e:
             print(f"OCR failed: {e}")
-            
     return None
+
+def scan_frame(image_bytes: bytes) -> dict:
+    """
+    Barcode pass over one frame of a burst (no OCR). Also reports the
+    frame's sharpness so the caller can pick the best frame for OCR.
+
+    Returns:
+        {'barcode': str or None, 'sharpness': float}
+    """
+    prepared = PreparedImage.from_bytes(image_bytes)
+    if prepared is None:
+        return {'barcode': None, 'sharpness': 0.0}
+    return {'barcode': decode_barcode(prepared), 'sharpness': prepared.sharpness()}
+
+def extract_text(image_bytes: bytes) -> dict:
+    """OCR-only counterpart of extract_identifiers, for a frame already scanned for barcodes."""
+    prepared = PreparedImage.from_bytes(image_bytes)
+    if prepared is None:
+        return {'barcode': None, 'ocr_text': None}
+    return {'barcode': None, 'ocr_text': _read_text(prepared)}
+
+def resolve_identifiers(identifiers: dict) -> Optional[ProductResponse]:
+    """
+    I/O-bound half of image resolution: look up the decoded barcode, or
+    search by the OCR text.
+    """
+    if identifiers.get('barcode'):
+        from .barcode_resolver import resolve_by_barcode
+        return resolve_by_barcode(identifiers['barcode'])
+    if identifiers.get('ocr_text'):
+        # Local index first; the remote search only when it isn't confident
+        return search_local_names(identifiers['ocr_text']) or search_product_by_name(identifiers['ocr_text'])
+    return None
+
+def resolve_by_image(image_bytes: bytes) -> Optional[ProductResponse]:
+    """
+    Resolves a product from an image:
+    1. Try barcode decoding.
+    2. If no barcode, try OCR + Search.
+    """
+    return resolve_identifiers(extract_identifiers(image_bytes))
@@ -1,6 +1,6 @@
 from typing import Optional, Dict, Any
-import requests
 import os
+from ..utils.http_client import http_get
 
 USDA_API_KEY = os.getenv("USDA_API_KEY")
 USDA_BASE_URL = "https://api.nal.usda.gov/fdc/v1"
@@ -22,7 +22,7 @@ def search_usda_food(query: str) -> Optional[Dict[str, Any]]:
     }
     
     try:
-        response = requests.get(url, params=params, timeout=5)
+        response = http_get(url, params=params, timeout=5)
         if response.status_code == 200:
             data = response.json()
             if data.get("foods"):
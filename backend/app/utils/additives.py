@@ -0,0 +1,182 @@
+"""
+Food additive (E-number) database.
+
+Loaded once from additives.json into dicts keyed by normalized code, plus an
+index of names and common aliases ("msg", "soy lecithin") to codes. Label
+and tag spellings vary ('en:e322i', 'E 322(i)', 'e150d', 'INS 330'), so
+codes are normalized before lookup, and a sub-variant without an entry of
+its own (E322i, E160aI) resolves to its parent (E322, E160a).
+
+The file is re-read when its mtime changes (checked at most every
+ADDITIVES_RELOAD_INTERVAL seconds), so the dataset can be updated without a
+restart.
+"""
+import json
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from .metrics import register_gauge
+
+DEFAULT_ADDITIVES_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'additives.json')
+
+_CODE_RE = re.compile(r'^E(\d{3,4})([A-H]?)([IVX]*)$')
+
+
+@lru_cache(maxsize=4096)
+def normalize_code(raw: str) -> Optional[str]:
+    """
+    Canonical form of an E-number ('E322I', 'E150D'), or None if `raw`
+    is not one.
+    """
+    code = raw.split(':', 1)[-1].upper()
+    code = re.sub(r'[\s\-\.\(\)]', '', code)
+    if code.startswith('INS'):
+        code = 'E' + code[3:]
+    return code if _CODE_RE.match(code) else None
+
+
+def _parents(code: str) -> List[str]:
+    """Candidate codes for a normalized code, most specific first: E160AII → E160AII, E160A, E160."""
+    digits, letter, roman = _CODE_RE.match(code).groups()
+    candidates = [code]
+    if roman:
+        candidates.append(f"E{digits}{letter}")
+    if letter:
+        candidates.append(f"E{digits}")
+    return candidates
+
+
+class AdditiveDB:
+    """Indexed, hot-reloadable view of additives.json."""
+
+    def __init__(self, path: str = DEFAULT_ADDITIVES_PATH, reload_interval: float = 30.0):
+        """
+        Args:
+            reload_interval: Seconds between mtime checks; 0 disables reloading.
+        """
+        self.path = path
+        self.reload_interval = reload_interval
+        self.version = None
+        # Incremented on every successful (re)load, so derived indexes know to rebuild
+        self.generation = 0
+        self._entries: Dict[str, dict] = {}
+        self._aliases: Dict[str, str] = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self) -> bool:
+        """Re-read the file. On error the previous data stays in use."""
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            entries, aliases = {}, {}
+            for record in data['additives']:
+                code = normalize_code(record['code'])
+                if code is None:
+                    continue
+                entries[code] = {
+                    'name': record['name'],
+                    'risk': record.get('risk', 'low'),
+                    'description': record.get('description', ''),
+                    'class': record.get('class'),
+                }
+                for alias in [record['name'], *record.get('aliases', [])]:
+                    aliases.setdefault(alias.lower(), code)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"⚠️ Could not load additive database from {self.path}: {e}")
+            return False
+        # Swap whole dicts so readers never see a half-built index
+        self._entries, self._aliases = entries, aliases
+        self.version = data.get('version')
+        self._mtime = mtime
+        self.generation += 1
+        print(f"🧪 Additive database loaded: {len(entries)} additives, {len(aliases)} names/aliases")
+        return True
+
+    def _maybe_reload(self):
+        if self.reload_interval <= 0 or time.time() - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            if time.time() - self._checked_at < self.reload_interval:
+                return
+            self._checked_at = time.time()
+            try:
+                changed = os.path.getmtime(self.path) != self._mtime
+            except OSError:
+                changed = False
+            if changed:
+                self.reload()
+
+    def resolve(self, raw: str) -> Optional[str]:
+        """Database code for an E-number (or its parent) or a known name/alias; None if unknown."""
+        self._maybe_reload()
+        entries = self._entries
+        code = normalize_code(raw)
+        if code is None:
+            return self._aliases.get(raw.strip().lower())
+        for candidate in _parents(code):
+            if candidate in entries:
+                return candidate
+        return None
+
+    def lookup(self, raw: str) -> Optional[dict]:
+        code = self.resolve(raw)
+        return self._entries.get(code) if code is not None else None
+
+    def details(self, additive_ids: List[str]) -> List[dict]:
+        """AdditiveDetail dicts for a product's additives (unknown codes get a neutral placeholder)."""
+        details = []
+        for aid in additive_ids:
+            code = self.resolve(aid)
+            clean_id = normalize_code(aid) or code or aid.upper()
+            entry = self._entries.get(code) if code is not None else None
+            if entry is not None:
+                details.append({'id': clean_id, 'name': entry['name'], 'risk': entry['risk'],
+                                'description': entry['description']})
+            else:
+                # Fallback for unknown additives
+                details.append({
+                    'id': clean_id,
+                    'name': f'Additive {clean_id}',
+                    'risk': 'low',
+                    'description': 'Information not available, but generally used in safe quantities.'
+                })
+        return details
+
+    def aliases(self) -> Dict[str, str]:
+        """Lower-case name/alias → code, e.g. for matching additives in ingredient text."""
+        self._maybe_reload()
+        return dict(self._aliases)
+
+    def codes(self) -> List[str]:
+        """Every code in the database (normalized)."""
+        self._maybe_reload()
+        return list(self._entries)
+
+    def stats(self) -> dict:
+        return {'additives': len(self._entries), 'aliases': len(self._aliases), 'version': self.version}
+
+
+# Global instance (singleton pattern)
+_db_instance = None
+_db_lock = threading.Lock()
+
+def get_additive_db() -> AdditiveDB:
+    """Get or create the global additive database."""
+    global _db_instance
+    if _db_instance is None:
+        with _db_lock:
+            if _db_instance is None:
+                _db_instance = AdditiveDB(
+                    path=os.getenv("ADDITIVES_PATH", DEFAULT_ADDITIVES_PATH),
+                    reload_interval=float(os.getenv("ADDITIVES_RELOAD_INTERVAL", "30")),
+                )
+                register_gauge("additives", _db_instance.stats)
+    return _db_instance
@@ -0,0 +1,137 @@
+"""
+Per-upstream circuit breakers.
+
+After repeated failures a breaker opens and requests to that upstream are
+skipped at once instead of paying timeouts. While open, a background probe
+periodically checks the upstream (half-open); a successful probe closes the
+breaker again, and so does a successful real request, which also stops the
+probe.
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from .metrics import increment, register_gauge
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Closed → Open after `failure_threshold` consecutive failures.
+    Open → Half-open when the background probe runs (every `reset_timeout` s).
+    Half-open → Closed on a successful probe, back to Open otherwise.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 30.0,
+                 probe: Optional[Callable[[], bool]] = None):
+        """
+        Args:
+            name: Upstream identifier (used in logs and metric names).
+            probe: Cheap health check returning True when the upstream is back.
+                Without a probe, the first real request after `reset_timeout`
+                is let through as the half-open trial.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+        self._probing = False
+        self._probe_stop = threading.Event()
+
+    def allow_request(self) -> bool:
+        """Whether a real request may be sent to this upstream now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.probe is None and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # No background probe: this request is the half-open trial
+                self.state = HALF_OPEN
+                return True
+        increment(f"circuit_breaker.{self.name}.skipped")
+        return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"✅ Circuit for {self.name} closed")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._stop_probe()
+
+    def _stop_probe(self):
+        """Tell the running probe loop, if any, to exit (caller holds the lock)."""
+        if self._probing:
+            self._probe_stop.set()
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+                self._open()
+
+    def _open(self):
+        """Trip the breaker (caller holds the lock)."""
+        if self.state != OPEN:
+            print(f"🔌 Circuit for {self.name} opened after {self.consecutive_failures} failure(s)")
+            increment(f"circuit_breaker.{self.name}.opened")
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        if self.probe is not None and not self._probing:
+            self._probing = True
+            # A fresh event per loop, so stopping one loop never affects a later one
+            self._probe_stop = threading.Event()
+            threading.Thread(target=self._probe_loop, args=(self._probe_stop,),
+                             name=f"probe-{self.name}", daemon=True).start()
+
+    def _probe_loop(self, stop: threading.Event):
+        """Background half-open probing until the upstream recovers or a real request succeeds."""
+        while not stop.wait(self.reset_timeout):
+            with self._lock:
+                if stop.is_set() or self.state != OPEN:
+                    return
+                self.state = HALF_OPEN
+            try:
+                healthy = bool(self.probe())
+            except Exception:
+                healthy = False
+            increment(f"circuit_breaker.{self.name}.probes")
+
+            with self._lock:
+                if stop.is_set():
+                    return  # closed by a real request meanwhile; leave it closed
+                if healthy:
+                    print(f"✅ Circuit for {self.name} closed after successful probe")
+                    self.state = CLOSED
+                    self.consecutive_failures = 0
+                    self._stop_probe()
+                    return
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+def get_breaker(name: str, probe: Optional[Callable[[], bool]] = None) -> CircuitBreaker:
+    """Get or create the breaker for an upstream; its state is exported as a gauge."""
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3")),
+                reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30")),
+                probe=probe,
+            )
+            _breakers[name] = breaker
+            register_gauge(f"circuit_breaker.{name}.state", lambda b=breaker: b.state)
+        return breaker
@@ -0,0 +1,171 @@
+"""
+Hedged requests across equivalent upstream mirrors.
+
+The best-scoring mirror is queried first. If it has not answered within a
+short hedge delay (or fails outright), the next mirror is queried in
+parallel, and the first good answer wins. Every mirror keeps a rolling
+latency/error score that decides the order for the next request.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class HedgeCancelled(Exception):
+    """Raised inside a losing request once another mirror has already answered."""
+
+
+class AllMirrorsFailed(Exception):
+    """Raised when no mirror produced a good answer before the deadline."""
+
+
+class MirrorScoreboard:
+    """
+    Rolling (exponentially weighted) latency and error rate per mirror.
+    Lower score = preferred.
+    """
+
+    def __init__(self, alpha: float = 0.2, error_penalty: float = 5.0, initial_latency: float = 1.0):
+        """
+        Args:
+            alpha: Weight of the newest observation in the moving averages.
+            error_penalty: Seconds of latency an error rate of 1.0 is worth.
+            initial_latency: Assumed latency for mirrors with no history yet.
+        """
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.initial_latency = initial_latency
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, mirror: str) -> Dict[str, float]:
+        if mirror not in self._stats:
+            self._stats[mirror] = {'latency': self.initial_latency, 'error_rate': 0.0, 'requests': 0}
+        return self._stats[mirror]
+
+    def record(self, mirror: str, latency: float, ok: bool):
+        """Fold one completed request into the mirror's averages."""
+        with self._lock:
+            s = self._entry(mirror)
+            s['latency'] = (1 - self.alpha) * s['latency'] + self.alpha * latency
+            s['error_rate'] = (1 - self.alpha) * s['error_rate'] + self.alpha * (0.0 if ok else 1.0)
+            s['requests'] += 1
+
+    def score(self, mirror: str) -> float:
+        with self._lock:
+            s = self._entry(mirror)
+            return s['latency'] + s['error_rate'] * self.error_penalty
+
+    def rank(self, mirrors: List[str]) -> List[str]:
+        """Mirrors ordered best-first; ties keep the configured order."""
+        return sorted(mirrors, key=lambda m: (self.score(m), mirrors.index(m)))
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                m: {**s, 'score': round(s['latency'] + s['error_rate'] * self.error_penalty, 3)}
+                for m, s in self._stats.items()
+            }
+
+
+# Shared worker pool for in-flight mirror requests
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv("HEDGE_MAX_WORKERS", "16")),
+                    thread_name_prefix="hedge",
+                )
+    return _executor
+
+
+def hedged_request(
+    mirrors: List[str],
+    call: Callable[[str, threading.Event], T],
+    scoreboard: MirrorScoreboard,
+    hedge_delay: Optional[float] = 0.5,
+    deadline: float = 15.0,
+) -> T:
+    """
+    Run `call(mirror, cancelled)` against mirrors in score order, hedging after `hedge_delay`.
+
+    `call` must return a good answer or raise. It should check the `cancelled`
+    event after blocking I/O and raise HedgeCancelled if it is set, so that
+    losing requests stop as soon as possible.
+
+    Args:
+        hedge_delay: Seconds to wait on outstanding requests before launching the
+            next mirror. None disables latency hedging (fail-over only).
+        deadline: Overall time budget in seconds.
+
+    Raises:
+        AllMirrorsFailed: if every mirror failed or the deadline passed.
+    """
+    queue = scoreboard.rank(mirrors)
+    cancelled = threading.Event()
+    pending = {}
+    errors = []
+    started_at = time.monotonic()
+
+    def _timed(mirror: str) -> T:
+        t0 = time.monotonic()
+        try:
+            result = call(mirror, cancelled)
+        except HedgeCancelled:
+            # Lost the race: its latency is at least this long
+            scoreboard.record(mirror, time.monotonic() - t0, ok=True)
+            raise
+        except Exception:
+            if not cancelled.is_set():
+                scoreboard.record(mirror, time.monotonic() - t0, ok=False)
+            raise
+        scoreboard.record(mirror, time.monotonic() - t0, ok=True)
+        return result
+
+    def _launch_next():
+        mirror = queue.pop(0)
+        pending[_get_executor().submit(_timed, mirror)] = mirror
+
+    _launch_next()
+    try:
+        while pending:
+            remaining = deadline - (time.monotonic() - started_at)
+            if remaining <= 0:
+                errors.append("deadline exceeded")
+                break
+
+            wait_for = remaining
+            if queue and hedge_delay is not None:
+                wait_for = min(hedge_delay, remaining)
+
+            done, _ = wait(list(pending), timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                mirror = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    errors.append(f"{mirror}: {str(e)[:100]}")
+                    # Failed outright — don't wait for the hedge delay
+                    if queue:
+                        _launch_next()
+
+            if not done and queue:
+                print(f"⏳ No answer after {wait_for:.2f}s, hedging to {queue[0]}")
+                _launch_next()
+    finally:
+        # Losers: drop queued work and tell running requests to stop
+        cancelled.set()
+        for future in pending:
+            future.cancel()
+
+    raise AllMirrorsFailed("; ".join(errors) or "no mirrors available")
@@ -1,46 +1,172 @@
+"""
+Scan history store.
+
+Scans are appended to a SQLite table in WAL mode: saving one is a single
+INSERT (plus trimming the row that fell out of the retention window), several
+workers/processes can write concurrently without losing entries, and reads
+walk the primary-key index backwards instead of parsing a whole file.
+
+An existing scan_history.json from earlier versions is imported once, the
+first time the store is opened, and renamed to scan_history.json.imported.
+"""
 import json
 import os
+import sqlite3
+import threading
+import time
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import Any, Dict, List
 
-HISTORY_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'scan_history.json')
+from .metrics import increment, register_gauge
 
-def save_scan(user_profile: Dict[str, Any], product_data: Dict[str, Any], score: float):
-    """Saves a scan result to the history file."""
-    history = []
-    if os.path.exists(HISTORY_FILE):
+DEFAULT_HISTORY_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'scan_history.db')
+LEGACY_HISTORY_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'scan_history.json')
+
+
+class HistoryStore:
+    """Append-only SQLite scan log with a bounded number of retained entries."""
+
+    def __init__(self, path: str = DEFAULT_HISTORY_PATH, max_entries: int = 1000):
+        """
+        Args:
+            path: SQLite database file.
+            max_entries: Most recent scans kept; older ones are deleted as new
+                ones arrive (0 keeps everything).
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread; sqlite3 connections are not thread-safe."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            # WAL lets several workers read while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS scans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scanned_at REAL NOT NULL,
+                product_id TEXT,
+                product_name TEXT,
+                score REAL,
+                calories REAL,
+                profile_summary TEXT
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS scans_scanned_at ON scans (scanned_at)")
+        conn.commit()
+
+    def import_legacy(self, json_path: str = LEGACY_HISTORY_FILE) -> int:
+        """Move an old scan_history.json aside (to *.imported) and copy its entries into the store."""
+        imported_path = json_path + '.imported'
+        try:
+            # Claim the file first so only one worker imports it
+            os.replace(json_path, imported_path)
+        except OSError:
+            return 0
         try:
-            with open(HISTORY_FILE, 'r') as f:
-                history = json.load(f)
-        except:
-            history = []
-    
-    new_entry = {
-        'timestamp': datetime.now().isoformat(),
+            with open(imported_path, 'r') as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not import scan history from {json_path}: {e}")
+            return 0
+        rows = []
+        for entry in entries if isinstance(entries, list) else []:
+            try:
+                scanned_at = datetime.fromisoformat(entry['timestamp']).timestamp()
+            except (KeyError, TypeError, ValueError):
+                scanned_at = time.time()
+            rows.append((scanned_at, entry.get('product_id'), entry.get('product_name'), entry.get('score'),
+                         entry.get('calories'), json.dumps(entry.get('user_profile_summary', {}))))
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT INTO scans (scanned_at, product_id, product_name, score, calories, profile_summary) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+        print(f"📜 Imported {len(rows)} scans from {json_path}")
+        return len(rows)
+
+    def append(self, entry: Dict[str, Any]):
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO scans (scanned_at, product_id, product_name, score, calories, profile_summary) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), entry['product_id'], entry['product_name'], entry['score'], entry['calories'],
+                 json.dumps(entry['user_profile_summary']))
+            )
+            if self.max_entries > 0:
+                # Ids only grow, so this removes the scan(s) that just left the window
+                conn.execute("DELETE FROM scans WHERE id <= ?", (cursor.lastrowid - self.max_entries,))
+        increment("history.saved")
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """The last `limit` scans, oldest first."""
+        rows = self._connect().execute(
+            "SELECT scanned_at, product_name, product_id, score, calories, profile_summary "
+            "FROM scans ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [
+            {
+                'timestamp': datetime.fromtimestamp(scanned_at).isoformat(),
+                'product_name': product_name,
+                'product_id': product_id,
+                'score': score,
+                'calories': calories,
+                'user_profile_summary': json.loads(profile_summary or '{}'),
+            }
+            for scanned_at, product_name, product_id, score, calories, profile_summary in reversed(rows)
+        ]
+
+    def stats(self) -> dict:
+        count, = self._connect().execute("SELECT COUNT(*) FROM scans").fetchone()
+        return {'entries': count, 'max_entries': self.max_entries}
+
+
+# Global instance (singleton pattern)
+_store_instance = None
+_store_lock = threading.Lock()
+
+def get_history_store() -> HistoryStore:
+    """Get or create the global scan history store."""
+    global _store_instance
+    if _store_instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                store = HistoryStore(
+                    path=os.getenv("HISTORY_DB_PATH", DEFAULT_HISTORY_PATH),
+                    max_entries=int(os.getenv("HISTORY_MAX_ENTRIES", "1000")),
+                )
+                store.import_legacy()
+                register_gauge("history", store.stats)
+                _store_instance = store
+    return _store_instance
+
+def save_scan(user_profile: Dict[str, Any], product_data: Dict[str, Any], score: float):
+    """Saves a scan result to the history store."""
+    get_history_store().append({
         'product_name': product_data.get('name', 'Unknown'),
         'product_id': product_data.get('product_id', 'Unknown'),
         'score': score,
-        'calories': product_data.get('nutrition', {}).get('energy_kcal_100g', 0),
+        'calories': (product_data.get('nutrition') or {}).get('energy_kcal_100g', 0),
         'user_profile_summary': {
             'has_diabetes': user_profile.get('has_diabetes', False),
             'has_hypertension': user_profile.get('has_hypertension', False)
         }
-    }
-    
-    history.append(new_entry)
-    
-    # Keep only last 50 scans for the demo
-    history = history[-50:]
-    
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(history, f, indent=2)
-
-def get_history() -> List[Dict[str, Any]]:
-    """Retrieves the scan history."""
-    if os.path.exists(HISTORY_FILE):
-        try:
-            with open(HISTORY_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+    })
+
+def get_history(limit: int = 50) -> List[Dict[str, Any]]:
+    """Retrieves the most recent scans, oldest first."""
+    return get_history_store().recent(limit)
@@ -0,0 +1,82 @@
+"""
+Shared HTTP client for upstream APIs (OpenFoodFacts, USDA).
+
+All resolvers go through one requests.Session so TCP+TLS connections are
+kept alive and reused from per-host pools instead of being re-established
+for every lookup.
+"""
+import os
+import threading
+from typing import Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = "NutriGuardAI/0.2 (+https://github.com/diyaj14/nutriguard-ai)"
+
+Timeout = Union[float, Tuple[float, float]]
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_default_timeout() -> Tuple[float, float]:
+    """(connect, read) timeout in seconds, configurable via environment."""
+    return (
+        float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05")),
+        float(os.getenv("HTTP_READ_TIMEOUT", "10")),
+    )
+
+
+def _build_session() -> requests.Session:
+    """Create a session with keep-alive connection pools mounted for http(s)."""
+    pool_connections = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))  # number of hosts to keep pools for
+    pool_maxsize = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))  # connections kept alive per host
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        # Block instead of opening throwaway connections when the pool is exhausted
+        pool_block=os.getenv("HTTP_POOL_BLOCK", "0") == "1",
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT})
+    return session
+
+
+def get_http_session() -> requests.Session:
+    """Get or create the global pooled session."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def http_get(url: str, params: Optional[dict] = None, timeout: Optional[Timeout] = None, **kwargs) -> requests.Response:
+    """
+    GET through the shared session.
+
+    Args:
+        timeout: Either a single read timeout in seconds (connect timeout is
+            taken from HTTP_CONNECT_TIMEOUT) or an explicit (connect, read) tuple.
+            Defaults to HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT.
+    """
+    connect_timeout, read_timeout = get_default_timeout()
+    if timeout is None:
+        timeout = (connect_timeout, read_timeout)
+    elif not isinstance(timeout, tuple):
+        timeout = (connect_timeout, float(timeout))
+    return get_http_session().get(url, params=params, timeout=timeout, **kwargs)
+
+
+def close_http_session():
+    """Close pooled connections (called on application shutdown)."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,165 @@
+"""
+In-memory cache from uploaded photos to resolved products.
+
+Users often re-upload the same photo (retries, double taps) or one that
+differs only by recompression or a slight reframe. An exact hit is found
+through the SHA-256 of the upload bytes, with no decode at all. A near hit
+is found through a 64-bit difference hash (dHash) of the decoded image,
+matched within a small Hamming distance. The dHash only needs a 9x8
+thumbnail, so a 1/8-scale JPEG decode is enough. Both paths skip barcode
+decoding, OCR and the OpenFoodFacts lookup.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+from ..models.schemas import ProductResponse
+from .metrics import increment, register_gauge
+
+
+def content_hash(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def dhash(image_bytes: bytes) -> Optional[int]:
+    """64-bit difference hash of an image, or None if it cannot be decoded."""
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    # Reduced decode is only implemented for JPEG; other formats decode normally
+    img = cv2.imdecode(nparr, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        return None
+    small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class ImageScanCache:
+    """
+    Bounded LRU of upload → ProductResponse.
+
+    Entries are keyed by content hash and also carry their dHash. A near
+    lookup scans every entry, which costs microseconds at the sizes this
+    cache is meant for (hundreds to a few thousand entries).
+    """
+
+    def __init__(self, max_entries: int = 512, max_distance: int = 6, ttl: int = 3600):
+        """
+        Args:
+            max_entries: LRU capacity.
+            max_distance: Largest Hamming distance (of 64 bits) that still
+                counts as the same photo.
+            ttl: Seconds a resolved product is reused before it is looked up again.
+        """
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl = ttl
+        # content hash -> (dhash, product, stored_at)
+        self._entries: "OrderedDict[str, Tuple[Optional[int], ProductResponse, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_exact(self, digest: str) -> Optional[ProductResponse]:
+        """Hit on identical upload bytes."""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or self._expired(digest, entry):
+                return None
+            self._entries.move_to_end(digest)
+        increment("image_cache.exact_hits")
+        return entry[1]
+
+    def get_similar(self, phash: Optional[int]) -> Optional[ProductResponse]:
+        """Closest unexpired entry within max_distance of `phash`, if any; expired entries are evicted."""
+        if phash is None:
+            return None
+        with self._lock:
+            best_key, best_distance = None, self.max_distance + 1
+            expired = []
+            now = time.time()
+            for key, (other, _, stored_at) in self._entries.items():
+                if now - stored_at > self.ttl:
+                    expired.append(key)
+                    continue
+                if other is None:
+                    continue
+                distance = (phash ^ other).bit_count()
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+            for key in expired:
+                del self._entries[key]
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            product = self._entries[best_key][1]
+        increment("image_cache.phash_hits")
+        return product
+
+    def lookup(self, image_bytes: bytes) -> Tuple[Optional[ProductResponse], str, Optional[int]]:
+        """
+        Exact, then near-duplicate lookup for an upload.
+
+        Returns:
+            (product or None, content hash, dHash). The hashes are passed back
+            to put() on a miss so the upload is not hashed twice. The dHash is
+            None on an exact hit, since it is never computed.
+        """
+        digest = content_hash(image_bytes)
+        product = self.get_exact(digest)
+        if product is not None:
+            return product, digest, None
+        phash = dhash(image_bytes)
+        product = self.get_similar(phash)
+        if product is not None:
+            # Alias the new bytes so an identical re-upload is an exact hit
+            self.put(digest, phash, product)
+            return product, digest, phash
+        increment("image_cache.misses")
+        return None, digest, phash
+
+    def put(self, digest: str, phash: Optional[int], product: ProductResponse):
+        with self._lock:
+            self._entries[digest] = (phash, product, time.time())
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                increment("image_cache.evictions")
+
+    def _expired(self, digest: str, entry) -> bool:
+        """Drop an entry past its TTL (caller holds the lock)."""
+        if time.time() - entry[2] <= self.ttl:
+            return False
+        del self._entries[digest]
+        return True
+
+
+# Global instance (singleton pattern)
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+def get_image_cache() -> Optional[ImageScanCache]:
+    """
+    Get or create the global image scan cache.
+    Returns None when disabled via IMAGE_CACHE_SIZE=0.
+    """
+    global _cache_instance
+    if _cache_instance is None:
+        size = int(os.getenv("IMAGE_CACHE_SIZE", "512"))
+        if size <= 0:
+            return None
+        with _cache_lock:
+            if _cache_instance is None:
+                _cache_instance = ImageScanCache(
+                    max_entries=size,
+                    max_distance=int(os.getenv("IMAGE_CACHE_MAX_DISTANCE", "6")),
+                    ttl=int(os.getenv("IMAGE_CACHE_TTL", "3600")),
+                )
+                register_gauge("image_cache.size", lambda: len(_cache_instance))
+    return _cache_instance
@@ -0,0 +1,212 @@
+"""
+Process pool for CPU-heavy image work (image decoding, pyzbar, EasyOCR).
+
+Running these on the event loop froze every other request on the worker for
+seconds; running them in threads still contends on the GIL. Jobs go to a
+bounded pool of worker processes instead, with a per-job timeout and
+cancellation when the client disconnects. If a worker dies (OOM, killed),
+the pool is rebuilt and only the jobs that were on it fail.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from .metrics import increment
+
+
+class ImagePoolBusy(Exception):
+    """All workers are busy and the wait queue is full."""
+
+
+class ImageJobTimeout(Exception):
+    """The job did not finish within the per-job timeout."""
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the job finished."""
+
+
+class ImageWorkerCrashed(Exception):
+    """The worker process running the job died."""
+
+
+def _worker_init(warm_up: bool):
+    """Runs once in every worker process."""
+    if warm_up:
+        from ..resolvers.image_resolver import warm_up_backends
+        warm_up_backends()
+
+
+def _worker_capabilities() -> dict:
+    from ..resolvers.image_resolver import get_capabilities
+    return get_capabilities()
+
+
+class ImageWorkerPool:
+    """
+    Bounded ProcessPoolExecutor wrapper for asyncio endpoints.
+
+    At most `max_workers` jobs run at once and at most `max_queue` more may
+    wait; beyond that submissions fail fast with ImagePoolBusy. With
+    max_workers=0 jobs run in threads instead (no extra processes).
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 8, job_timeout: float = 30.0, warm_up: bool = True):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.in_flight = 0
+        self.worker_capabilities = None
+        self.warm_up = warm_up
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def _new_executor(self):
+        if self.max_workers <= 0:
+            # A thread per admitted job: a timed-out job keeps running (threads
+            # can't be interrupted) and keeps its slot, like a process job
+            return ThreadPoolExecutor(max_workers=max(1, self.max_queue), thread_name_prefix="image-job")
+        # spawn: forking a process that already runs threads is unsafe
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_worker_init,
+            initargs=(self.warm_up,),
+        )
+
+    def _replace_broken(self, broken):
+        """Swap in a fresh process pool, once per broken executor."""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = self._new_executor()
+        increment("image_pool.rebuilt")
+        print("♻️ An image worker died; process pool rebuilt")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, fn, *args):
+        """Returns (executor, future); a pool found broken is replaced first."""
+        executor = self._executor
+        try:
+            return executor, executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._replace_broken(executor)
+            executor = self._executor
+            return executor, executor.submit(fn, *args)
+
+    def start(self):
+        """Spawn the workers now (instead of on the first image scan)."""
+        if self.max_workers <= 0:
+            return
+        future = self._executor.submit(_worker_capabilities)
+        future.add_done_callback(self._store_capabilities)
+
+    def _store_capabilities(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.worker_capabilities = future.result()
+
+    def _release(self, _future=None):
+        with self._lock:
+            self.in_flight -= 1
+
+    async def run(self, fn: Callable[..., Any], *args, request=None) -> Any:
+        """
+        Run `fn(*args)` in a worker and await the result.
+
+        Args:
+            request: Starlette request; if given, the job is cancelled when
+                the client disconnects.
+
+        Raises:
+            ImagePoolBusy, ImageJobTimeout, ClientDisconnected, ImageWorkerCrashed
+        """
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                increment("image_pool.rejected")
+                raise ImagePoolBusy()
+            self.in_flight += 1
+
+        try:
+            executor, job = self._submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        # A job that is already running can't be interrupted; it keeps its
+        # slot until it really finishes so the queue bound stays honest.
+        job.add_done_callback(self._release)
+        result = asyncio.wrap_future(job)
+
+        watcher = asyncio.ensure_future(self._wait_for_disconnect(request)) if request is not None else None
+        waiting = {result} | ({watcher} if watcher else set())
+        try:
+            done, _ = await asyncio.wait(waiting, timeout=self.job_timeout, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # The awaiting task was cancelled (e.g. another burst frame won)
+            job.cancel()
+            raise
+        finally:
+            if watcher:
+                watcher.cancel()
+
+        if result in done:
+            try:
+                value = result.result()
+            except BrokenProcessPool:
+                increment("image_pool.worker_crashes")
+                self._replace_broken(executor)
+                raise ImageWorkerCrashed()
+            increment("image_pool.completed")
+            return value
+
+        job.cancel()
+        if watcher in done:
+            increment("image_pool.cancelled_disconnect")
+            raise ClientDisconnected()
+        increment("image_pool.timeouts")
+        raise ImageJobTimeout()
+
+    @staticmethod
+    async def _wait_for_disconnect(request):
+        while not await request.is_disconnected():
+            await asyncio.sleep(0.25)
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'in_flight': self.in_flight,
+            'worker_capabilities': self.worker_capabilities,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Global instance (singleton pattern)
+_pool_instance = None
+_pool_lock = threading.Lock()
+
+def get_image_pool() -> ImageWorkerPool:
+    """Get or create the global image worker pool."""
+    global _pool_instance
+    if _pool_instance is None:
+        with _pool_lock:
+            if _pool_instance is None:
+                _pool_instance = ImageWorkerPool(
+                    max_workers=int(os.getenv("IMAGE_WORKERS", "2")),
+                    max_queue=int(os.getenv("IMAGE_QUEUE_SIZE", "8")),
+                    job_timeout=float(os.getenv("IMAGE_JOB_TIMEOUT", "30")),
+                    warm_up=os.getenv("IMAGE_BACKENDS_WARMUP", "1") == "1",
+                )
+    return _pool_instance
+
+def shutdown_image_pool():
+    global _pool_instance
+    with _pool_lock:
+        if _pool_instance is not None:
+            _pool_instance.shutdown()
+            _pool_instance = None
@@ -0,0 +1,193 @@
+"""
+Single-decode preprocessing for image scans.
+
+An upload is decoded once; everything downstream works on views derived
+from that one decode:
+- a grayscale working image capped at IMAGE_WORKING_MAX_SIDE, which feeds
+  a small pyramid of scales and rotations for barcode detection, and
+- a downscaled, text-cropped image for OCR.
+
+Phone photos are commonly 12+ megapixels. Neither pyzbar nor EasyOCR needs
+that many, so large JPEGs are decoded straight at a reduced scale and the
+working copies are ~1 MP, cutting both CPU time and peak memory.
+"""
+import os
+from typing import Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+def _env_floats(name: str, default: str) -> Tuple[float, ...]:
+    return tuple(float(v) for v in os.getenv(name, default).split(',') if v.strip())
+
+
+def jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """(width, height) from a JPEG's SOF header, without decoding; None if not a JPEG."""
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        length = int.from_bytes(data[i + 2:i + 4], 'big')
+        # SOF0..SOF15, excluding DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return width, height
+        i += 2 + length
+    return None
+
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 scale, skipping most of the IDCT work
+_REDUCED_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+
+def decode_image(image_bytes: bytes, min_side: int = 0) -> Optional[np.ndarray]:
+    """
+    Decode upload bytes to a BGR image (the only decode per scan).
+
+    JPEGs larger than needed are decoded at the largest libjpeg reduction
+    that still leaves the longest side at least `min_side` pixels.
+    """
+    flag = cv2.IMREAD_COLOR
+    size = jpeg_size(image_bytes) if min_side else None
+    if size:
+        for factor, reduced_flag in _REDUCED_FLAGS:
+            if max(size) // factor >= min_side:
+                flag = reduced_flag
+                break
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    img = cv2.imdecode(nparr, flag)
+    if img is None:
+        print("❌ Failed to decode image bytes to image")
+    return img
+
+
+def downscale(img: np.ndarray, max_side: int) -> np.ndarray:
+    """Shrink so the longest side is at most `max_side` (never upscales)."""
+    h, w = img.shape[:2]
+    longest = max(h, w)
+    if longest <= max_side:
+        return img
+    scale = max_side / longest
+    return cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def _rotate(img: np.ndarray, degrees: float) -> np.ndarray:
+    if degrees % 360 == 0:
+        return img
+    if degrees % 90 == 0:
+        turns = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}
+        return cv2.rotate(img, turns[int(degrees) % 360])
+    h, w = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), degrees, 1.0)
+    # Enlarge the canvas so the corners aren't clipped
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    new_w, new_h = int(h * sin + w * cos), int(h * cos + w * sin)
+    matrix[0, 2] += new_w / 2 - w / 2
+    matrix[1, 2] += new_h / 2 - h / 2
+    return cv2.warpAffine(img, matrix, (new_w, new_h), flags=cv2.INTER_LINEAR, borderValue=255)
+
+
+class PreparedImage:
+    """
+    One decoded upload plus the derived views used for barcode and OCR.
+
+    Views are computed lazily and cached, so an image whose barcode is found
+    on the first pyramid level never pays for the OCR preprocessing.
+    """
+
+    def __init__(self, original: np.ndarray, working_max_side: int = 1280, ocr_max_side: int = 1024):
+        self.original = original
+        self.working_max_side = working_max_side
+        self.ocr_max_side = ocr_max_side
+        self._gray = None
+
+    @classmethod
+    def from_bytes(cls, image_bytes: bytes) -> Optional['PreparedImage']:
+        working_max_side = int(os.getenv("IMAGE_WORKING_MAX_SIDE", "1280"))
+        # Keep up to ~1.5x the working size for the high-resolution fallback
+        img = decode_image(image_bytes, min_side=int(working_max_side * 1.5))
+        if img is None:
+            return None
+        return cls(img, working_max_side=working_max_side, ocr_max_side=int(os.getenv("IMAGE_OCR_MAX_SIDE", "1024")))
+
+    @property
+    def gray(self) -> np.ndarray:
+        """Grayscale working image (downscaled before conversion, which is cheaper)."""
+        if self._gray is None:
+            self._gray = cv2.cvtColor(downscale(self.original, self.working_max_side), cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    def barcode_pyramid(self, scales: Optional[Tuple[float, ...]] = None,
+                        rotations: Optional[Tuple[float, ...]] = None) -> Iterator[np.ndarray]:
+        """
+        Grayscale candidates for barcode detection, cheapest first.
+
+        Every rotation is tried at each scale before moving on to the next
+        scale. If nothing matches on the working image, the last candidate is
+        the decoded image at its own (higher) resolution, which catches small
+        or distant barcodes.
+        """
+        scales = scales or _env_floats("BARCODE_SCALES", "1.0,0.5")
+        rotations = rotations or _env_floats("BARCODE_ROTATIONS", "0,45")
+        base = self.gray
+        for scale in scales:
+            level = base if scale == 1.0 else cv2.resize(base, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            for degrees in rotations:
+                yield _rotate(level, degrees)
+        if max(self.original.shape[:2]) > self.working_max_side:
+            yield cv2.cvtColor(self.original, cv2.COLOR_BGR2GRAY)
+
+    def sharpness(self) -> float:
+        """Variance of the Laplacian of the working image; higher is sharper."""
+        return float(cv2.Laplacian(self.gray, cv2.CV_64F).var())
+
+    def ocr_image(self) -> np.ndarray:
+        """Downscaled grayscale crop around the text-dense part of the image."""
+        img = downscale(self.original, self.ocr_max_side)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        x, y, w, h = text_region(gray)
+        return gray[y:y + h, x:x + w]
+
+
+def text_region(gray: np.ndarray, margin: float = 0.04) -> Tuple[int, int, int, int]:
+    """
+    Bounding box (x, y, w, h) of the text-like strokes in a grayscale image.
+
+    Strong morphological gradients are closed horizontally into word/line
+    blobs, and the box spans every blob that looks like a text line. Falls
+    back to the whole image when nothing convincing is found.
+    """
+    h, w = gray.shape[:2]
+    full = (0, 0, w, h)
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, mask = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, w // 60), 1)))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    boxes = []
+    min_width = w * 0.03
+    for contour in contours:
+        bx, by, bw, bh = cv2.boundingRect(contour)
+        # Text lines are wider than tall and not tiny specks or the whole frame
+        if bw >= min_width and bw > bh and bh >= 6 and bh < h * 0.3:
+            boxes.append((bx, by, bx + bw, by + bh))
+    if not boxes:
+        return full
+
+    boxes = np.array(boxes)
+    x0, y0 = boxes[:, 0].min(), boxes[:, 1].min()
+    x1, y1 = boxes[:, 2].max(), boxes[:, 3].max()
+    pad_x, pad_y = int(w * margin), int(h * margin)
+    x0, y0 = max(0, x0 - pad_x), max(0, y0 - pad_y)
+    x1, y1 = min(w, x1 + pad_x), min(h, y1 + pad_y)
+    if (x1 - x0) * (y1 - y0) < 0.05 * w * h:
+        return full
+    return int(x0), int(y0), int(x1 - x0), int(y1 - y0)
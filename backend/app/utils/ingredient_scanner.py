@@ -0,0 +1,237 @@
+"""
+Finds allergens and additives in free-text ingredient lists.
+
+Many OpenFoodFacts records have empty allergens_tags even though their
+ingredients_text says "milk" or "farine de blé", and additives are often
+written out by name ("citric acid") rather than tagged. This module compiles
+every allergen synonym from the taxonomy (taxonomy.json, seven languages),
+every additive name, alias and E-number from the additive database, and a
+few "may contain" markers into one Aho-Corasick automaton. One linear pass
+over the normalized text then finds all of them at once, however many
+keywords there are, which keeps it cheap enough for bulk ingestion.
+"""
+import re
+import threading
+import unicodedata
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .additives import get_additive_db, normalize_code
+from .taxonomy import get_taxonomy
+
+# Everything after one of these is a trace, not an ingredient
+TRACE_MARKERS = [
+    'may contain', 'traces', 'trace of', 'made in a factory', 'produced in a factory',
+    'peut contenir', 'traces eventuelles', 'kann spuren', 'spuren von', 'kann enthalten',
+    'puede contener', 'trazas', 'puo contenere', 'tracce', 'kan sporen', 'sporen van', 'pode conter',
+]
+
+# Phrases containing an allergen keyword that are not that allergen
+NOT_ALLERGENS = [
+    'coconut', 'coconut milk', 'coconut cream', 'noix de coco', 'lait de coco', 'leche de coco', 'latte di cocco',
+    'nutmeg', 'noix de muscade', 'cocoa butter', 'beurre de cacao', 'manteca de cacao', 'burro di cacao',
+    'shea butter', 'cream of tartar', 'almond milk', 'soy milk', 'soya milk', 'oat milk', 'rice milk',
+    'butternut', 'milk thistle',
+]
+
+# "Free from" claims: an allergen right after one of these, or right before
+# one of FREE_SUFFIXES ("peanut-free", "gluten frei"), is absent, not present.
+# A prefix also covers allergens joined to it by "and"/"or" ("free from eggs
+# and soy"); punctuation is gone after normalization, so a bare list
+# ("free from milk, eggs") only negates the first one, erring towards flagging.
+FREE_PREFIXES = re.compile(r' (?:free from|free of|without|no|sans|sin|ohne|frei von|senza|zonder|sem) $')
+FREE_SUFFIXES = re.compile(r' (?:free|frei|vrij|libre|livre)(?= )')
+LIST_CONNECTORS = {'and', 'or', 'nor', 'et', 'ou', 'ni', 'y', 'o', 'und', 'oder', 'e', 'en'}
+
+# (kind, value); kinds: 'allergen' → canonical tag, 'additive' → code,
+# 'code' → E-number digits, 'trace_marker', 'not_allergen'
+Meaning = Tuple[str, Optional[str]]
+
+
+def normalize_text(text: str) -> str:
+    """Lower-case, strip accents, and turn punctuation into single spaces: 'Farine de Blé (12%)' → 'farine de ble 12'."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text).split())
+
+
+class AhoCorasick:
+    """Multi-pattern string matcher: reports every occurrence of every pattern in one pass."""
+
+    def __init__(self, patterns: List[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._output: List[Tuple[int, ...]] = [()]
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._output.append(())
+                state = nxt
+            self._output[state] += (index,)
+
+        # Breadth-first failure links; outputs of the failure state are merged in
+        self._fail = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target
+                self._output[nxt] += self._output[self._fail[nxt]]
+
+    def iter(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Yields (end index, pattern index) for every match; end is exclusive."""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                for index in output[state]:
+                    yield i + 1, index
+
+
+class IngredientScanner:
+    """Compiled keyword dictionary for allergens, additives and trace markers."""
+
+    def __init__(self, allergen_tags: Dict[str, str], additive_aliases: Dict[str, str], additive_codes: List[str]):
+        """
+        Args:
+            allergen_tags: Allergen tag or synonym tag ('fr:lait') → canonical tag ('en:milk').
+            additive_aliases: Lower-case additive name/alias → code.
+            additive_codes: Normalized E-numbers; matched with or without a space after the E.
+        """
+        patterns: Dict[str, List[Meaning]] = {}
+
+        def add(keyword: str, kind: str, value: Optional[str]):
+            keyword = normalize_text(keyword)
+            if len(keyword) >= 2 and (kind, value) not in patterns.get(keyword, []):
+                patterns.setdefault(keyword, []).append((kind, value))
+
+        for keyword in NOT_ALLERGENS:
+            add(keyword, 'not_allergen', None)
+        for keyword in TRACE_MARKERS:
+            add(keyword, 'trace_marker', None)
+        for tag, canonical in allergen_tags.items():
+            add(tag.split(':', 1)[-1].replace('-', ' '), 'allergen', canonical)
+        for alias, code in additive_aliases.items():
+            add(alias, 'additive', code)
+        for code in additive_codes:
+            digits = re.match(r'E(\d+)', code).group(1)
+            add(f"e{digits}", 'code', digits)
+            add(f"e {digits}", 'code', digits)
+
+        self._keywords = list(patterns)
+        self._meanings = [patterns[k] for k in self._keywords]
+        self._matcher = AhoCorasick(self._keywords)
+
+    def scan(self, ingredients_text: str) -> Dict[str, List[str]]:
+        """
+        Returns:
+            {'allergens': canonical tags, 'traces': canonical tags (after a
+            "may contain" marker), 'additives': E-numbers as written (e.g. 'E322I')
+            or, for additives named in full, their database code}
+        """
+        # Space sentinels: every keyword must start and end on a word boundary
+        text = f" {normalize_text(ingredients_text or '')} "
+        allergens, excluded, additives = [], [], []
+        trace_start = len(text)
+        for end, index in self._matcher.iter(text):
+            start = end - len(self._keywords[index])
+            if text[start - 1] != ' ':
+                continue
+            for kind, value in self._meanings[index]:
+                if kind == 'code':
+                    # Allow a variant suffix (e322i, e150d); reject longer numbers (e3301)
+                    suffix = re.match(r'[a-h]?[ivx]*(?= )', text[end:end + 6])
+                    if suffix is None:
+                        continue
+                    code = normalize_code(f"E{value}{suffix.group(0)}")
+                    if code is not None and get_additive_db().resolve(code) is not None:
+                        additives.append(code)
+                elif text[end] != ' ':
+                    continue
+                elif kind == 'trace_marker':
+                    trace_start = min(trace_start, start)
+                elif kind == 'not_allergen':
+                    excluded.append((start, end))
+                elif kind == 'allergen':
+                    allergens.append((start, end, value))
+                else:
+                    additives.append(value)
+
+        found, traces = set(), set()
+        free_end = None  # end of the last allergen negated by a "free from" prefix
+        for start, end, tag in sorted(allergens):
+            if any(s <= start and end <= e for s, e in excluded):
+                continue
+            if FREE_PREFIXES.search(text, max(0, start - 12), start) or self._continues_free_list(text, free_end, start):
+                free_end = max(free_end or 0, end)
+                continue
+            if FREE_SUFFIXES.match(text, end):
+                continue
+            (traces if start >= trace_start else found).add(tag)
+        return {
+            'allergens': sorted(found),
+            'traces': sorted(traces - found),
+            'additives': list(dict.fromkeys(additives)),
+        }
+
+    @staticmethod
+    def _continues_free_list(text: str, free_end: Optional[int], start: int) -> bool:
+        """True if only 'and'/'or' words separate this match from a negated one (or it overlaps it)."""
+        if free_end is None:
+            return False
+        if start < free_end:
+            return True
+        gap = text[free_end:start].split()
+        return bool(gap) and all(word in LIST_CONNECTORS for word in gap)
+
+
+def merge_ingredient_findings(ingredients_text: str, allergens_tags: List[str], traces_tags: List[str],
+                              additives: List[str]) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Add the allergens, traces and additives found in the ingredients text to
+    the ones a record already declares. Declared values come first and keep
+    their spelling; an additive already declared under a sub-variant or
+    parent code is not added again.
+    """
+    if not ingredients_text:
+        return allergens_tags, traces_tags, additives
+    found = get_ingredient_scanner().scan(ingredients_text)
+    allergens = list(dict.fromkeys([*allergens_tags, *found['allergens']]))
+    traces = list(dict.fromkeys([*traces_tags, *(t for t in found['traces'] if t not in allergens)]))
+    db = get_additive_db()
+    declared = {db.resolve(code) or code for code in additives}
+    merged = list(additives)
+    for code in found['additives']:
+        resolved = db.resolve(code) or code
+        if resolved not in declared:
+            declared.add(resolved)
+            merged.append(code)
+    return allergens, traces, merged
+
+
+# Global instance (singleton pattern)
+_scanner_instance = None
+_scanner_generation = None
+_scanner_lock = threading.Lock()
+
+def get_ingredient_scanner() -> IngredientScanner:
+    """Get the global scanner, rebuilding it after the additive database reloads."""
+    global _scanner_instance, _scanner_generation
+    db = get_additive_db()
+    if _scanner_instance is None or _scanner_generation != db.generation:
+        with _scanner_lock:
+            if _scanner_instance is None or _scanner_generation != db.generation:
+                generation = db.generation
+                _scanner_instance = IngredientScanner(get_taxonomy().allergen_tags, db.aliases(), db.codes())
+                _scanner_generation = generation
+    return _scanner_instance
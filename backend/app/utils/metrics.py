@@ -0,0 +1,37 @@
+"""
+Lightweight in-process metrics (counters + gauges) exposed on GET /metrics.
+"""
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict
+
+_counters: Dict[str, float] = defaultdict(float)
+_gauges: Dict[str, Callable[[], Any]] = {}
+_lock = threading.Lock()
+
+
+def increment(name: str, value: float = 1):
+    """Add `value` to a named counter."""
+    with _lock:
+        _counters[name] += value
+
+
+def register_gauge(name: str, fn: Callable[[], Any]):
+    """Register a callable evaluated each time metrics are read."""
+    with _lock:
+        _gauges[name] = fn
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Snapshot of all counters and gauges."""
+    with _lock:
+        counters = {k: (int(v) if float(v).is_integer() else v) for k, v in sorted(_counters.items())}
+        gauges = dict(_gauges)
+
+    gauge_values = {}
+    for name, fn in sorted(gauges.items()):
+        try:
+            gauge_values[name] = fn()
+        except Exception as e:
+            gauge_values[name] = f"error: {e}"
+    return {'counters': counters, 'gauges': gauge_values}
@@ -33,18 +33,73 @@ def normalize_nutrition(nutrition_data: Dict[str, Any]) -> Dict[str, float]:
     }
     return normalized
 
+_OPENERS = {'(': ')', '[': ']', '{': '}'}
+_CLOSERS = set(_OPENERS.values())
+
+def parse_ingredients(ingredients_text: str) -> List[Dict[str, Any]]:
+    """
+    Splits ingredients text into a tree, keeping sub-ingredients:
+    "chocolate (sugar, cocoa (fat-reduced)), salt" →
+    [{'text': 'chocolate', 'children': [{'text': 'sugar', ...}, {'text': 'cocoa', ...}]},
+     {'text': 'salt', 'children': []}]
+    Items are separated by commas (other than decimal commas) or semicolons
+    at their own bracket depth. Unbalanced brackets are tolerated.
+    """
+    root: List[Dict[str, Any]] = []
+    # (items at this depth, text of the current item, its children, closing bracket)
+    stack = [(root, [], [], None)]
+    ingredients_text = ingredients_text or ''
+    for i, ch in enumerate(ingredients_text):
+        items, text, children, closer = stack[-1]
+        if ch in _OPENERS:
+            stack.append(([], [], [], _OPENERS[ch]))
+        elif ch in _CLOSERS and len(stack) > 1 and ch == closer:
+            _close_item(items, text, children)
+            stack.pop()
+            stack[-1][2].extend(items)
+        elif ch in _CLOSERS:
+            continue  # stray closing bracket
+        elif ch == ',' and 0 < i < len(ingredients_text) - 1 \
+                and ingredients_text[i - 1].isdigit() and ingredients_text[i + 1].isdigit():
+            text.append(ch)  # decimal comma: "8,7%"
+        elif ch in ',;':
+            _close_item(items, text, children)
+            stack[-1] = (items, [], [], closer)
+        else:
+            text.append(ch)
+    # Close anything left open
+    while len(stack) > 1:
+        items, text, children, _ = stack.pop()
+        _close_item(items, text, children)
+        stack[-1][2].extend(items)
+    _close_item(*stack[0][:3])
+    return root
+
+def _close_item(items: List[Dict[str, Any]], text: List[str], children: List[Dict[str, Any]]):
+    name = ' '.join(''.join(text).split())
+    if name:
+        items.append({'text': name, 'children': list(children)})
+    elif children:
+        # "(a, b)" with no name of its own: keep the sub-ingredients at this level
+        items.extend(children)
+
 def normalize_ingredients(ingredients_text: str) -> List[str]:
-    """Cleans up ingredients text and returns a list."""
+    """
+    Cleans up ingredients text and returns every ingredient, sub-ingredients
+    right after their parent (see parse_ingredients):
+    "chocolate (sugar, cocoa), salt" → ['chocolate', 'sugar', 'cocoa', 'salt'].
+    Bracketed notes without a name, like "(45%)", are dropped.
+    """
     if not ingredients_text:
         return []
-        
-    # Remove marketing noise like 'Fresh', 'Premium', etc if needed.
-    # For now, splitting by comma and stripping whitespace.
-    # Also clean up HTML entities, weird characters
-    
-    cleaned = re.sub(r'[\(\[\{].*?[\)\]\}]', '', ingredients_text) # Remove parenthesis info for now
-    items = [item.strip() for item in cleaned.split(',')]
-    return [item for item in items if item]
+    names = []
+    stack = list(reversed(parse_ingredients(ingredients_text)))
+    while stack:
+        item = stack.pop()
+        if re.search(r'[^\W\d_]', item['text']):
+            names.append(item['text'])
+        stack.extend(reversed(item['children']))
+    return names
 
 def extract_additives(additives_tags: List[str]) -> List[str]:
     """Extracts additive codes (e.g., E330)."""
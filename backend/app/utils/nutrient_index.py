@@ -0,0 +1,186 @@
+"""
+Nearest-neighbour index over product nutrient vectors.
+
+Used to find "healthier swaps": products that are nutritionally similar to
+the scanned one (so they are plausible replacements) but score higher for
+the user. The index is a blocked brute-force search over a float32 NumPy
+matrix — exact, allocation-light, and fast enough for millions of rows —
+and grows incrementally as the local product store is updated.
+"""
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# Normalized nutrition fields + NOVA, with the scale that makes one unit
+# of distance roughly "one meaningful step" in each dimension.
+VECTOR_FIELDS = [
+    ('energy_kcal_100g', 100.0),
+    ('fat_100g', 10.0),
+    ('saturated_fat_100g', 5.0),
+    ('carbohydrates_100g', 20.0),
+    ('sugars_100g', 10.0),
+    ('proteins_100g', 5.0),
+    ('salt_100g', 0.5),
+    ('fiber_100g', 3.0),
+    ('nova_group', 1.0),
+]
+_SCALES = np.array([s for _, s in VECTOR_FIELDS], dtype=np.float32)
+
+
+def to_vector(product: Dict) -> np.ndarray:
+    """Scaled nutrient vector for a flat product/candidate dict."""
+    values = []
+    for field, _ in VECTOR_FIELDS:
+        try:
+            values.append(float(product.get(field) or (4 if field == 'nova_group' else 0)))
+        except (TypeError, ValueError):
+            values.append(4.0 if field == 'nova_group' else 0.0)
+    return np.asarray(values, dtype=np.float32) / _SCALES
+
+
+class NutrientIndex:
+    """
+    Exact k-NN over scaled nutrient vectors.
+
+    Rows are kept in a preallocated matrix that doubles when full; updating
+    an existing barcode overwrites its row in place, so incremental syncs
+    never require a full rebuild.
+    """
+
+    def __init__(self, block_size: int = 65536):
+        self.block_size = block_size
+        self._vectors = np.empty((1024, len(VECTOR_FIELDS)), dtype=np.float32)
+        self._norms = np.empty(1024, dtype=np.float32)  # squared row norms
+        self._barcodes: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self.synced_until = 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self._barcodes)
+
+    def add_many(self, items: Iterable[Tuple[str, Dict]]):
+        """Insert or update (barcode, product) pairs."""
+        with self._lock:
+            for barcode, product in items:
+                pos = self._positions.get(barcode)
+                if pos is None:
+                    pos = len(self._barcodes)
+                    if pos >= self._vectors.shape[0]:
+                        grown = np.empty((self._vectors.shape[0] * 2, self._vectors.shape[1]), dtype=np.float32)
+                        grown[:pos] = self._vectors[:pos]
+                        self._vectors = grown
+                        self._norms = np.resize(self._norms, grown.shape[0])
+                    self._barcodes.append(barcode)
+                    self._positions[barcode] = pos
+                vector = to_vector(product)
+                self._vectors[pos] = vector
+                self._norms[pos] = vector @ vector
+
+    def query(self, product: Dict, k: int = 50, exclude: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """
+        The k nearest barcodes to `product` as (barcode, distance), closest first.
+        """
+        exclude = exclude or set()
+        target = to_vector(product)
+        want = k + len(exclude)
+
+        with self._lock:
+            n = self.size
+            if n == 0:
+                return []
+            best_idx = np.empty(0, dtype=np.int64)
+            best_dist = np.empty(0, dtype=np.float32)
+            for start in range(0, n, self.block_size):
+                end = min(start + self.block_size, n)
+                # |v - t|² = |v|² - 2 v·t + |t|²  (one BLAS mat-vec per block)
+                dist = self._norms[start:end] - 2.0 * (self._vectors[start:end] @ target)
+                if dist.shape[0] > want:
+                    top = np.argpartition(dist, want)[:want]
+                else:
+                    top = np.arange(dist.shape[0])
+                best_idx = np.concatenate([best_idx, top + start])
+                best_dist = np.concatenate([best_dist, dist[top]])
+                if best_dist.shape[0] > want:
+                    keep = np.argpartition(best_dist, want)[:want]
+                    best_idx, best_dist = best_idx[keep], best_dist[keep]
+
+            best_dist = np.maximum(best_dist + target @ target, 0.0)
+            order = np.argsort(best_dist, kind='stable')
+            results = []
+            for i in order:
+                barcode = self._barcodes[best_idx[i]]
+                if barcode in exclude:
+                    continue
+                results.append((barcode, float(np.sqrt(best_dist[i]))))
+                if len(results) == k:
+                    break
+            return results
+
+    def sync_from_store(self, store) -> int:
+        """Pull products added or updated in the store since the last sync."""
+        started = time.time()
+        count = 0
+        batch = []
+        newest = self.synced_until
+        for barcode, candidate, updated_at in store.iter_candidates(since=self.synced_until):
+            batch.append((barcode, candidate))
+            newest = max(newest, updated_at)
+            if len(batch) >= 10000:
+                self.add_many(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.add_many(batch)
+            count += len(batch)
+        self.synced_until = newest
+        if count:
+            print(f"🧭 Nutrient index synced {count:,} products in {time.time() - started:.1f}s (size {self.size:,})")
+        return count
+
+
+# Global instance (singleton pattern)
+_index_instance = None
+_index_lock = threading.Lock()
+_sync_running = False
+_last_sync = 0.0
+
+def get_nutrient_index() -> Optional[NutrientIndex]:
+    """
+    Get the global nutrient index, or None if there is no local product store.
+
+    The index is (re)synced from the store in a background thread at most
+    every NUTRIENT_INDEX_SYNC_INTERVAL seconds; until the first sync finishes
+    it is simply empty.
+    """
+    global _index_instance, _sync_running, _last_sync
+    from .product_store import get_product_store
+
+    store = get_product_store()
+    if store is None:
+        return None
+
+    with _index_lock:
+        if _index_instance is None:
+            _index_instance = NutrientIndex()
+        interval = float(os.getenv("NUTRIENT_INDEX_SYNC_INTERVAL", "300"))
+        if not _sync_running and time.time() - _last_sync >= interval:
+            _sync_running = True
+            _last_sync = time.time()
+            threading.Thread(target=_background_sync, args=(_index_instance, store),
+                             name="nutrient-index-sync", daemon=True).start()
+    return _index_instance
+
+def _background_sync(index: NutrientIndex, store):
+    global _sync_running
+    try:
+        index.sync_from_store(store)
+    except Exception as e:
+        print(f"⚠️ Nutrient index sync failed: {e}")
+    finally:
+        with _index_lock:
+            _sync_running = False
@@ -1,28 +1,73 @@
 """
 ML Model Integration Module for Personalized Food Scoring
 """
+import hashlib
 import numpy as np
-import joblib
 import os
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Optional
+
+from ..models.schemas import ProductRecord, ProductResponse
+from .additives import get_additive_db
+from .metrics import increment
+from .score_cache import get_score_memo, profile_bitmask
+from .taxonomy import get_taxonomy
+from .tree_model import TreeEnsembleModel
+
+# Bump whenever the thresholds, weights or modifiers in _fallback_scoring
+# change, so memoized scores from the old rules are never served
+RULES_VERSION = 1
+
+# Scoring-relevant profile flags (the model's user features), in bitmask order
+PROFILE_FLAGS = [
+    'has_hypertension', 'has_diabetes', 'has_high_cholesterol',
+    'gluten_intolerance', 'peanut_allergy', 'lactose_intolerance',
+    'egg_allergy', 'goal_weight_loss', 'goal_muscle_gain',
+]
+
+# Threshold ladders of _fallback_scoring as (thresholds, scores) tables for
+# predict_batch. "<=" ladders bucket with searchsorted(side='left'), ">="
+# ladders with side='right'; keep both in sync with the scalar code.
+_SUGAR_LADDER = ([2, 5, 10, 15, 22.5], [100, 85, 65, 45, 25, 5])
+_SALT_LADDER = ([0.1, 0.3, 0.6, 1.0, 1.5], [100, 85, 65, 40, 20, 5])
+_SAT_FAT_LADDER = ([1, 2, 3.5, 5, 8], [100, 80, 60, 35, 15, 5])
+_CALORIE_LADDER = ([100, 200, 300, 400, 500, 600], [90, 80, 65, 50, 35, 20, 10])
+_FIBER_LADDER = ([0.5, 1.5, 3, 6], [10, 30, 50, 75, 100])
+_PROTEIN_LADDER = ([2, 5, 10, 15, 20], [25, 40, 55, 70, 85, 100])
+
+# (user feature, product feature) pairs that force a score of 0
+_ALLERGEN_STOPS = [
+    ('peanut_allergy', 'contains_peanut'),
+    ('gluten_intolerance', 'contains_gluten'),
+    ('lactose_intolerance', 'contains_milk'),
+    ('egg_allergy', 'contains_egg'),
+]
+
+
+def _bucket(values: np.ndarray, ladder, side: str) -> np.ndarray:
+    thresholds, scores = ladder
+    return np.asarray(scores, dtype=np.float64)[np.searchsorted(thresholds, values, side=side)]
+
+
+def _file_sha256(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _round1(scores: np.ndarray) -> np.ndarray:
+    """Elementwise round(x, 1) with Python's exact tie handling."""
+    rounded = np.round(scores, 1)
+    # np.round scales by 10 first, which can land on the other side of a tie
+    tens = scores * 10
+    near_tie = np.abs(tens - np.floor(tens) - 0.5) < 1e-6
+    for idx in zip(*np.nonzero(near_tie)):
+        rounded[idx] = round(float(scores[idx]), 1)
+    return rounded
 
 class PersonalizationEngine:
     """
     Handles loading the ML model and making personalized predictions.
     """
     
-    # Define feature order (must match training order)
-    FEATURE_ORDER = [
-        # Product features
-        'energy_kcal_100g', 'sugar_100g', 'fat_100g', 'saturated_fat_100g',
-        'salt_100g', 'fiber_100g', 'protein_100g', 'nova_group',
-        'contains_gluten', 'contains_peanut', 'contains_milk', 'contains_egg',
-        # User features
-        'has_hypertension', 'has_diabetes', 'has_high_cholesterol',
-        'gluten_intolerance', 'peanut_allergy', 'lactose_intolerance',
-        'egg_allergy', 'goal_weight_loss', 'goal_muscle_gain'
-    ]
-    
     def __init__(self, model_path: str = None):
         """Initialize the personalization engine."""
         if model_path is None:
@@ -31,14 +76,42 @@ class PersonalizationEngine:
         
         self.model_path = model_path
         self.model = None
+        self._ml_layout = None
+        self._ml_regressor = None
         self._load_model()
+        self.scoring_version = self._scoring_version()
+        memo = get_score_memo()
+        if memo is not None:
+            memo.clear()
     
     def _load_model(self):
-        """Load the trained model from disk."""
+        """
+        Load the trained model from disk.
+
+        Prefers the NumPy export (personalization_model.npz, written by
+        export_model.py), which needs no sklearn. Falls back to the pickled
+        sklearn pipeline if the export is missing, was made from a
+        different pickle, or fails its reference-row parity check.
+        """
         try:
+            export_path = os.path.splitext(self.model_path)[0] + '.npz'
+            if os.path.exists(export_path):
+                exported = TreeEnsembleModel.load(export_path)
+                if os.path.exists(self.model_path) and exported.source_sha256 != _file_sha256(self.model_path):
+                    print(f"⚠️ {export_path} was exported from a different model; re-run export_model.py")
+                elif not self._export_matches(exported):
+                    print(f"⚠️ {export_path} does not reproduce the model's reference outputs; re-run export_model.py")
+                else:
+                    self.model = exported
+                    self._ml_layout = exported.layout
+                    self._ml_regressor = exported
+                    print(f"✅ Personalization model loaded from {export_path} (NumPy evaluator)")
+                    return
             if os.path.exists(self.model_path):
+                import joblib  # only needed for the sklearn pickle
                 self.model = joblib.load(self.model_path)
                 print(f"✅ Personalization model loaded from {self.model_path}")
+                self._prepare_ml_inputs()
             else:
                 print(f"⚠️ Warning: Model file not found at {self.model_path}")
                 print("   The engine will use fallback rule-based scoring.")
@@ -46,28 +119,145 @@ class PersonalizationEngine:
             print(f"❌ Error loading model: {e}")
             self.model = None
     
-    def _map_product_to_features(self, product_data: dict) -> dict:
+    @staticmethod
+    def _export_matches(exported: TreeEnsembleModel, tolerance: float = 1e-6) -> bool:
+        """Re-score the export's stored reference rows and compare with sklearn's outputs."""
+        if not exported.check_rows:
+            print("⚠️ Model export has no reference rows to check; re-run export_model.py")
+            return True
+        engine = PersonalizationEngine.__new__(PersonalizationEngine)
+        engine._ml_layout = exported.layout
+        # One row per "product" against an empty user: every column comes from the product side
+        actual = exported.predict(engine._ml_matrix(exported.check_rows, [{}]))
+        diff = float(np.abs(actual - exported.check_expected).max())
+        if diff > tolerance:
+            increment("personalization.export_check_failures")
+            return False
+        return True
+
+    def _scoring_version(self) -> str:
+        """Identifies the rules + model in use; part of every score memo key."""
+        if isinstance(self.model, TreeEnsembleModel):
+            model_id = self.model.source_sha256
+        elif self._ml_layout is not None:
+            model_id = _file_sha256(self.model_path)
+        else:
+            model_id = 'rules-only'
+        rules = repr((RULES_VERSION, _SUGAR_LADDER, _SALT_LADDER, _SAT_FAT_LADDER,
+                      _CALORIE_LADDER, _FIBER_LADDER, _PROTEIN_LADDER, _ALLERGEN_STOPS))
+        return hashlib.sha256(f"{rules}|{model_id}".encode()).hexdigest()[:16]
+
+    def _memo_key(self, product_data: dict, product_features: dict, user_features: dict) -> tuple:
+        product_id = product_data.get('product_id') or product_data.get('code')
+        return (self.scoring_version, product_id, tuple(product_features.values()),
+                profile_bitmask(user_features, PROFILE_FLAGS))
+
+    def recommendation_key(self, product_data: dict, user_profile: dict) -> tuple:
+        """
+        Recommendations depend on everything the product's score does (its
+        memo key) plus the category searched for alternatives.
+        """
+        return (*self._memo_key(product_data, self._map_product_to_features(product_data),
+                                self._map_user_to_features(user_profile)),
+                self._search_category(product_data))
+
+    @staticmethod
+    def _search_category(product_data: dict) -> str:
+        """Category tag searched for alternatives: the most specific useful one."""
+        cat_tags = product_data.get('categories_tags', [])
+        # Filter for useful categories (avoid generic ones like 'en:food')
+        useful_cats = [c for c in cat_tags if not c.startswith('en:label') and len(c) > 5 and ':' in c]
+        # The last tag is usually the most specific
+        return useful_cats[-1] if useful_cats else "en:snacks"
+
+    def _prepare_ml_inputs(self):
+        """
+        Read the fitted preprocessing out of the saved Pipeline
+        (ColumnTransformer of StandardScaler + OneHotEncoder, then the
+        regressor) so inference can build the model matrix from plain
+        feature dicts, without a pandas DataFrame.
+        """
+        try:
+            preprocessor, regressor = self.model.steps[0][1], self.model.steps[-1][1]
+            layout = []
+            for name, transformer, columns in preprocessor.transformers_:
+                if transformer == 'drop' or not len(columns):
+                    continue
+                kind = type(transformer).__name__
+                if kind == 'StandardScaler':
+                    mean = transformer.mean_ if transformer.with_mean else np.zeros(len(columns))
+                    scale = transformer.scale_ if transformer.with_std else np.ones(len(columns))
+                    layout.append(('scale', list(columns), (mean, scale)))
+                elif kind == 'OneHotEncoder':
+                    layout.append(('onehot', list(columns), transformer.categories_))
+                elif transformer == 'passthrough':
+                    layout.append(('scale', list(columns), (np.zeros(len(columns)), np.ones(len(columns)))))
+                else:
+                    raise ValueError(f"unsupported transformer {name}: {kind}")
+            self._ml_layout = layout
+            self._ml_regressor = regressor
+        except Exception as e:
+            print(f"⚠️ Model pipeline not recognized ({e}); ML adjustment disabled.")
+            self._ml_layout = None
+
+    def _ml_matrix(self, product_features: List[dict], user_features: List[dict]) -> np.ndarray:
+        """
+        Model input rows for every (product, user) pair, product-major,
+        transformed exactly as the fitted ColumnTransformer would.
+        """
+        n, m = len(product_features), len(user_features)
+        blocks = []
+        for kind, columns, params in self._ml_layout:
+            if kind == 'scale':
+                block = np.empty((n, m, len(columns)))
+                for i, col in enumerate(columns):
+                    if col in user_features[0]:
+                        block[:, :, i] = np.array([float(u[col]) for u in user_features])[None, :]
+                    else:
+                        block[:, :, i] = np.array([float(p.get(col, 0) or 0) for p in product_features])[:, None]
+                mean, scale = params
+                blocks.append(((block - mean) / scale).reshape(n * m, len(columns)))
+            else:
+                for col, categories in zip(columns, params):
+                    source = user_features if col in user_features[0] else product_features
+                    values = np.array([f.get(col) for f in source], dtype=object)
+                    # Unknown categories encode as all zeros (handle_unknown='ignore')
+                    onehot = (values[:, None] == categories[None, :]).astype(np.float64)
+                    if source is user_features:
+                        onehot = np.broadcast_to(onehot[None, :, :], (n, m, len(categories)))
+                    else:
+                        onehot = np.broadcast_to(onehot[:, None, :], (n, m, len(categories)))
+                    blocks.append(onehot.reshape(n * m, len(categories)))
+        return np.hstack(blocks)
+
+    def _ml_scores(self, product_features: List[dict], user_features: List[dict]) -> Optional[np.ndarray]:
+        """
+        Clamped model predictions as an (N, M) array, from a single model
+        call per batch. None when the model is unavailable or fails.
+        """
+        if self._ml_layout is None:
+            return None
+        try:
+            X = self._ml_matrix(product_features, user_features)
+            raw = self._ml_regressor.predict(X)
+            return np.clip(raw, 0.0, 100.0).reshape(len(product_features), len(user_features))
+        except Exception as e:
+            increment("personalization.ml_failures")
+            print(f"⚠️ ML model adjustment failed: {e}. Using pure rule-based score.")
+            return None
+
+    @staticmethod
+    def _map_product_to_features(product_data: dict) -> dict:
         """
         Convert API product data to model input features.
         Reads from the correctly-keyed product dict (post schema fix).
         """
-        # Category mapping — read from the now-preserved categories_tags field
-        cat_tags = [t.lower() for t in product_data.get('categories_tags', [])]
-
-        model_category = 'Snack'  # Default
-        if any('beverage' in t or 'drink' in t for t in cat_tags):
-            model_category = 'Beverage'
-        elif any('dairy' in t or 'milk' in t for t in cat_tags):
-            model_category = 'Dairy'
-        elif any('cereal' in t or 'breakfast' in t for t in cat_tags):
-            model_category = 'Cereal'
-        elif any('meal' in t or 'ready' in t for t in cat_tags):
-            model_category = 'Ready-Meal'
-
-        # Allergens — read from the now-preserved allergens_tags / traces_tags
-        allergens = str(product_data.get('allergens_tags', [])).lower()
-        traces = str(product_data.get('traces_tags', [])).lower()
-        combined_allergens = allergens + " " + traces
+        # Category and allergens — whole-tag lookups in the compiled
+        # taxonomy index (categories inherit from their parents)
+        taxonomy = get_taxonomy()
+        model_category = taxonomy.model_category(product_data.get('categories_tags') or [])
+        allergen_flags = taxonomy.allergen_flags(
+            (product_data.get('allergens_tags') or []) + (product_data.get('traces_tags') or []))
 
         # NOVA: stored directly on ProductResponse (not inside nutrition)
         nova = product_data.get('nova_group', None)
@@ -89,38 +279,22 @@ class PersonalizationEngine:
             # protein key is 'proteins_100g' in NutritionInfo
             'protein_100g': product_data.get('proteins_100g') or 0,
             'nova_group': nova,
-            'contains_gluten': 1 if 'gluten' in combined_allergens else 0,
-            'contains_peanut': 1 if ('peanut' in combined_allergens or 'nut' in combined_allergens) else 0,
-            'contains_milk': 1 if ('milk' in combined_allergens or 'dairy' in combined_allergens) else 0,
-            'contains_egg': 1 if 'egg' in combined_allergens else 0,
+            'contains_gluten': int('contains_gluten' in allergen_flags),
+            'contains_peanut': int('contains_peanut' in allergen_flags),
+            'contains_milk': int('contains_milk' in allergen_flags),
+            'contains_egg': int('contains_egg' in allergen_flags),
         }
     
     def _map_user_to_features(self, user_profile: dict) -> dict:
         """Convert user profile to model input features."""
-        return {
-            'has_hypertension': int(user_profile.get('has_hypertension', False)),
-            'has_diabetes': int(user_profile.get('has_diabetes', False)),
-            'has_high_cholesterol': int(user_profile.get('has_high_cholesterol', False)),
-            'gluten_intolerance': int(user_profile.get('gluten_intolerance', False)),
-            'peanut_allergy': int(user_profile.get('peanut_allergy', False)),
-            'lactose_intolerance': int(user_profile.get('lactose_intolerance', False)),
-            'egg_allergy': int(user_profile.get('egg_allergy', False)),
-            'goal_weight_loss': int(user_profile.get('goal_weight_loss', False)),
-            'goal_muscle_gain': int(user_profile.get('goal_muscle_gain', False)),
-        }
+        return {flag: int(user_profile.get(flag, False)) for flag in PROFILE_FLAGS}
     
-    def _fallback_scoring(self, product_features: dict, user_features: dict) -> Tuple[float, List[str], List[str]]:
+    @staticmethod
+    def _base_scoring(product_features: dict) -> Tuple[float, List[str]]:
         """
-        Two-phase scoring engine:
-        Phase 1 – Inherent Nutritional Quality (50 pts baseline):
-            Uses WHO/NHS benchmarks to evaluate sugar, salt, saturated fat,
-            calories, fiber, and protein. Produces varied scores for any product
-            even with a blank user profile (e.g. Nutella ≈ 30, plain yogurt ≈ 70).
-        Phase 2 – Personalization Modifiers (±30 pts):
-            Adjusts score based on the user's specific health conditions,
-            allergies, and fitness goals.
+        Phase 1 of _fallback_scoring: the user-independent nutritional
+        quality score (unrounded) and its reasons.
         """
-        warnings = []
         reasons = []
 
         # ──────────────────────────────────────────────────────────────
@@ -233,6 +407,35 @@ class PersonalizationEngine:
         if protein >= 15:
             reasons.append(f"High protein content — {protein:.1f}g per 100g ✅")
 
+        return base_score, reasons
+
+    def _fallback_scoring(self, product_features: dict, user_features: dict,
+                          base: Optional[Tuple[float, List[str]]] = None) -> Tuple[float, List[str], List[str]]:
+        """
+        Two-phase scoring engine:
+        Phase 1 – Inherent Nutritional Quality (50 pts baseline):
+            Uses WHO/NHS benchmarks to evaluate sugar, salt, saturated fat,
+            calories, fiber, and protein. Produces varied scores for any product
+            even with a blank user profile (e.g. Nutella ≈ 30, plain yogurt ≈ 70).
+        Phase 2 – Personalization Modifiers (±30 pts):
+            Adjusts score based on the user's specific health conditions,
+            allergies, and fitness goals.
+
+        Phase 1 is user-independent; pass its precomputed (base_score,
+        base_reasons) as `base` to skip it.
+        """
+        warnings = []
+        if base is None:
+            base = self._base_scoring(product_features)
+        base_score, base_reasons = base
+        reasons = list(base_reasons)
+
+        sugar      = product_features.get('sugar_100g', 0) or 0
+        salt       = product_features.get('salt_100g', 0) or 0
+        sat_fat    = product_features.get('saturated_fat_100g', 0) or 0
+        calories   = product_features.get('energy_kcal_100g', 0) or 0
+        protein    = product_features.get('protein_100g', 0) or 0
+
         # ──────────────────────────────────────────────────────────────
         # PHASE 2 — PERSONALISATION MODIFIERS  (±30 pts max)
         # ──────────────────────────────────────────────────────────────
@@ -358,29 +561,177 @@ class PersonalizationEngine:
         product_features = self._map_product_to_features(product_data)
         user_features = self._map_user_to_features(user_profile)
 
+        memo = get_score_memo()
+        if memo is not None:
+            key = self._memo_key(product_data, product_features, user_features)
+            hit = memo.get(key, need_reasons=True)
+            if hit is not None:
+                return hit[0], list(hit[1]), list(hit[2])
+
+        score, reasons, warnings = self._score(product_features, user_features, stored_base_score(product_data))
+        if memo is not None:
+            memo.put(key, (score, tuple(reasons), tuple(warnings)))
+        return score, reasons, warnings
+
+    def predict_many(self, products: List[dict], user_profile: dict) -> List[Tuple[float, List[str], List[str]]]:
+        """
+        predict() for several products and one user, with a single ML model
+        call for every product that is not memoized (the rules still run per
+        product, since they produce the reasons and warnings).
+        """
+        user_features = self._map_user_to_features(user_profile)
+        memo = get_score_memo()
+        results: List[Optional[Tuple[float, List[str], List[str]]]] = [None] * len(products)
+        keys, computed, blend = [None] * len(products), [], []
+        for i, product_data in enumerate(products):
+            product_features = self._map_product_to_features(product_data)
+            if memo is not None:
+                keys[i] = self._memo_key(product_data, product_features, user_features)
+                hit = memo.get(keys[i], need_reasons=True)
+                if hit is not None:
+                    results[i] = (hit[0], list(hit[1]), list(hit[2]))
+                    continue
+            computed.append(i)
+            results[i] = self._fallback_scoring(product_features, user_features, stored_base_score(product_data))
+            # Allergen hard-stops stay at 0; the model never nudges them back up
+            if not results[i][2]:
+                blend.append((i, product_features))
+
+        ml_scores = self._ml_scores([f for _, f in blend], [user_features]) if blend else None
+        if ml_scores is not None:
+            for (i, _), ml_score in zip(blend, ml_scores[:, 0]):
+                rule_score, reasons, warnings = results[i]
+                blended = (rule_score * 0.90) + (float(ml_score) * 0.10)
+                results[i] = (round(min(100.0, max(0.0, blended)), 1), reasons, warnings)
+
+        if memo is not None:
+            for i in computed:
+                score, reasons, warnings = results[i]
+                memo.put(keys[i], (score, tuple(reasons), tuple(warnings)))
+        return results
+
+    def _score(self, product_features: dict, user_features: dict,
+               base: Optional[Tuple[float, List[str]]] = None) -> Tuple[float, List[str], List[str]]:
+        """Uncached predict(): rule-based score plus the ML nudge."""
         # PRIMARY: Rule-based engine — always run this for the real score
-        rule_score, reasons, warnings = self._fallback_scoring(product_features, user_features)
+        rule_score, reasons, warnings = self._fallback_scoring(product_features, user_features, base)
+
+        # Allergen hard-stops stay at 0; the model never nudges them back up
+        if warnings:
+            return rule_score, reasons, warnings
 
         # SECONDARY: ML model as a minor confidence nudge only (±5 pts max)
-        if self.model:
-            try:
-                combined = {**product_features, **user_features}
-                feature_values = [combined.get(feat, 0) for feat in self.FEATURE_ORDER]
-                input_array = np.array([feature_values])
-                ml_raw = float(self.model.predict(input_array)[0])
-                ml_clamped = min(100.0, max(0.0, ml_raw))
-
-                # Blend: 90% rule-based + 10% ML (caps model influence at ±5 pts)
-                blended = (rule_score * 0.90) + (ml_clamped * 0.10)
-                final_score = round(min(100.0, max(0.0, blended)), 1)
-                print(f"📊 Score: rule={rule_score}, ml={ml_clamped:.1f}, blended={final_score}")
-                return final_score, reasons, warnings
-
-            except Exception as e:
-                print(f"⚠️ ML model adjustment failed: {e}. Using pure rule-based score.")
+        ml_scores = self._ml_scores([product_features], [user_features])
+        if ml_scores is not None:
+            ml_clamped = float(ml_scores[0, 0])
+            # Blend: 90% rule-based + 10% ML (caps model influence at ±5 pts)
+            blended = (rule_score * 0.90) + (ml_clamped * 0.10)
+            final_score = round(min(100.0, max(0.0, blended)), 1)
+            print(f"📊 Score: rule={rule_score}, ml={ml_clamped:.1f}, blended={final_score}")
+            return final_score, reasons, warnings
 
         return rule_score, reasons, warnings
 
+    def predict_batch(self, products: List[dict], user_profiles: List[dict]) -> np.ndarray:
+        """
+        Score N products for M user profiles at once.
+
+        Same numbers as predict(), computed as array operations: component
+        scores by threshold bucketing, the NOVA multiplier, personalization
+        modifiers and allergen hard-stops, then the ML blend from a single
+        model call for the whole batch. Reasons and warnings are not
+        produced; use predict() for those.
+
+        Returns:
+            (N, M) float array of scores.
+        """
+        if not products or not user_profiles:
+            return np.zeros((len(products), len(user_profiles)))
+
+        product_features = [self._map_product_to_features(p) for p in products]
+        user_features = [self._map_user_to_features(u) for u in user_profiles]
+
+        def column(name, default=0):
+            return np.array([float(f.get(name, default) or default) for f in product_features])
+
+        def user_flags(name):
+            # Row vector (1, M) so it broadcasts against product columns (N, 1)
+            return np.array([bool(f.get(name)) for f in user_features])[None, :]
+
+        sugar, salt, sat_fat = column('sugar_100g'), column('salt_100g'), column('saturated_fat_100g')
+        calories, fiber, protein = column('energy_kcal_100g'), column('fiber_100g'), column('protein_100g')
+        nova = column('nova_group', 4).astype(int)
+
+        # Phase 1 — inherent nutritional quality, per product: persisted
+        # base scores where present, computed for the rest
+        stored = [stored_base_score(p) for p in products]
+        base_score = np.array([b[0] if b else np.nan for b in stored])
+        todo = np.isnan(base_score)
+        if todo.any():
+            nova_mult = np.select([nova == 1, nova == 2, nova == 3], [1.0, 0.95, 0.88], 0.78)
+            base_score[todo] = ((
+                _bucket(sugar[todo], _SUGAR_LADDER, 'left')      * 0.25 +
+                _bucket(salt[todo], _SALT_LADDER, 'left')        * 0.20 +
+                _bucket(sat_fat[todo], _SAT_FAT_LADDER, 'left')  * 0.18 +
+                _bucket(calories[todo], _CALORIE_LADDER, 'left') * 0.15 +
+                _bucket(fiber[todo], _FIBER_LADDER, 'right')     * 0.12 +
+                _bucket(protein[todo], _PROTEIN_LADDER, 'right') * 0.10
+            ) * nova_mult[todo])
+
+        # Phase 2 — personalization modifiers, per (product, user)
+        sugar, salt, sat_fat = sugar[:, None], salt[:, None], sat_fat[:, None]
+        calories, protein = calories[:, None], protein[:, None]
+        modifier = np.zeros((len(products), len(user_profiles)))
+        modifier += user_flags('has_hypertension') * np.select([salt > 1.5, salt > 0.6, salt <= 0.3], [-20, -10, 5], 0)
+        modifier += user_flags('has_diabetes') * np.select([sugar > 22.5, sugar > 10, sugar <= 5], [-25, -15, 5], 0)
+        modifier += user_flags('has_high_cholesterol') * np.select([sat_fat > 5, sat_fat > 3, sat_fat <= 1.5], [-15, -8, 5], 0)
+        modifier += user_flags('goal_weight_loss') * np.select(
+            [(calories > 450) & (sugar > 15), (calories <= 200) & (sugar <= 5)], [-12, 8], 0)
+        modifier += user_flags('goal_muscle_gain') * np.select([protein >= 20, protein >= 10, protein < 3], [12, 5, -8], 0)
+        modifier += user_flags('goal_high_protein') * np.select([protein >= 15, protein < 5], [8, -8], 0)
+        modifier += user_flags('goal_low_carb') * np.select([sugar > 15, sugar <= 5], [-10, 8], 0)
+        modifier = np.clip(modifier, -30.0, 30.0)
+
+        scores = _round1(np.clip(base_score[:, None] + modifier, 0.0, 100.0))
+
+        ml_scores = self._ml_scores(product_features, user_features)
+        if ml_scores is not None:
+            scores = _round1(np.clip(scores * 0.90 + ml_scores * 0.10, 0.0, 100.0))
+
+        unsafe = np.zeros(scores.shape, dtype=bool)
+        for user_flag, product_flag in _ALLERGEN_STOPS:
+            contains = np.array([bool(f.get(product_flag)) for f in product_features])[:, None]
+            unsafe |= user_flags(user_flag) & contains
+        scores[unsafe] = 0.0
+        return scores
+
+    def score_candidates(self, candidates: List[dict], user_profile: dict) -> np.ndarray:
+        """
+        Scores of many products for one user: memoized scores where
+        available, one predict_batch call for the rest.
+        """
+        memo = get_score_memo()
+        if memo is None:
+            return self.predict_batch(candidates, [user_profile])[:, 0]
+
+        user_features = self._map_user_to_features(user_profile)
+        scores = np.empty(len(candidates))
+        keys, missing = [], []
+        for i, candidate in enumerate(candidates):
+            key = self._memo_key(candidate, self._map_product_to_features(candidate), user_features)
+            keys.append(key)
+            hit = memo.get(key)
+            if hit is None:
+                missing.append(i)
+            else:
+                scores[i] = hit[0]
+        if missing:
+            computed = self.predict_batch([candidates[i] for i in missing], [user_profile])[:, 0]
+            for i, score in zip(missing, computed):
+                scores[i] = score
+                memo.put(keys[i], (float(score), None, None))
+        return scores
+
     def _generate_explanations(self, product_features: dict, user_features: dict, score: float) -> Tuple[List[str], List[str]]:
         """Delegate to the new unified scoring engine for explanations."""
         _, reasons, warnings = self._fallback_scoring(product_features, user_features)
@@ -392,19 +743,13 @@ class PersonalizationEngine:
         Find healthier alternatives to the current product by searching OpenFoodFacts.
         """
         # --- 1. Identify category for search ---
-        cat_tags = current_product_data.get('categories_tags', [])
-        # Find the most specific category (usually longer strings or further down the list)
-        # Filter for useful categories (avoid generic ones like 'en:food')
-        search_cat = "en:snacks" # Default fallback
-        
-        useful_cats = [c for c in cat_tags if not c.startswith('en:label') and len(c) > 5 and ':' in c]
-        if useful_cats:
-            # Pick the 2nd to last or last tag for better specificity
-            search_cat = useful_cats[-1]
-            
+        search_cat = self._search_category(current_product_data)
+
         # --- 2. Fetch candidates ---
         from ..resolvers.barcode_resolver import resolve_by_category
         candidates = resolve_by_category(search_cat, limit=12)
+        # Nutritionally similar products that already score higher for this user
+        candidates.extend(self.find_healthier_swaps(current_product_data, current_score, user_profile))
         
         # --- 3. Add fallbacks from library if search returns few results ---
         if len(candidates) < 3:
@@ -424,15 +769,19 @@ class PersonalizationEngine:
         # --- 4. Score and Filter ---
         recommendations = []
         seen_ids = {current_product_data.get('product_id'), current_product_data.get('code')}
-        
+        unique = []
         for candidate in candidates:
             pid = candidate.get('product_id') or candidate.get('code')
             if pid in seen_ids:
                 continue
             seen_ids.add(pid)
-            
-            # Score candidate
-            score, _, _ = self.predict(candidate, user_profile)
+            unique.append((pid, candidate))
+
+        # Score all candidates in one pass
+        scores = self.score_candidates([c for _, c in unique], user_profile)
+
+        for (pid, candidate), score in zip(unique, scores):
+            score = float(score)
             
             # Only recommend if it's better by at least 10 points or it's a "good" product (>70)
             if score > current_score + 5 or (score > 75 and current_score < 75):
@@ -462,42 +811,59 @@ class PersonalizationEngine:
         # Sort by score and take top 3
         return sorted(recommendations, key=lambda x: x['suitability_score'], reverse=True)[:3]
 
+    def find_healthier_swaps(self, current_product_data: dict, current_score: float, user_profile: dict, k: int = 3) -> List[dict]:
+        """
+        Nearest neighbours of the current product in nutrient space (local
+        product store only) that score higher for this user, closest first.
+        """
+        from .nutrient_index import get_nutrient_index
+        from .product_store import get_product_store
+
+        index = get_nutrient_index()
+        if index is None or index.size == 0:
+            return []
+
+        exclude = {current_product_data.get('product_id'), current_product_data.get('code')}
+        neighbours = index.query(current_product_data, k=int(os.getenv("SWAP_SEARCH_K", "50")), exclude=exclude)
+        records = get_product_store().get_candidates([barcode for barcode, _ in neighbours])
+
+        found = [records[barcode] for barcode, _ in neighbours if barcode in records]
+        scores = self.score_candidates(found, user_profile)
+        return [candidate for candidate, score in zip(found, scores) if score > current_score][:k]
+
     def get_additive_details(self, additive_ids: List[str]) -> List[dict]:
         """Get detailed health impact for a list of E-numbers."""
-        ADDITIVE_DB = {
-            'E102': {'name': 'Tartrazine', 'risk': 'high', 'description': 'Artificial yellow dye. Linked to hyperactivity in children and asthma.'},
-            'E110': {'name': 'Sunset Yellow', 'risk': 'high', 'description': 'Artificial orange dye. Banned in some countries due to health concerns.'},
-            'E129': {'name': 'Allura Red', 'risk': 'high', 'description': 'Artificial red dye. May cause allergic reactions in some people.'},
-            'E133': {'name': 'Brilliant Blue', 'risk': 'moderate', 'description': 'Synthetic dye. Generally safe but limited intake recommended.'},
-            'E150C': {'name': 'Ammonia Caramel', 'risk': 'moderate', 'description': 'Coloring agent. Some studies suggest potential inflammatory effects.'},
-            'E202': {'name': 'Potassium Sorbate', 'risk': 'low', 'description': 'Common preservative. Generally recognized as safe.'},
-            'E211': {'name': 'Sodium Benzoate', 'risk': 'moderate', 'description': 'Preservative. Can react with Vitamin C to form benzene in soft drinks.'},
-            'E330': {'name': 'Citric Acid', 'risk': 'low', 'description': 'Natural acidity regulator. Very safe.'},
-            'E415': {'name': 'Xanthan Gum', 'risk': 'low', 'description': 'Thickener. Safe for most, though may cause digestive issues in large amounts.'},
-            'E440': {'name': 'Pectin', 'risk': 'low', 'description': 'Natural thickener from fruit. Very safe.'},
-            'E621': {'name': 'MSG (Monosodium Glutamate)', 'risk': 'moderate', 'description': 'Flavor enhancer. Some people report sensitivity (headaches, sweating).'},
-            'E951': {'name': 'Aspartame', 'risk': 'moderate', 'description': 'Artificial sweetener. Controversial; some concerns about long-term neurological impact.'},
-            'E955': {'name': 'Sucralose', 'risk': 'moderate', 'description': 'Artificial sweetener. May impact gut microbiome in high amounts.'},
-        }
-        
-        details = []
-        for aid in additive_ids:
-            # Clean ID (remove trailing 'i', etc)
-            clean_id = aid.upper()
-            if clean_id in ADDITIVE_DB:
-                details.append({
-                    'id': clean_id,
-                    **ADDITIVE_DB[clean_id]
-                })
-            else:
-                # Fallback for unknown additives
-                details.append({
-                    'id': clean_id,
-                    'name': f'Additive {clean_id}',
-                    'risk': 'low',
-                    'description': 'Information not available, but generally used in safe quantities.'
-                })
-        return details
+        return get_additive_db().details(additive_ids)
+
+
+# Identifies the Phase 1 rules; persisted base scores from other versions are ignored
+BASE_SCORE_VERSION = hashlib.sha256(repr((
+    RULES_VERSION, _SUGAR_LADDER, _SALT_LADDER, _SAT_FAT_LADDER, _CALORIE_LADDER, _FIBER_LADDER, _PROTEIN_LADDER,
+)).encode()).hexdigest()[:12]
+
+
+def compute_base_score(product_data: dict) -> Dict:
+    """
+    User-independent Phase 1 score and reasons for a product dict (either a
+    ProductResponse dict or a flat candidate record), in the form persisted
+    with product records.
+    """
+    flat = {**product_data, **(product_data.get('nutrition') or {})}
+    base_score, base_reasons = PersonalizationEngine._base_scoring(PersonalizationEngine._map_product_to_features(flat))
+    return {'base_score': float(base_score), 'base_reasons': base_reasons, 'base_score_version': BASE_SCORE_VERSION}
+
+
+def attach_base_score(product: ProductResponse) -> ProductRecord:
+    """The product as a ProductRecord carrying its (freshly computed) base score."""
+    product_data = product.dict()
+    return ProductRecord(**{**product_data, **compute_base_score(product_data)})
+
+
+def stored_base_score(product_data: dict) -> Optional[Tuple[float, List[str]]]:
+    """The persisted (base_score, base_reasons), if present and computed by the current rules."""
+    if product_data.get('base_score') is None or product_data.get('base_score_version') != BASE_SCORE_VERSION:
+        return None
+    return product_data['base_score'], product_data.get('base_reasons') or []
 
 
 # Global instance (singleton pattern)
@@ -0,0 +1,240 @@
+"""
+Persistent on-disk product cache for barcode lookups.
+
+Normalized ProductResponse records are stored in SQLite keyed by barcode so
+repeat scans cost a local lookup and survive process restarts. Entries older
+than the TTL are still served immediately while a background refresh fetches
+a new copy (stale-while-revalidate). Confirmed "product not found" answers
+are remembered for a short negative TTL so unknown barcodes are not re-queried
+on every scan.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+from ..models.schemas import ProductRecord, ProductResponse
+from .metrics import increment
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'product_cache.db')
+
+
+class ProductCache:
+    """
+    SQLite-backed barcode → ProductResponse store with TTL and stale-while-revalidate.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl: int = 86400, max_stale: int = 2592000,
+                 negative_ttl: int = 3600):
+        """
+        Args:
+            path: SQLite database file.
+            ttl: Seconds an entry is considered fresh.
+            max_stale: Seconds past the TTL a stale entry may still be served
+                while it is refreshed. Older entries are treated as misses.
+            negative_ttl: Seconds a confirmed "not found" is remembered (0 disables).
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.negative_ttl = negative_ttl
+        self._local = threading.local()
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread; sqlite3 connections are not thread-safe."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            # WAL lets several workers read while one writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS products (
+                barcode TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS misses (
+                barcode TEXT PRIMARY KEY,
+                checked_at REAL NOT NULL
+            )
+            """
+        )
+        conn.commit()
+
+    def get(self, barcode: str) -> Optional[Tuple[ProductResponse, bool]]:
+        """
+        Look up a cached product.
+
+        Returns:
+            Tuple of (product, is_stale), or None if missing or expired.
+        """
+        try:
+            row = self._connect().execute(
+                "SELECT data, fetched_at FROM products WHERE barcode = ?", (barcode,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ Product cache read failed: {e}")
+            return None
+
+        if row is None:
+            return None
+
+        data, fetched_at = row
+        age = time.time() - fetched_at
+        if age > self.ttl + self.max_stale:
+            return None
+
+        try:
+            product = ProductRecord(**json.loads(data))
+        except Exception as e:
+            print(f"⚠️ Dropping unreadable cache entry for {barcode}: {e}")
+            self.delete(barcode)
+            return None
+        return product, age > self.ttl
+
+    def put(self, barcode: str, product: ProductResponse):
+        """Insert or replace the cached record for a barcode."""
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO products (barcode, data, fetched_at) VALUES (?, ?, ?)",
+                (barcode, json.dumps(product.dict()), time.time())
+            )
+            conn.execute("DELETE FROM misses WHERE barcode = ?", (barcode,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ Product cache write failed: {e}")
+
+    def is_known_miss(self, barcode: str) -> bool:
+        """True if the barcode was confirmed unknown within the negative TTL."""
+        if self.negative_ttl <= 0:
+            return False
+        try:
+            row = self._connect().execute(
+                "SELECT checked_at FROM misses WHERE barcode = ?", (barcode,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ Negative cache read failed: {e}")
+            return False
+        return row is not None and time.time() - row[0] <= self.negative_ttl
+
+    def put_miss(self, barcode: str):
+        """Remember a confirmed "not found" answer."""
+        if self.negative_ttl <= 0:
+            return
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO misses (barcode, checked_at) VALUES (?, ?)",
+                (barcode, time.time())
+            )
+            conn.commit()
+            increment("negative_cache.stores")
+        except sqlite3.Error as e:
+            print(f"⚠️ Negative cache write failed: {e}")
+
+    def delete(self, barcode: str):
+        """Remove a barcode from the cache."""
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM products WHERE barcode = ?", (barcode,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ Product cache delete failed: {e}")
+
+    def get_or_fetch(self, barcode: str, fetch: Callable[[str], Optional[ProductResponse]]) -> Optional[ProductResponse]:
+        """
+        Serve from cache when possible, otherwise call `fetch` and store the result.
+
+        Fresh hits return immediately. Stale hits also return immediately and
+        schedule a background refresh. Misses fetch synchronously.
+
+        `fetch` returns None when the upstream could not be reached and raises
+        LookupError when the upstream confirmed the product does not exist;
+        only the latter is stored in the negative cache.
+        """
+        if self.is_known_miss(barcode):
+            increment("negative_cache.hits")
+            print(f"💾 Negative cache hit for barcode: {barcode}")
+            return None
+
+        cached = self.get(barcode)
+        if cached is not None:
+            product, is_stale = cached
+            if is_stale:
+                self._schedule_refresh(barcode, fetch)
+            print(f"💾 Product cache {'stale ' if is_stale else ''}hit for barcode: {barcode}")
+            return product
+
+        try:
+            product = fetch(barcode)
+        except LookupError:
+            self.put_miss(barcode)
+            return None
+        if product is not None:
+            self.put(barcode, product)
+        return product
+
+    def _schedule_refresh(self, barcode: str, fetch: Callable[[str], Optional[ProductResponse]]):
+        """Start at most one background refresh per barcode."""
+        with self._refresh_lock:
+            if barcode in self._refreshing:
+                return
+            self._refreshing.add(barcode)
+
+        def _refresh():
+            try:
+                product = fetch(barcode)
+                if product is not None:
+                    self.put(barcode, product)
+            except LookupError:
+                # Removed upstream since we cached it
+                self.delete(barcode)
+                self.put_miss(barcode)
+            except Exception as e:
+                print(f"⚠️ Background refresh failed for {barcode}: {e}")
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(barcode)
+
+        threading.Thread(target=_refresh, name=f"cache-refresh-{barcode}", daemon=True).start()
+
+
+# Global instance (singleton pattern)
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+def get_product_cache() -> Optional[ProductCache]:
+    """
+    Get or create the global product cache.
+    Returns None when disabled via PRODUCT_CACHE_ENABLED=0.
+    """
+    global _cache_instance
+    if os.getenv("PRODUCT_CACHE_ENABLED", "1") == "0":
+        return None
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                _cache_instance = ProductCache(
+                    path=os.getenv("PRODUCT_CACHE_PATH", DEFAULT_CACHE_PATH),
+                    ttl=int(os.getenv("PRODUCT_CACHE_TTL", "86400")),
+                    max_stale=int(os.getenv("PRODUCT_CACHE_MAX_STALE", "2592000")),
+                    negative_ttl=int(os.getenv("PRODUCT_CACHE_NEGATIVE_TTL", "3600")),
+                )
+    return _cache_instance
@@ -0,0 +1,382 @@
+"""
+Local indexed product store built from OpenFoodFacts dumps.
+
+Unlike the product cache (which only remembers what we fetched), the store
+holds an offline copy of the catalogue loaded by `ingest_openfoodfacts.py`.
+resolve_by_barcode checks it before any network call, and its inverted
+category index (categories_tags → products) lets resolve_by_category find
+recommendation candidates without an OpenFoodFacts search. A trigram
+full-text index over names and brands serves the OCR name lookup.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..models.schemas import ProductRecord, ProductResponse
+
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'product_store.db')
+
+# (barcode, name, brands, data, last_modified_t, unique_scans_n)
+StoreRow = Tuple[str, str, str, str, int, int]
+
+
+class ProductStore:
+    """
+    SQLite table of normalized ProductResponse records keyed by barcode.
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._name_count = None
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread; sqlite3 connections are not thread-safe."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS products (
+                barcode TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                brands TEXT NOT NULL DEFAULT '',
+                data TEXT NOT NULL,
+                last_modified_t INTEGER NOT NULL DEFAULT 0,
+                unique_scans_n INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_products_updated_at ON products (updated_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        # Inverted index: category tag → barcodes, ordered by popularity
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS product_categories (
+                category TEXT NOT NULL,
+                barcode TEXT NOT NULL,
+                unique_scans_n INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (category, barcode)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_product_categories_rank "
+            "ON product_categories (category, unique_scans_n DESC)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_product_categories_barcode ON product_categories (barcode)")
+        # Precomputed recommendation-candidate records (flat nutrient fields)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS candidates (
+                barcode TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            )
+            """
+        )
+        # Trigram index over name + brands (rowid = products.rowid), tolerant to OCR typos
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS product_names "
+            "USING fts5(name, brands, tokenize='trigram', detail='none')"
+        )
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS product_names_vocab USING fts5vocab(product_names, row)")
+        conn.commit()
+
+    def get(self, barcode: str) -> Optional[ProductResponse]:
+        """Look up a product by barcode."""
+        try:
+            row = self._connect().execute(
+                "SELECT data FROM products WHERE barcode = ?", (barcode,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ Product store read failed: {e}")
+            return None
+        if row is None:
+            return None
+        return ProductRecord(**json.loads(row[0]))
+
+    def upsert_many(self, rows: Iterable[StoreRow]) -> int:
+        """
+        Bulk insert/update in one transaction, keeping the category index in sync.
+
+        Existing records are only replaced by rows with an equal or newer
+        last_modified_t, so replaying an older dump never overwrites a delta.
+        Updates keep the row's rowid, which the name index is keyed on.
+        """
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            rows = self._newer_rows(conn, list(rows))
+            conn.executemany(
+                """
+                INSERT INTO products (barcode, name, brands, data, last_modified_t, unique_scans_n, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (barcode) DO UPDATE SET
+                    name = excluded.name, brands = excluded.brands, data = excluded.data,
+                    last_modified_t = excluded.last_modified_t, unique_scans_n = excluded.unique_scans_n,
+                    updated_at = excluded.updated_at
+                """,
+                [(*row, now) for row in rows]
+            )
+            self._index_rows(conn, rows)
+        self._name_count = None
+        return len(rows)
+
+    def _newer_rows(self, conn: sqlite3.Connection, rows: List[StoreRow]) -> List[StoreRow]:
+        """Drop rows older than what is already stored (last duplicate in a batch wins)."""
+        latest = {}
+        for row in rows:
+            latest[row[0]] = row
+        existing = {}
+        barcodes = list(latest)
+        for i in range(0, len(barcodes), 500):  # stay under SQLite's bound-parameter limit
+            chunk = barcodes[i:i + 500]
+            existing.update(conn.execute(
+                f"SELECT barcode, last_modified_t FROM products WHERE barcode IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall())
+        return [row for bc, row in latest.items() if bc not in existing or row[4] >= existing[bc]]
+
+    def _index_rows(self, conn: sqlite3.Connection, rows: Iterable[StoreRow]):
+        """(Re)build category index entries, candidate records and name index entries for the given rows."""
+        entries, candidates, names = [], [], {}
+        for barcode, name, brands, data, _, unique_scans_n in rows:
+            product = json.loads(data)
+            for category in set(product.get('categories_tags') or []):
+                entries.append((category, barcode, unique_scans_n))
+            candidates.append((barcode, json.dumps(to_candidate(product))))
+            names[barcode] = (name, brands)
+
+        conn.executemany("DELETE FROM product_categories WHERE barcode = ?", [(c[0],) for c in candidates])
+        conn.executemany(
+            "INSERT OR REPLACE INTO product_categories (category, barcode, unique_scans_n) VALUES (?, ?, ?)",
+            entries
+        )
+        conn.executemany("INSERT OR REPLACE INTO candidates (barcode, data) VALUES (?, ?)", candidates)
+
+        barcodes = list(names)
+        rowids = []
+        for i in range(0, len(barcodes), 500):
+            chunk = barcodes[i:i + 500]
+            rowids.extend(conn.execute(
+                f"SELECT rowid, barcode FROM products WHERE barcode IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall())
+        conn.executemany("DELETE FROM product_names WHERE rowid = ?", [(rowid,) for rowid, _ in rowids])
+        conn.executemany(
+            "INSERT INTO product_names (rowid, name, brands) VALUES (?, ?, ?)",
+            [(rowid, *names[barcode]) for rowid, barcode in rowids]
+        )
+
+    def rebuild_category_index(self, batch_size: int = 5000) -> int:
+        """Re-derive the category index, candidate records and name index from all stored products."""
+        conn = self._connect()
+        read_conn = sqlite3.connect(self.path, timeout=30)
+        total = 0
+        with conn:
+            conn.execute("DELETE FROM product_categories")
+            conn.execute("DELETE FROM candidates")
+            conn.execute("DELETE FROM product_names")
+        cursor = read_conn.execute(
+            "SELECT barcode, name, brands, data, last_modified_t, unique_scans_n FROM products"
+        )
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            with conn:
+                self._index_rows(conn, batch)
+            total += len(batch)
+        read_conn.close()
+        return total
+
+    def rescore(self, compute: Callable[[Dict], Dict], version: str, batch_size: int = 5000) -> int:
+        """
+        Recompute the persisted base score of every product whose stored
+        base_score_version differs from `version`, rewriting its record and
+        candidate entry. `compute` maps a product dict to its base score fields.
+        """
+        conn = self._connect()
+        read_conn = sqlite3.connect(self.path, timeout=30)
+        total = 0
+        cursor = read_conn.execute(
+            "SELECT barcode, data FROM products "
+            "WHERE json_extract(data, '$.base_score_version') IS NOT ?",
+            (version,)
+        )
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            updates, candidates = [], []
+            for barcode, data in batch:
+                product = json.loads(data)
+                product.update(compute(product))
+                updates.append((json.dumps(product), barcode))
+                candidates.append((barcode, json.dumps(to_candidate(product))))
+            with conn:
+                conn.executemany("UPDATE products SET data = ? WHERE barcode = ?", updates)
+                conn.executemany("INSERT OR REPLACE INTO candidates (barcode, data) VALUES (?, ?)", candidates)
+            total += len(batch)
+        read_conn.close()
+        return total
+
+    def find_by_category(self, category_tag: str, limit: int = 8) -> List[Dict]:
+        """
+        Most-scanned products tagged with `category_tag`, in the same shape
+        resolve_by_category returns. Empty if the category is not indexed.
+        """
+        try:
+            rows = self._connect().execute(
+                """
+                SELECT c.data FROM product_categories pc
+                JOIN candidates c ON c.barcode = pc.barcode
+                WHERE pc.category = ?
+                ORDER BY pc.unique_scans_n DESC
+                LIMIT ?
+                """,
+                (category_tag, limit)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"⚠️ Product store category lookup failed: {e}")
+            return []
+        return [json.loads(r[0]) for r in rows]
+
+    def search_names(self, text: str, limit: int = 20, max_terms: int = 24, max_doc_fraction: float = 0.02) -> List[Dict]:
+        """
+        Products whose name/brands share the most distinctive trigrams with `text`.
+
+        OCR text is long and noisy, and OR-ing every trigram in it would match
+        most of the catalogue. Only the `max_terms` rarest trigrams that occur
+        in the index are queried, ranked by BM25. Trigrams found in more than
+        `max_doc_fraction` of names say little and make the query slow, so they
+        are skipped. Callers re-rank the result.
+        """
+        tokens = re.findall(r'[^\W_]{3,}', text.lower())
+        trigrams = list(dict.fromkeys(t[i:i + 3] for t in tokens for i in range(len(t) - 2)))
+        if not trigrams:
+            return []
+        try:
+            conn = self._connect()
+            if self._name_count is None:
+                self._name_count = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+            max_docs = max(1, int(self._name_count * max_doc_fraction))
+            frequency = {}
+            for trigram in trigrams:
+                row = conn.execute("SELECT doc FROM product_names_vocab WHERE term = ?", (trigram,)).fetchone()
+                if row and row[0] <= max_docs:
+                    frequency[trigram] = row[0]
+            rarest = sorted(frequency, key=frequency.get)[:max_terms]
+            if not rarest:
+                return []
+            rows = conn.execute(
+                """
+                SELECT p.barcode, p.name, p.brands, p.unique_scans_n FROM product_names
+                JOIN products p ON p.rowid = product_names.rowid
+                WHERE product_names MATCH ?
+                ORDER BY bm25(product_names)
+                LIMIT ?
+                """,
+                (' OR '.join(f'"{t}"' for t in rarest), limit)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"⚠️ Product store name search failed: {e}")
+            return []
+        return [{'barcode': r[0], 'name': r[1], 'brands': r[2], 'unique_scans_n': r[3]} for r in rows]
+
+    def get_candidates(self, barcodes: List[str]) -> Dict[str, Dict]:
+        """Candidate records for the given barcodes (missing ones are omitted)."""
+        result = {}
+        conn = self._connect()
+        for i in range(0, len(barcodes), 500):
+            chunk = barcodes[i:i + 500]
+            for barcode, data in conn.execute(
+                f"SELECT barcode, data FROM candidates WHERE barcode IN ({','.join('?' * len(chunk))})",
+                chunk
+            ):
+                result[barcode] = json.loads(data)
+        return result
+
+    def iter_candidates(self, since: float = 0.0, batch_size: int = 10000) -> Iterator[Tuple[str, Dict, float]]:
+        """Stream (barcode, candidate, updated_at) for products updated after `since`."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            cursor = conn.execute(
+                """
+                SELECT c.barcode, c.data, p.updated_at FROM products p
+                JOIN candidates c ON c.barcode = p.barcode
+                WHERE p.updated_at > ?
+                """,
+                (since,)
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for barcode, data, updated_at in rows:
+                    yield barcode, json.loads(data), updated_at
+        finally:
+            conn.close()
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value: str):
+        conn = self._connect()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def to_candidate(product: Dict) -> Dict:
+    """Flatten a ProductResponse dict into a recommendation-candidate record."""
+    return {
+        'product_id': product.get('product_id'),
+        'name': product.get('name') or 'Unknown',
+        'image_url': product.get('image_url'),
+        'nova_group': product.get('nova_group'),
+        'categories_tags': product.get('categories_tags', []),
+        'allergens_tags': product.get('allergens_tags', []),
+        'traces_tags': product.get('traces_tags', []),
+        'base_score': product.get('base_score'),
+        'base_reasons': product.get('base_reasons', []),
+        'base_score_version': product.get('base_score_version'),
+        **(product.get('nutrition') or {}),
+    }
+
+
+# Global instance (singleton pattern)
+_store_instance = None
+_store_lock = threading.Lock()
+
+def get_product_store() -> Optional[ProductStore]:
+    """
+    Get the global product store, or None if no dump has been ingested
+    (PRODUCT_STORE_PATH does not exist).
+    """
+    global _store_instance
+    if _store_instance is None:
+        path = os.getenv("PRODUCT_STORE_PATH", DEFAULT_STORE_PATH)
+        if not os.path.exists(path):
+            return None
+        with _store_lock:
+            if _store_instance is None:
+                _store_instance = ProductStore(path)
+                print(f"✅ Local product store opened at {path}")
+    return _store_instance
@@ -0,0 +1,120 @@
+"""
+Background computation of recommendations for personalized scans.
+
+Recommendations need a category search upstream plus scoring every
+candidate, which costs far more than scoring the scanned product, and
+clients only show them after the score anyway. Personalized scans therefore
+return as soon as the score is ready, with a scan ID; the recommendations
+are computed on a small thread pool and fetched later from
+GET /recommendations/{scan_id} (or streamed as server-sent events).
+
+Jobs are keyed by what the recommendations depend on (the product and the
+scoring-relevant profile flags), so rescanning a product with the same
+profile reuses the running or finished job instead of starting another.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from .metrics import increment, register_gauge
+
+
+class RecommendationJobs:
+    """
+    Scan ID → recommendations future, with results kept for `ttl` seconds.
+
+    Failed jobs are not reused: the next scan of the same product retries.
+    """
+
+    def __init__(self, max_workers: int = 4, max_entries: int = 2000, ttl: int = 600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="recommendations")
+        # job key -> (future, started_at)
+        self._jobs: "OrderedDict[Hashable, Tuple[Future, float]]" = OrderedDict()
+        # scan id -> job key
+        self._scans: "OrderedDict[str, Hashable]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, fn: Callable[..., Any], *args) -> Tuple[str, Future]:
+        """Start (or reuse) the job for `key`; returns a new scan ID and the job's future."""
+        scan_id = uuid.uuid4().hex
+        with self._lock:
+            future = self._live_job(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._executor.submit(fn, *args)
+                self._jobs[key] = (future, time.time())
+                increment("recommendations.jobs_started")
+            else:
+                increment("recommendations.jobs_reused")
+            self._jobs.move_to_end(key)
+            self._scans[scan_id] = key
+            while len(self._jobs) > self.max_entries:
+                self._jobs.popitem(last=False)
+            while len(self._scans) > self.max_entries:
+                self._scans.popitem(last=False)
+        return scan_id, future
+
+    def get(self, scan_id: str) -> Optional[Future]:
+        """The job future for a scan, or None if the scan ID is unknown or expired."""
+        with self._lock:
+            key = self._scans.get(scan_id)
+            return self._live_job(key) if key is not None else None
+
+    def _live_job(self, key: Hashable) -> Optional[Future]:
+        """Job future for `key` unless past its TTL (caller holds the lock)."""
+        entry = self._jobs.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[1] > self.ttl:
+            del self._jobs[key]
+            return None
+        return entry[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = sum(1 for future, _ in self._jobs.values() if not future.done())
+            return {'jobs': len(self._jobs), 'pending': pending, 'scans': len(self._scans)}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def job_status(scan_id: str, future: Future) -> dict:
+    """Response body for a recommendations job."""
+    if not future.done():
+        return {'scan_id': scan_id, 'status': 'pending', 'recommendations': []}
+    error = future.exception()
+    if error is not None:
+        return {'scan_id': scan_id, 'status': 'error', 'recommendations': [], 'error': str(error)}
+    return {'scan_id': scan_id, 'status': 'ready', 'recommendations': future.result()}
+
+
+# Global instance (singleton pattern)
+_jobs_instance = None
+_jobs_lock = threading.Lock()
+
+def get_recommendation_jobs() -> RecommendationJobs:
+    """Get or create the global recommendation job store."""
+    global _jobs_instance
+    if _jobs_instance is None:
+        with _jobs_lock:
+            if _jobs_instance is None:
+                _jobs_instance = RecommendationJobs(
+                    max_workers=int(os.getenv("RECOMMENDATION_WORKERS", "4")),
+                    max_entries=int(os.getenv("RECOMMENDATION_JOBS_SIZE", "2000")),
+                    ttl=int(os.getenv("RECOMMENDATION_JOBS_TTL", "600")),
+                )
+                register_gauge("recommendations", _jobs_instance.stats)
+    return _jobs_instance
+
+def shutdown_recommendation_jobs():
+    global _jobs_instance
+    with _jobs_lock:
+        if _jobs_instance is not None:
+            _jobs_instance.shutdown()
+            _jobs_instance = None
@@ -0,0 +1,106 @@
+"""
+Memo cache for personalization scores.
+
+A score depends only on the product's features, the user's scoring-relevant
+profile flags and the scoring rules/model. Popular products get scored for
+the same handful of profile combinations over and over (most obviously as
+recommendation candidates), so results are memoized under
+(scoring version, product id, product features, profile bitmask).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+
+from .metrics import increment, register_gauge
+
+# (score, reasons, warnings); reasons/warnings are None for entries written
+# by batch scoring, which only computes the score
+ScoreEntry = Tuple[float, Optional[Tuple[str, ...]], Optional[Tuple[str, ...]]]
+
+
+def profile_bitmask(user_features: dict, flags: List[str]) -> int:
+    """Pack the boolean profile features named in `flags` into an int."""
+    mask = 0
+    for bit, flag in enumerate(flags):
+        if user_features.get(flag):
+            mask |= 1 << bit
+    return mask
+
+
+class ScoreMemo:
+    """Bounded LRU with a TTL, safe to share between threads."""
+
+    def __init__(self, max_entries: int = 10000, ttl: int = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[ScoreEntry, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, need_reasons: bool = False) -> Optional[ScoreEntry]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and time.time() - item[1] > self.ttl:
+                del self._entries[key]
+                item = None
+            if item is None or (need_reasons and item[0][1] is None):
+                hit = None
+            else:
+                self._entries.move_to_end(key)
+                hit = item[0]
+            if hit is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        increment("score_memo.hits" if hit is not None else "score_memo.misses")
+        return hit
+
+    def put(self, key: Hashable, entry: ScoreEntry):
+        with self._lock:
+            existing = self._entries.get(key)
+            # Don't let a score-only entry replace one that has reasons
+            if existing is not None and entry[1] is None and existing[0][1] is not None:
+                return
+            self._entries[key] = (entry, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                increment("score_memo.evictions")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Global instance (singleton pattern)
+_memo_instance = None
+_memo_lock = threading.Lock()
+
+def get_score_memo() -> Optional[ScoreMemo]:
+    """
+    Get or create the global score memo.
+    Returns None when disabled via SCORE_MEMO_SIZE=0.
+    """
+    global _memo_instance
+    if _memo_instance is None:
+        size = int(os.getenv("SCORE_MEMO_SIZE", "10000"))
+        if size <= 0:
+            return None
+        with _memo_lock:
+            if _memo_instance is None:
+                _memo_instance = ScoreMemo(max_entries=size, ttl=int(os.getenv("SCORE_MEMO_TTL", "3600")))
+                register_gauge("score_memo", lambda: _memo_instance.stats())
+    return _memo_instance
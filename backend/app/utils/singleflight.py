@@ -0,0 +1,72 @@
+"""
+In-process request coalescing ("single-flight").
+
+Concurrent callers asking for the same key share one in-flight call and its
+result instead of each hitting the upstream API.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call:
+    """One in-flight call shared by a leader and its waiting followers."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls by key.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is running block until it finishes and receive the same
+    result (or exception). Nothing is cached once the call completes.
+    """
+
+    def __init__(self, name: str = "singleflight"):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.stats = {'executed': 0, 'coalesced': 0}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run `fn(*args, **kwargs)` once per concurrent burst of callers for `key`."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.followers += 1
+                self.stats['coalesced'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.stats['executed'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            if call.followers:
+                print(f"🔗 {self.name}: {call.followers} concurrent request(s) shared one call for {key}")
+            call.done.set()
+        return call.result
+
+    def in_flight(self) -> int:
+        """Number of keys currently being fetched."""
+        with self._lock:
+            return len(self._calls)
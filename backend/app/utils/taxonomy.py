@@ -0,0 +1,133 @@
+"""
+Compiled allergen and category taxonomy index.
+
+Maps OpenFoodFacts allergen and category tags to the model's allergen flags
+and categories with dict lookups. taxonomy.json (written by
+build_taxonomy.py from the OpenFoodFacts taxonomy files) holds each
+taxonomy's parent links and synonym tags; at load time every known tag is
+resolved through its ancestors once, so a tag inherits the flags/category
+of any parent ('en:colas' → 'en:sodas' → … → 'en:beverages' → Beverage).
+
+Matching whole tags rather than substrings means 'en:coconuts' or
+'en:nutmeg' no longer look like nut allergens and 'en:milk-chocolates' is
+not Dairy.
+"""
+import json
+import os
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+
+DEFAULT_TAXONOMY_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'taxonomy.json')
+
+# Model allergen flags for canonical allergen tags; descendants and synonyms inherit them
+ALLERGEN_FLAGS = {
+    'en:gluten': 'contains_gluten',
+    'en:milk': 'contains_milk',
+    'en:eggs': 'contains_egg',
+    'en:peanuts': 'contains_peanut',
+    # Tree nuts share the peanut flag, as before
+    'en:nuts': 'contains_peanut',
+}
+
+# Model categories with the category tags (and descendants) they cover, in
+# priority order: a product tagged both Beverage and Dairy is a Beverage
+CATEGORY_MODELS: List[Tuple[str, List[str]]] = [
+    ('Beverage', ['en:beverages']),
+    ('Dairy', ['en:dairies']),
+    ('Cereal', ['en:cereals-and-potatoes', 'en:breakfasts']),
+    ('Ready-Meal', ['en:meals']),
+]
+DEFAULT_CATEGORY = 'Snack'
+
+
+def _ancestors(tag: str, parents: Dict[str, List[str]]) -> set:
+    """`tag` and every tag above it (the taxonomies are DAGs)."""
+    seen, stack = set(), [tag]
+    while stack:
+        current = stack.pop()
+        if current not in seen:
+            seen.add(current)
+            stack.extend(parents.get(current, []))
+    return seen
+
+
+class TaxonomyIndex:
+    """Precompiled tag → allergen flags and tag → model category tables."""
+
+    def __init__(self, data: dict):
+        allergens = data.get('allergens', {})
+        categories = data.get('categories', {})
+
+        self._allergen_flags: Dict[str, FrozenSet[str]] = {}
+        parents = allergens.get('parents', {})
+        for tag in set(parents) | set(ALLERGEN_FLAGS):
+            flags = frozenset(ALLERGEN_FLAGS[a] for a in _ancestors(tag, parents) if a in ALLERGEN_FLAGS)
+            if flags:
+                self._allergen_flags[tag] = flags
+        for synonym, tag in allergens.get('synonyms', {}).items():
+            if tag in self._allergen_flags:
+                self._allergen_flags.setdefault(synonym, self._allergen_flags[tag])
+        # Every allergen tag and synonym → its canonical tag
+        self.allergen_tags: Dict[str, str] = {tag: tag for tag in set(parents) | set(ALLERGEN_FLAGS)}
+        self.allergen_tags.update(allergens.get('synonyms', {}))
+
+        roots = {root: rank for rank, (_, tags) in enumerate(CATEGORY_MODELS) for root in tags}
+        self._category_rank: Dict[str, int] = {}
+        parents = categories.get('parents', {})
+        for tag in set(parents) | set(roots):
+            ranks = [roots[a] for a in _ancestors(tag, parents) if a in roots]
+            if ranks:
+                self._category_rank[tag] = min(ranks)
+        for synonym, tag in categories.get('synonyms', {}).items():
+            if tag in self._category_rank:
+                self._category_rank.setdefault(synonym, self._category_rank[tag])
+
+    @classmethod
+    def load(cls, path: str) -> 'TaxonomyIndex':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def allergen_flags(self, tags: Iterable[str]) -> FrozenSet[str]:
+        """Model allergen flags (e.g. 'contains_milk') raised by any of the tags."""
+        flags = frozenset()
+        for tag in tags:
+            hit = self._allergen_flags.get(tag.lower())
+            if hit:
+                flags = flags | hit
+        return flags
+
+    def model_category(self, tags: Iterable[str]) -> str:
+        """Highest-priority model category among the tags, or DEFAULT_CATEGORY."""
+        best = len(CATEGORY_MODELS)
+        for tag in tags:
+            rank = self._category_rank.get(tag.lower(), best)
+            if rank < best:
+                best = rank
+        return CATEGORY_MODELS[best][0] if best < len(CATEGORY_MODELS) else DEFAULT_CATEGORY
+
+    def stats(self) -> dict:
+        return {'allergen_tags': len(self._allergen_flags), 'category_tags': len(self._category_rank)}
+
+
+# Global instance (singleton pattern)
+_taxonomy_instance = None
+_taxonomy_lock = threading.Lock()
+
+def get_taxonomy() -> TaxonomyIndex:
+    """
+    Get or load the global taxonomy index (TAXONOMY_PATH). Without a
+    readable file only the canonical tags in ALLERGEN_FLAGS / CATEGORY_MODELS
+    are recognised.
+    """
+    global _taxonomy_instance
+    if _taxonomy_instance is None:
+        with _taxonomy_lock:
+            if _taxonomy_instance is None:
+                path = os.getenv("TAXONOMY_PATH", DEFAULT_TAXONOMY_PATH)
+                try:
+                    _taxonomy_instance = TaxonomyIndex.load(path)
+                    print(f"🗂️ Taxonomy index loaded: {_taxonomy_instance.stats()}")
+                except (OSError, ValueError) as e:
+                    print(f"⚠️ Could not load taxonomy from {path}: {e}. Using canonical tags only.")
+                    _taxonomy_instance = TaxonomyIndex({})
+    return _taxonomy_instance
@@ -0,0 +1,98 @@
+"""
+Pure-NumPy evaluator for the personalization model.
+
+`export_model.py` flattens the fitted sklearn Pipeline (StandardScaler +
+OneHotEncoder preprocessing, GradientBoostingRegressor) into a compact .npz
+of arrays. This module loads that file and evaluates the trees with array
+indexing only, so serving workers never import sklearn and single-row
+calls skip sklearn's per-call validation overhead.
+"""
+from typing import List, Tuple
+
+import numpy as np
+
+
+class TreeEnsembleModel:
+    """
+    Gradient-boosted regression trees stored as complete binary trees.
+
+    Every tree is padded to the ensemble's max depth and laid out in heap
+    order (children of node i at 2i+1 and 2i+2), so descending is pure
+    arithmetic: no child-pointer lookups, and exactly `max_depth` steps.
+    """
+
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, value: np.ndarray, max_depth: int,
+                 init_value: float, learning_rate: float, layout: List[Tuple[str, List[str], object]]):
+        """
+        Args:
+            feature, threshold: (n_trees, 2**max_depth - 1) split tables.
+            value: (n_trees, 2**max_depth) leaf values.
+            layout: Input preprocessing, same shape as
+                PersonalizationEngine._ml_layout.
+        """
+        self.max_depth = max_depth
+        self.init_value = init_value
+        self.learning_rate = learning_rate
+        self.layout = layout
+        self.source_sha256 = ''
+        # Reference rows (feature dicts) and their sklearn predictions, checked at load time
+        self.check_rows: List[dict] = []
+        self.check_expected = np.zeros(0)
+        n_trees, n_internal = feature.shape
+        # Flattened tables indexed by (tree offset + heap index)
+        self._internal_offsets = (np.arange(n_trees) * n_internal)[None, :]
+        self._leaf_offsets = (np.arange(n_trees) * value.shape[1])[None, :] - n_internal
+        self._feature = feature.ravel().astype(np.intp)
+        self._threshold = threshold.ravel()
+        self._value = value.ravel()
+
+    @classmethod
+    def load(cls, path: str) -> 'TreeEnsembleModel':
+        with np.load(path, allow_pickle=False) as data:
+            layout = [
+                ('scale', list(data['num_columns']), (data['num_mean'], data['num_scale'])),
+                ('onehot', list(data['cat_columns']), [data['cat_categories'].astype(object)]),
+            ]
+            model = cls(
+                feature=data['feature'], threshold=data['threshold'], value=data['value'],
+                max_depth=int(data['max_depth']), init_value=float(data['init_value']),
+                learning_rate=float(data['learning_rate']), layout=layout,
+            )
+            model.source_sha256 = str(data['source_sha256'])
+            if 'check_expected' in data.files:
+                num_columns, cat_columns = list(data['num_columns']), list(data['cat_columns'])
+                model.check_rows = [
+                    {**dict(zip(num_columns, map(float, num))), **dict(zip(cat_columns, map(str, cat)))}
+                    for num, cat in zip(data['check_num'], data['check_cat'])
+                ]
+                model.check_expected = data['check_expected']
+            return model
+
+    def predict(self, X: np.ndarray, block_size: int = 512) -> np.ndarray:
+        """Predictions for an (n_samples, n_features) matrix of transformed inputs."""
+        # sklearn compares float32 inputs against float64 thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        out = np.empty(X.shape[0])
+        # Blocks keep the (rows x trees) index arrays cache-sized
+        for start in range(0, X.shape[0], block_size):
+            out[start:start + block_size] = self._predict_block(X[start:start + block_size])
+        return out
+
+    def _predict_block(self, X: np.ndarray) -> np.ndarray:
+        n_rows, n_features = X.shape
+        row_offsets = (np.arange(n_rows) * n_features)[:, None]
+        flat_x = X.ravel()
+        node = np.zeros((n_rows, self._internal_offsets.shape[1]), dtype=np.intp)
+        for _ in range(self.max_depth):
+            split = node + self._internal_offsets
+            # sklearn goes left when x <= threshold
+            go_right = flat_x.take(row_offsets + self._feature.take(split)) > self._threshold.take(split)
+            node = 2 * node + 1 + go_right
+        leaves = self._value.take(node + self._leaf_offsets)
+
+        # Add stage by stage like sklearn does; cumsum is sequential (unlike
+        # sum, which is pairwise), so the floating-point result is identical
+        stages = np.empty((n_rows, leaves.shape[1] + 1))
+        stages[:, 0] = self.init_value
+        np.multiply(leaves, self.learning_rate, out=stages[:, 1:])
+        return np.cumsum(stages, axis=1)[:, -1]
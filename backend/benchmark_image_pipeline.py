@@ -0,0 +1,132 @@
+"""
+Benchmarks the image scan pipeline: legacy (decode twice, full resolution)
+versus the single-decode, downscaled pipeline in app/utils/image_preprocess.py.
+
+For every sample photo it reports wall time and peak NumPy/OpenCV memory for
+each pipeline, and whether both found the same barcode / OCR text. When
+pyzbar or EasyOCR are not installed only the preprocessing stages are timed.
+
+Usage (from the backend folder):
+    python benchmark_image_pipeline.py path/to/photos/
+    python benchmark_image_pipeline.py --synthetic 5   # generated 12 MP test images
+"""
+import argparse
+import glob
+import os
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from app.resolvers.image_resolver import get_barcode_decoder, get_ocr_reader, decode_barcode
+from app.utils.image_preprocess import PreparedImage
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def legacy_pipeline(image_bytes: bytes) -> Tuple:
+    """What resolve_by_image did before: grayscale decode for pyzbar, colour decode for OCR."""
+    pyzbar_decode = get_barcode_decoder()
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if pyzbar_decode is not None:
+        for obj in pyzbar_decode(gray):
+            return obj.data.decode('utf-8'), None
+    color = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    reader = get_ocr_reader()
+    if reader is not None:
+        return None, " ".join(reader.readtext(color, detail=0))
+    return None, None
+
+
+def new_pipeline(image_bytes: bytes) -> Tuple:
+    """Single decode, barcode pyramid on the working image, OCR on the text crop."""
+    prepared = PreparedImage.from_bytes(image_bytes)
+    if get_barcode_decoder() is not None:
+        barcode = decode_barcode(prepared)
+        if barcode:
+            return barcode, None
+    else:
+        # Same work as the legacy grayscale decode: the first pyramid level
+        prepared.gray
+    img = prepared.ocr_image()
+    reader = get_ocr_reader()
+    if reader is not None:
+        return None, " ".join(reader.readtext(img, detail=0, canvas_size=prepared.ocr_max_side))
+    return None, None
+
+
+def measure(fn: Callable, image_bytes: bytes, repeat: int) -> Dict:
+    times = []
+    peak = 0
+    result = None
+    for _ in range(repeat):
+        tracemalloc.start()
+        started = time.perf_counter()
+        result = fn(image_bytes)
+        times.append(time.perf_counter() - started)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {'seconds': statistics.median(times), 'peak_mb': peak / 1e6, 'result': result}
+
+
+def synthetic_samples(count: int) -> List[Tuple[str, bytes]]:
+    """Phone-sized (4032x3024) JPEGs with a barcode-like stripe block and label text."""
+    rng = np.random.default_rng(0)
+    samples = []
+    for i in range(count):
+        img = np.full((3024, 4032, 3), 235, np.uint8)
+        img += rng.integers(0, 20, img.shape, dtype=np.uint8)
+        x = 600 + i * 150
+        for _ in range(60):
+            width = int(rng.integers(6, 24))
+            cv2.rectangle(img, (x, 1700), (x + width, 2500), (20, 20, 20), -1)
+            x += width + int(rng.integers(6, 24))
+        for line, text in enumerate(["ORGANIC OAT BISCUITS", "Ingredients: oats, sugar, palm oil", "Net wt 300 g"]):
+            cv2.putText(img, text, (500, 500 + line * 250), cv2.FONT_HERSHEY_SIMPLEX, 5, (30, 30, 30), 12)
+        ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        samples.append((f"synthetic-{i}.jpg", buf.tobytes()))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the legacy vs single-decode image pipelines.")
+    parser.add_argument('photos', nargs='?', help="Directory of sample photos")
+    parser.add_argument('--synthetic', type=int, default=0, help="Generate N synthetic 12 MP samples instead")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per image (median is reported)")
+    args = parser.parse_args()
+    if not args.photos and not args.synthetic:
+        parser.error("a photo directory or --synthetic N is required")
+
+    if args.photos:
+        paths = sorted(p for p in glob.glob(os.path.join(args.photos, '*')) if p.lower().endswith(IMAGE_EXTENSIONS))
+        samples = [(os.path.basename(p), open(p, 'rb').read()) for p in paths]
+    else:
+        samples = synthetic_samples(args.synthetic)
+
+    print(f"{'='*20} IMAGE PIPELINE BENCHMARK {'='*20}\n")
+    print(f"pyzbar: {'yes' if get_barcode_decoder() else 'no'}, easyocr: {'yes' if get_ocr_reader() else 'no'}\n")
+    print(f"{'image':<28}{'legacy ms':>11}{'new ms':>9}{'legacy MB':>11}{'new MB':>9}  same result")
+
+    totals = {'legacy': [], 'new': []}
+    for name, data in samples:
+        legacy = measure(legacy_pipeline, data, args.repeat)
+        new = measure(new_pipeline, data, args.repeat)
+        totals['legacy'].append(legacy)
+        totals['new'].append(new)
+        same = 'yes' if legacy['result'] == new['result'] else f"no ({legacy['result']} vs {new['result']})"
+        print(f"{name[:27]:<28}{legacy['seconds']*1000:>11.1f}{new['seconds']*1000:>9.1f}"
+              f"{legacy['peak_mb']:>11.1f}{new['peak_mb']:>9.1f}  {same}")
+
+    if samples:
+        legacy_ms = sum(r['seconds'] for r in totals['legacy']) * 1000 / len(samples)
+        new_ms = sum(r['seconds'] for r in totals['new']) * 1000 / len(samples)
+        legacy_mb = max(r['peak_mb'] for r in totals['legacy'])
+        new_mb = max(r['peak_mb'] for r in totals['new'])
+        print(f"\n📊 Mean time {legacy_ms:.1f} ms → {new_ms:.1f} ms, max peak memory {legacy_mb:.1f} MB → {new_mb:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
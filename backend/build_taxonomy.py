@@ -0,0 +1,106 @@
+"""
+Compiles the OpenFoodFacts allergen and category taxonomies into
+taxonomy.json for app/utils/taxonomy.py.
+
+The taxonomy files (allergens.txt, categories.txt) live in the
+openfoodfacts-server repository under taxonomies/. Each entry is a block of
+lines separated by a blank line:
+
+    < en:Carbonated drinks            parent(s)
+    en: Colas, Cola                   names: the first one is canonical
+    fr: Colas
+
+Only parent links and the tags of every name (in --languages) are kept:
+tag → parent tags, and synonym tag → canonical tag.
+
+Usage (from the backend folder):
+    python build_taxonomy.py --allergens allergens.txt --categories categories.txt
+"""
+import argparse
+import json
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_OUT = os.path.join(os.path.dirname(__file__), 'taxonomy.json')
+
+_NAMES_RE = re.compile(r'^([a-z]{2}(?:_[a-z]{2})?|xx):\s*(.*)$')
+
+
+def tag_id(lang: str, name: str) -> str:
+    """OpenFoodFacts-style tag for a name: 'fr', 'Épeautre' → 'fr:epeautre'."""
+    text = unicodedata.normalize('NFKD', name.strip().lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return f"{lang}:{re.sub(r'[^a-z0-9]+', '-', text).strip('-')}"
+
+
+def parse_taxonomy(path: str, languages: Optional[set] = None) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+    """
+    Returns:
+        (canonical tag → parent tags, synonym tag → canonical tag)
+    """
+    entries = []  # (canonical, [parent (lang, name)], [synonym tags])
+    with open(path, 'r', encoding='utf-8') as f:
+        blocks = re.split(r'\n\s*\n', f.read())
+    for block in blocks:
+        lines = [l.strip() for l in block.splitlines() if l.strip() and not l.lstrip().startswith('#')]
+        if not lines or lines[0].startswith(('stopwords:', 'synonyms:')):
+            continue
+        canonical, parent_names, synonyms = None, [], []
+        for line in lines:
+            if line.startswith('<'):
+                lang, _, name = line[1:].strip().partition(':')
+                parent_names.append((lang.strip(), name))
+                continue
+            match = _NAMES_RE.match(line)
+            if not match:
+                continue  # property line, e.g. wikidata:en: Q…
+            lang, names = match.groups()
+            names = [n for n in names.split(',') if n.strip()]
+            if not names:
+                continue
+            if canonical is None:
+                canonical = tag_id(lang, names[0])
+            if languages is None or lang in languages or lang == 'xx':
+                synonyms.extend(tag_id('en' if lang == 'xx' else lang, n) for n in names)
+        if canonical is not None:
+            entries.append((canonical, parent_names, synonyms))
+
+    synonym_map = {}
+    for canonical, _, synonyms in entries:
+        for tag in synonyms:
+            synonym_map.setdefault(tag, canonical)
+    parents = {}
+    for canonical, parent_names, _ in entries:
+        resolved = []
+        for lang, name in parent_names:
+            tag = tag_id(lang, name)
+            resolved.append(synonym_map.get(tag, tag))
+        parents[canonical] = resolved
+    synonyms = {tag: canonical for tag, canonical in synonym_map.items() if tag != canonical}
+    return parents, synonyms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile OpenFoodFacts taxonomies for the personalization engine.")
+    parser.add_argument('--allergens', required=True, help="allergens.txt")
+    parser.add_argument('--categories', required=True, help="categories.txt")
+    parser.add_argument('--languages', default='en,fr,de,es,it,nl,pt',
+                        help="Languages whose names become synonym tags ('all' for every language)")
+    parser.add_argument('--out', default=DEFAULT_OUT, help="Output JSON")
+    args = parser.parse_args()
+    languages = None if args.languages == 'all' else set(args.languages.split(','))
+
+    result = {'version': 1}
+    for name, path in (('allergens', args.allergens), ('categories', args.categories)):
+        parents, synonyms = parse_taxonomy(path, languages)
+        result[name] = {'parents': parents, 'synonyms': synonyms}
+        print(f"🗂️ {name}: {len(parents):,} tags, {len(synonyms):,} synonyms")
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    print(f"✅ Wrote {args.out} ({os.path.getsize(args.out):,} bytes)")
+
+
+if __name__ == "__main__":
+    main()
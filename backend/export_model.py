@@ -0,0 +1,154 @@
+"""
+Exports personalization_model.pkl to the NumPy format served by
+app/utils/tree_model.py, and checks the export against sklearn.
+
+The export flattens the fitted StandardScaler / OneHotEncoder parameters and
+every regression tree of the GradientBoostingRegressor into arrays in a
+single .npz. When that file exists next to the .pkl, the personalization
+engine uses it and never imports sklearn. The export also stores a few
+reference rows with sklearn's predictions for them; the engine re-scores
+those rows every time it loads the export and falls back to the pickle if
+they no longer match.
+
+Usage (from the backend folder; needs scikit-learn and pandas):
+    python export_model.py                 # export, then run the parity check
+    python export_model.py --check-only    # re-check an existing export
+
+tests/test_model_export.py runs the same parity check under pytest.
+"""
+import argparse
+import hashlib
+import os
+import sys
+
+import joblib
+import numpy as np
+
+from app.utils.tree_model import TreeEnsembleModel
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(__file__), 'personalization_model.pkl')
+
+
+def _to_heap(tree, node: int, heap_index: int, depth: int, feature, threshold, value):
+    """
+    Copy an sklearn tree into complete-binary-tree (heap) order: the children
+    of heap node i are 2i+1 and 2i+2, and the 2**depth leaves follow the
+    2**depth - 1 internal nodes. A leaf above the bottom level fills every
+    leaf slot below it with its value.
+    """
+    n_internal = 2 ** depth - 1
+    if tree.children_left[node] == -1:
+        # Descend to the bottom level; the +inf thresholds on the way route everything left
+        first, count = heap_index, 1
+        while first < n_internal:
+            first, count = 2 * first + 1, count * 2
+        value[first - n_internal:first - n_internal + count] = tree.value[node, 0, 0]
+        return
+    feature[heap_index] = tree.feature[node]
+    threshold[heap_index] = tree.threshold[node]
+    _to_heap(tree, tree.children_left[node], 2 * heap_index + 1, depth, feature, threshold, value)
+    _to_heap(tree, tree.children_right[node], 2 * heap_index + 2, depth, feature, threshold, value)
+
+
+def export(pipeline, path: str, source_sha256: str = '', check_rows: int = 64):
+    """
+    Write the fitted pipeline's parameters and trees to `path` (.npz).
+    `source_sha256` records which pickle the export came from;
+    `check_rows` random rows and sklearn's predictions for them are stored
+    for the load-time parity check.
+    """
+    preprocessor, regressor = pipeline.steps[0][1], pipeline.steps[-1][1]
+    scaler = preprocessor.named_transformers_['num']
+    encoder = preprocessor.named_transformers_['cat']
+    columns = {name: list(cols) for name, _, cols in preprocessor.transformers_ if name in ('num', 'cat')}
+    if len(encoder.categories_) != 1:
+        raise ValueError("expected a single categorical column")
+
+    trees = [stage[0].tree_ for stage in regressor.estimators_]
+    depth = max(t.max_depth for t in trees)
+    feature = np.zeros((len(trees), 2 ** depth - 1), dtype=np.int32)
+    # +inf thresholds always go left: padding below leaves that end early
+    threshold = np.full((len(trees), 2 ** depth - 1), np.inf)
+    value = np.zeros((len(trees), 2 ** depth), dtype=np.float64)
+    for i, tree in enumerate(trees):
+        _to_heap(tree, 0, 0, depth, feature[i], threshold[i], value[i])
+
+    reference = random_inputs(pipeline, check_rows, seed=1)
+    np.savez_compressed(
+        path,
+        feature=feature, threshold=threshold, value=value, max_depth=depth,
+        init_value=float(regressor.init_.constant_.ravel()[0]),
+        learning_rate=regressor.learning_rate,
+        num_columns=np.array(columns['num']),
+        num_mean=scaler.mean_, num_scale=scaler.scale_,
+        cat_columns=np.array(columns['cat']),
+        cat_categories=np.array(encoder.categories_[0], dtype=str),
+        source_sha256=np.array(source_sha256),
+        check_num=reference[columns['num']].to_numpy(dtype=np.float64),
+        check_cat=reference[columns['cat']].to_numpy(dtype=str),
+        check_expected=pipeline.predict(reference),
+    )
+
+
+def random_inputs(pipeline, n: int, seed: int = 0):
+    """Random feature rows covering the training ranges (plus an unseen category)."""
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    scaler = pipeline.steps[0][1].named_transformers_['num']
+    categories = list(pipeline.steps[0][1].named_transformers_['cat'].categories_[0]) + ['Unknown']
+    data = {}
+    for col, mean, scale in zip(scaler.feature_names_in_, scaler.mean_, scaler.scale_):
+        if col.startswith(('has_', 'contains_', 'goal_')) or col.endswith(('_allergy', '_intolerance')):
+            data[col] = rng.integers(0, 2, n)
+        elif col == 'nova_group':
+            data[col] = rng.integers(1, 5, n)
+        else:
+            data[col] = np.abs(rng.normal(mean, 2 * scale, n)).round(2)
+    data['category'] = rng.choice(categories, n)
+    return pd.DataFrame(data)[list(pipeline.feature_names_in_)]
+
+
+def check(pipeline, path: str, n: int = 20000) -> float:
+    """Max absolute difference between sklearn and the NumPy evaluator on random rows."""
+    from app.utils.personalization import PersonalizationEngine
+
+    df = random_inputs(pipeline, n)
+    expected = pipeline.predict(df)
+
+    model = TreeEnsembleModel.load(path)
+    engine = PersonalizationEngine.__new__(PersonalizationEngine)
+    engine._ml_layout = model.layout
+    records = df.to_dict('records')
+    # One row per "product" against a single empty user: the matrix builder
+    # takes every column from the product side
+    X = engine._ml_matrix(records, [{}])
+    actual = model.predict(X)
+    single = np.array([model.predict(X[i:i + 1])[0] for i in range(200)])
+    return max(float(np.abs(expected - actual).max()), float(np.abs(expected[:200] - single).max()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the personalization model for NumPy-only serving.")
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATH, help="Fitted sklearn pipeline (.pkl)")
+    parser.add_argument('--out', help="Output .npz (default: next to the model)")
+    parser.add_argument('--check-only', action='store_true', help="Only run the parity check")
+    parser.add_argument('--tolerance', type=float, default=1e-9, help="Max allowed absolute difference")
+    args = parser.parse_args()
+    out = args.out or os.path.splitext(args.model)[0] + '.npz'
+
+    pipeline = joblib.load(args.model)
+    if not args.check_only:
+        with open(args.model, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        export(pipeline, out, source_sha256=digest)
+        print(f"✅ Exported {len(pipeline.steps[-1][1].estimators_)} trees to {out} ({os.path.getsize(out):,} bytes)")
+
+    diff = check(pipeline, out)
+    if diff > args.tolerance:
+        print(f"❌ Parity check failed: max |sklearn - numpy| = {diff:.3g}")
+        sys.exit(1)
+    print(f"✅ Parity check passed: max |sklearn - numpy| = {diff:.3g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Streams an OpenFoodFacts export into the local product store.
+
+Supports the JSONL dump (openfoodfacts-products.jsonl[.gz]) and the
+tab-separated CSV export (en.openfoodfacts.org.products.csv[.gz]). Records
+are read one at a time, normalized with the same code path as live barcode
+lookups, and written in batches, so memory stays bounded for multi-gigabyte
+dumps.
+
+Usage (from the backend folder):
+    python ingest_openfoodfacts.py openfoodfacts-products.jsonl.gz
+    python ingest_openfoodfacts.py delta.jsonl.gz --delta
+    python ingest_openfoodfacts.py --reindex   # rebuild the category index only
+    python ingest_openfoodfacts.py --rescore   # recompute base scores after a rules change
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, Optional
+
+from app.resolvers.barcode_resolver import build_product_response
+from app.utils.personalization import BASE_SCORE_VERSION, compute_base_score
+from app.utils.product_store import ProductStore, StoreRow, DEFAULT_STORE_PATH
+
+# CSV columns holding comma-separated tag lists
+CSV_TAG_FIELDS = ['categories_tags', 'allergens_tags', 'traces_tags', 'additives_tags']
+
+
+def open_dump(path: str):
+    """Open a plain or gzip-compressed text dump."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def iter_jsonl(path: str) -> Iterator[Dict]:
+    """One product dict per line of a JSONL dump."""
+    with open_dump(path) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"⚠️ Skipping malformed JSON on line {line_no}")
+
+
+def _csv_row_to_product(row: Dict[str, str]) -> Dict:
+    """Reshape a flat CSV row into the API product structure build_product_response expects."""
+    product = {k: v for k, v in row.items() if v not in (None, '') and not k.endswith('_100g')}
+    product['nutriments'] = {k: v for k, v in row.items() if k.endswith('_100g') and v not in (None, '')}
+
+    # The CSV export names the allergen tag column 'allergens'
+    if not row.get('allergens_tags') and row.get('allergens'):
+        product['allergens_tags'] = row['allergens']
+    for field in CSV_TAG_FIELDS:
+        value = product.get(field)
+        product[field] = [t.strip() for t in value.split(',') if t.strip()] if value else []
+
+    for field in ('image_front_url', 'image_url', 'image_front_small_url'):
+        if field in product and not product[field].startswith('http'):
+            del product[field]
+    return product
+
+
+def iter_csv(path: str) -> Iterator[Dict]:
+    """One product dict per row of the tab-separated CSV export."""
+    # Ingredient texts can exceed the default 128 KB field limit
+    csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+    with open_dump(path) as f:
+        for row in csv.DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+            yield _csv_row_to_product(row)
+
+
+def _to_int(value, default: int = 0) -> int:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def to_store_row(product: Dict) -> Optional[StoreRow]:
+    """Normalize one raw record into a store row, or None if it has no barcode."""
+    barcode = str(product.get('code') or '').strip()
+    if not barcode:
+        return None
+    normalized = build_product_response(product, barcode)
+    brands = product.get('brands') or ''
+    if isinstance(brands, list):
+        brands = ', '.join(brands)
+    return (
+        barcode,
+        normalized.name,
+        brands,
+        json.dumps(normalized.dict()),
+        _to_int(product.get('last_modified_t')),
+        _to_int(product.get('unique_scans_n')),
+    )
+
+
+def ingest(path: str, store: ProductStore, batch_size: int = 5000, delta: bool = False, fmt: Optional[str] = None) -> Dict[str, int]:
+    """
+    Stream a dump into the store.
+
+    Args:
+        delta: Skip records not modified since the newest last_modified_t
+            seen by a previous ingestion.
+        fmt: 'jsonl' or 'csv'; inferred from the file name when omitted.
+    """
+    if fmt is None:
+        fmt = 'csv' if '.csv' in os.path.basename(path) else 'jsonl'
+    records = iter_csv(path) if fmt == 'csv' else iter_jsonl(path)
+
+    previous = _to_int(store.get_meta('max_last_modified_t'))
+    since = previous if delta else 0
+    newest = previous
+    stats = {'read': 0, 'written': 0, 'skipped': 0, 'errors': 0}
+    batch = []
+    started = time.time()
+
+    def _flush():
+        stats['written'] += store.upsert_many(batch)
+        batch.clear()
+        rate = stats['read'] / max(time.time() - started, 1e-6)
+        print(f"💾 {stats['read']:,} read, {stats['written']:,} written ({rate:,.0f} records/s)")
+
+    for product in records:
+        stats['read'] += 1
+        modified = _to_int(product.get('last_modified_t'))
+        if delta and modified <= since:
+            stats['skipped'] += 1
+            continue
+        try:
+            row = to_store_row(product)
+        except Exception as e:
+            stats['errors'] += 1
+            if stats['errors'] <= 10:
+                print(f"⚠️ Could not normalize {product.get('code')}: {e}")
+            continue
+        if row is None:
+            stats['skipped'] += 1
+            continue
+
+        batch.append(row)
+        newest = max(newest, modified)
+        if len(batch) >= batch_size:
+            _flush()
+
+    if batch:
+        _flush()
+    store.set_meta('max_last_modified_t', str(newest))
+    store.set_meta('last_ingested_at', str(int(time.time())))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load an OpenFoodFacts export into the local product store.")
+    parser.add_argument('dump', nargs='?', help="Path to a .jsonl / .csv export (optionally .gz)")
+    parser.add_argument('--store', default=os.getenv("PRODUCT_STORE_PATH", DEFAULT_STORE_PATH), help="SQLite store path")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help="Override format detection")
+    parser.add_argument('--batch-size', type=int, default=5000, help="Rows per insert transaction")
+    parser.add_argument('--delta', action='store_true', help="Only ingest records modified since the last run")
+    parser.add_argument('--reindex', action='store_true', help="Rebuild the category index from stored products")
+    parser.add_argument('--rescore', action='store_true', help="Recompute base scores computed by older scoring rules")
+    args = parser.parse_args()
+    if not args.dump and not args.reindex and not args.rescore:
+        parser.error("a dump path, --reindex or --rescore is required")
+
+    print(f"{'='*20} OPENFOODFACTS INGESTION {'='*20}\n")
+    store = ProductStore(args.store)
+    # Bulk load: trade durability for speed, the dump can simply be re-run
+    store._connect().execute("PRAGMA synchronous=OFF")
+
+    started = time.time()
+    if args.dump:
+        stats = ingest(args.dump, store, batch_size=args.batch_size, delta=args.delta, fmt=args.format)
+        print(f"\n✅ Done in {time.time() - started:.1f}s — {stats['read']:,} read, {stats['written']:,} written, "
+              f"{stats['skipped']:,} skipped, {stats['errors']:,} errors")
+    if args.reindex:
+        indexed = store.rebuild_category_index(batch_size=args.batch_size)
+        print(f"🗂️ Category index rebuilt for {indexed:,} products in {time.time() - started:.1f}s")
+    if args.rescore:
+        rescored = store.rescore(compute_base_score, BASE_SCORE_VERSION, batch_size=args.batch_size)
+        print(f"🧮 Base scores recomputed for {rescored:,} products (rules {BASE_SCORE_VERSION})")
+    print(f"📦 Store now holds {store.count():,} products at {args.store}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the app package the same way the server does (from the backend folder)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
@@ -0,0 +1,70 @@
+import threading
+import time
+
+from app.utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def _tripped(probe, reset_timeout=0.05):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=reset_timeout, probe=probe)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    return breaker
+
+
+def test_success_while_probe_pending_leaves_breaker_closed():
+    calls = []
+    breaker = _tripped(lambda: calls.append(1) or False)
+
+    breaker.record_success()
+    time.sleep(0.3)  # several probe intervals
+
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+    assert calls == []
+
+
+def test_success_during_failing_probe_leaves_breaker_closed():
+    started, release = threading.Event(), threading.Event()
+
+    def probe():
+        started.set()
+        release.wait(2)
+        return False
+
+    breaker = _tripped(probe)
+    assert started.wait(2)
+    assert breaker.state == HALF_OPEN
+
+    breaker.record_success()
+    release.set()
+    time.sleep(0.2)
+
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+
+def test_successful_probe_closes_breaker():
+    breaker = _tripped(lambda: True)
+    time.sleep(0.2)
+    assert breaker.state == CLOSED
+
+
+def test_failing_probe_keeps_breaker_open_and_rejects_requests():
+    breaker = _tripped(lambda: False)
+    time.sleep(0.2)
+    assert breaker.state in (OPEN, HALF_OPEN)
+    assert not breaker.allow_request()
+
+
+def test_breaker_reopened_after_success_probes_again():
+    healthy = threading.Event()
+    breaker = _tripped(healthy.is_set)
+    breaker.record_success()
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    healthy.set()
+    time.sleep(0.2)
+    assert breaker.state == CLOSED
@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+pytest.importorskip("cv2")
+
+from app.models.schemas import ProductResponse
+from app.utils.image_cache import ImageScanCache
+
+
+def _product(product_id):
+    return ProductResponse(product_id=product_id, name=product_id, ingredients=[], nutrition={},
+                           additives=[], data_sources=['test'])
+
+
+def test_expired_closest_match_falls_back_to_live_match():
+    cache = ImageScanCache(max_distance=6, ttl=60)
+    cache.put('exact', 0b0, _product('stale'))
+    cache.put('near', 0b111, _product('live'))
+    # Age the closer entry past the TTL
+    phash, product, _ = cache._entries['exact']
+    cache._entries['exact'] = (phash, product, time.time() - 120)
+
+    hit = cache.get_similar(0b0)
+
+    assert hit is not None and hit.product_id == 'live'
+    assert 'exact' not in cache._entries
+
+
+def test_only_expired_matches_is_a_miss_and_evicts_them():
+    cache = ImageScanCache(max_distance=6, ttl=60)
+    cache.put('a', 0b1, _product('a'))
+    cache._entries['a'] = (0b1, cache._entries['a'][1], time.time() - 120)
+
+    assert cache.get_similar(0b1) is None
+    assert len(cache) == 0
+
+
+def test_closest_live_match_wins():
+    cache = ImageScanCache(max_distance=6)
+    cache.put('far', 0b11111, _product('far'))
+    cache.put('close', 0b1, _product('close'))
+    cache.put('other', (1 << 63) | 0b1111111, _product('other'))
+
+    assert cache.get_similar(0b0).product_id == 'close'
+    # At least 56 bits away from every entry
+    assert cache.get_similar((1 << 64) - 1) is None
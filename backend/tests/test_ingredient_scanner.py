@@ -0,0 +1,72 @@
+import pytest
+
+from app.utils.ingredient_scanner import get_ingredient_scanner, merge_ingredient_findings, normalize_text
+
+
+@pytest.fixture(scope="module")
+def scan():
+    return get_ingredient_scanner().scan
+
+
+def test_normalize_text():
+    assert normalize_text("Farine de Blé (12%)") == "farine de ble 12"
+
+
+@pytest.mark.parametrize("text, allergens", [
+    ("Peanut-free, milk chocolate (sugar, cocoa butter)", ['en:milk']),
+    ("Nut free, soy free, dairy free bar", []),
+    ("Milk-free chocolate, egg free", []),
+    ("Free from milk", []),
+    ("Free from eggs and soy, wheat flour", ['en:gluten']),
+    # A bare list after "free from" only clears its first item (commas are lost)
+    ("Free from milk, eggs", ['en:eggs']),
+    ("Farine de blé, sans lait", ['en:gluten']),
+    ("Ohne Milch, Weizenmehl", ['en:gluten']),
+    ("Sin gluten, leche", ['en:milk']),
+    ("Noodles (wheat), no milk or eggs", ['en:gluten']),
+    # Oats sit under en:gluten in the taxonomy
+    ("Gluten free oats", ['en:gluten']),
+])
+def test_free_from_claims_are_not_allergens(scan, text, allergens):
+    assert scan(text)['allergens'] == allergens
+
+
+@pytest.mark.parametrize("text, allergens, traces", [
+    ("Farine de blé, sel. May contain nuts", ['en:gluten'], ['en:nuts']),
+    ("Sugar, cocoa. Peut contenir des traces de lait et d'arachides", [], ['en:milk', 'en:peanuts']),
+    # Declared as an ingredient: not repeated as a trace
+    ("Whole milk powder. May contain milk", ['en:milk'], []),
+])
+def test_traces_after_may_contain(scan, text, allergens, traces):
+    found = scan(text)
+    assert found['allergens'] == allergens
+    assert found['traces'] == traces
+
+
+@pytest.mark.parametrize("text", [
+    "Coconut milk, sugar",
+    "Lait de coco, noix de muscade",
+    "Cocoa butter, shea butter, cream of tartar",
+])
+def test_allergen_lookalikes_are_ignored(scan, text):
+    assert scan(text)['allergens'] == []
+
+
+def test_milk_chocolate_and_hazelnuts(scan):
+    assert scan("Milk chocolate, hazelnuts")['allergens'] == ['en:milk', 'en:nuts']
+
+
+def test_additives_by_code_and_name(scan):
+    found = scan("Emulsifier (E 322i), acid: citric acid, E3301 colour")['additives']
+    assert found[0] == 'E322I'
+    assert 'E330' in found
+    # Longer numbers are not a prefix match
+    assert all(not code.startswith('E3301') for code in found)
+
+
+def test_merge_keeps_declared_values_and_skips_free_from():
+    allergens, traces, additives = merge_ingredient_findings(
+        "Peanut-free. Milk chocolate, soy lecithin", ['en:soybeans'], [], ['E322'])
+    assert allergens == ['en:soybeans', 'en:milk']
+    assert 'en:peanuts' not in allergens
+    assert additives == ['E322']
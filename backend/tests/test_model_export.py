@@ -0,0 +1,36 @@
+import hashlib
+import os
+
+import pytest
+
+pytest.importorskip("sklearn")
+pytest.importorskip("pandas")
+joblib = pytest.importorskip("joblib")
+
+import export_model
+
+BACKEND = os.path.join(os.path.dirname(__file__), '..')
+MODEL_PATH = os.path.join(BACKEND, 'personalization_model.pkl')
+EXPORT_PATH = os.path.join(BACKEND, 'personalization_model.npz')
+
+
+@pytest.fixture(scope="module")
+def pipeline():
+    return joblib.load(MODEL_PATH)
+
+
+def test_bundled_export_matches_sklearn(pipeline):
+    assert export_model.check(pipeline, EXPORT_PATH) <= 1e-9
+
+
+def test_bundled_export_was_made_from_bundled_model():
+    from app.utils.tree_model import TreeEnsembleModel
+    with open(MODEL_PATH, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    assert TreeEnsembleModel.load(EXPORT_PATH).source_sha256 == digest
+
+
+def test_fresh_export_matches_sklearn(pipeline, tmp_path):
+    path = str(tmp_path / 'model.npz')
+    export_model.export(pipeline, path)
+    assert export_model.check(pipeline, path) <= 1e-9